@@ -0,0 +1,602 @@
+"""Offline timing benchmark for the Drive CSV merge pipeline.
+
+Generates synthetic Plex exports, runs the merge pipeline against an in-memory stand-in for
+Drive (or LocalCsvStore) and reports wall time, bytes and memory. The behaviour checks live in
+test_sync.py, which reuses the generators and the fake Drive defined here.
+
+Usage:
+    python benchmark_merge.py merge [history_rows] [new_rows]
+    python benchmark_merge.py dates [n_values]
+    python benchmark_merge.py clean [n_rows]
+    python benchmark_merge.py partition [history_rows] [new_rows]
+    python benchmark_merge.py memory [n_rows]
+    python benchmark_merge.py formats [history_rows] [new_rows]
+    python benchmark_merge.py parallel [n_rows] [workers]
+    python benchmark_merge.py store [history_rows] [new_rows]
+    python benchmark_merge.py suite [sizes] [--baseline PATH] [--save-baseline] [--no-memory] [--repeats N]
+"""
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import google_drive_utils as gdu
+
+
+PRODUCTION_HEADER = ["Date", "Part No", "Revision", "Workcenter", "Quantity", "Note"]
+SCRAP_HEADER = ["Report Date", "Part No", "Revision", "Workcenter", "Scrap Reason", "Quantity",
+                "Unit Cost", "Extended Cost", "Comments"]
+SCRAP_REASONS = ["Flash", "Short Shot", "Porosity", "Dimensional", "Contamination", "Setup"]
+
+
+def make_rows(n, start, days, seed=0, kind="production"):
+    """Return n Plex-shaped production or scrap rows spread across `days` days from `start`, oldest first.
+
+    Dates are zero-padded "%m/%d/%Y, %I:%M %p" and some cells span several lines (with \\r\\n,
+    commas and quotes inside) like the free-text columns of the real exports.
+    """
+    rnd = random.Random(seed)
+    stamps = sorted(start + timedelta(days=rnd.randrange(days), minutes=rnd.randrange(24 * 60)) for _ in range(n))
+    rows = []
+    for i, ts in enumerate(stamps):
+        date_txt = ts.strftime("%m/%d/%Y, %I:%M %p")
+        part, rev, wc = f"P{rnd.randrange(400):05d}", f"{rnd.randrange(3):02d}", f"WC-{rnd.randrange(30)}"
+        qty = rnd.randrange(1, 500)
+        if kind == "scrap":
+            note = 'Rebaba en "labio"\r\nretrabajo, turno B' if i % 25 == 0 else ""
+            cost = rnd.randrange(5, 5000) / 100
+            rows.append([date_txt, part, rev, wc, rnd.choice(SCRAP_REASONS), str(qty),
+                         f"{cost:.2f}", f"{cost * qty:.2f}", note])
+        else:
+            note = "Linea 1\nturno B, paro 15 min" if i % 50 == 0 else ""
+            rows.append([date_txt, part, rev, wc, str(qty), note])
+    return rows
+
+
+def to_csv_text(rows, kind="production", bom=False, lineterminator="\n", header=None):
+    """CSV text of rows under the report's header (or `header`).
+
+    Plex downloads exports with a BOM and \\r\\n line endings (bom=True, lineterminator="\\r\\n").
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator=lineterminator)
+    writer.writerow(header or (SCRAP_HEADER if kind == "scrap" else PRODUCTION_HEADER))
+    writer.writerows(rows)
+    return ("\ufeff" if bom else "") + buf.getvalue()
+
+
+def _write_text(path, text):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
+    return path
+
+
+class _FakeDrive:
+    """In-memory stand-in for google_drive_utils' Drive calls.
+
+    patches() maps each replaced function to its fake; as a with-block it patches them itself.
+    """
+
+    def __init__(self, files):
+        self.files = dict(files)
+        self.versions = {file_id: 1 for file_id in files}
+        self.properties = {}
+        self.created = []
+        self.downloads = 0
+        self.uploads = 0
+
+    def _metadata(self, file_id):
+        data = self.files.get(file_id, "")
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        return {"id": file_id, "name": f"{file_id}.csv", "version": str(self.versions.get(file_id, 1)),
+                "md5Checksum": hashlib.md5(data).hexdigest(),
+                "appProperties": dict(self.properties.get(file_id, {}))}
+
+    def _set_app_properties(self, file_id, properties):
+        self.properties.setdefault(file_id, {}).update(properties)
+
+    def _create(self, name, fh, size, sibling_file_id, mimetype="text/csv"):
+        self.created.append(name)
+        self.files[name] = ""
+        self._upload_stream(name, fh, size, mimetype)
+        return name
+
+    def _find(self, name, sibling_file_id):
+        return name if name in self.files else None
+
+    def _download_to(self, file_id, fh):
+        data = self._download(file_id).encode("utf-8")
+        fh.write(data)
+        return len(data)
+
+    def _download(self, file_id):
+        self.downloads += 1
+        return self.files[file_id]
+
+    def _iter_download(self, file_id, chunk_size=None):
+        text = self._download(file_id)
+        if text.startswith("\ufeff"):
+            text = text[1:]
+        step = chunk_size or gdu._CSV_CHUNK_SIZE
+        for i in range(0, len(text), step):
+            yield text[i:i + step]
+
+    def _upload_stream(self, file_id, fh, size, mimetype="text/csv"):
+        data = fh.read()
+        if len(data) != size:
+            raise AssertionError(f"size {size} != {len(data)} bytes")
+        if mimetype in ("text/csv", "application/json"):
+            data = data.decode("utf-8")
+        return self._upload(file_id, data)
+
+    def _upload(self, file_id, text):
+        self.uploads += 1
+        self.files[file_id] = text
+        self.versions[file_id] = self.versions.get(file_id, 1) + 1
+        return self._metadata(file_id)
+
+    def patches(self):
+        return {
+            "download_csv_text": self._download, "iter_download_text": self._iter_download,
+            "download_file_to": self._download_to, "upload_csv_text": self._upload,
+            "upload_csv_stream": self._upload_stream, "create_file_stream": self._create,
+            "find_sibling_file": self._find, "get_file_metadata": self._metadata,
+            "set_app_properties": self._set_app_properties, "_log": lambda msg: None,
+        }
+
+    def __enter__(self):
+        patches = self.patches()
+        self._saved = {name: getattr(gdu, name) for name in patches}
+        for name, fn in patches.items():
+            setattr(gdu, name, fn)
+        return self
+
+    def __exit__(self, *exc):
+        for name, fn in self._saved.items():
+            setattr(gdu, name, fn)
+
+
+@contextlib.contextmanager
+def _settings(**env):
+    """Set environment variables (None removes one) and silence the logs for a with-block."""
+    saved = {name: os.environ.get(name) for name in env}
+    original_log, gdu._log = gdu._log, lambda msg: None
+    try:
+        for name, value in env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        yield
+    finally:
+        gdu._log = original_log
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - t0
+
+
+def run_merge(history_rows=200000, new_rows=5000):
+    """Time a full merge, one through the date index and local cache, and a repeated export."""
+    today = datetime(2025, 11, 20)
+    history = to_csv_text(make_rows(history_rows, today - timedelta(days=700), 700, seed=1))
+    with tempfile.TemporaryDirectory() as tmp:
+        new_path = _write_text(os.path.join(tmp, "production.csv"),
+                               to_csv_text(make_rows(new_rows, today - timedelta(days=7), 7, seed=2), bom=True))
+        next_path = _write_text(os.path.join(tmp, "production-next.csv"),
+                                to_csv_text(make_rows(new_rows, today - timedelta(days=6), 7, seed=3), bom=True))
+        with _settings(DRIVE_CACHE_DIR=os.path.join(tmp, "cache")), _FakeDrive({"bench": history}):
+            cold = _timed(gdu.update_drive_csv_file, "bench", new_path, "Date")
+            warm = _timed(gdu.update_drive_csv_file, "bench", next_path, "Date")
+            noop = _timed(gdu.update_drive_csv_file, "bench", next_path, "Date")
+        with _settings(DRIVE_DATE_INDEX="off"), _FakeDrive({"bench": history}):
+            full = _timed(gdu.update_drive_csv_file, "bench", next_path, "Date")
+    print(f"Filas: historial={history_rows} nuevas={new_rows}")
+    print(f"Merge completo:             {cold:.2f}s")
+    print(f"Con índice de fechas:       {warm:.2f}s (sin índice {full:.2f}s, {full / warm:.1f}x)")
+    print(f"Mismo export repetido:      {noop:.2f}s")
+
+
+def run_dates(n_rows=1000000):
+    """Time _normalize_date_for_key against the memoized key engine on n_rows values."""
+    values = [r[0] for r in make_rows(n_rows, datetime(2025, 11, 13), 7, seed=3)]
+    print(f"Valores: {n_rows} ({len(set(values))} distintos)")
+    legacy = _timed(lambda: [gdu._normalize_date_for_key(v, True) for v in values])
+    engine = _timed(lambda: list(map(gdu._build_date_key_fn(values[:gdu._DATE_SNIFF_SAMPLE], True), values)))
+    print(f"_normalize_date_for_key: {legacy:.2f}s")
+    print(f"_build_date_key_fn:      {engine:.2f}s ({legacy / engine:.1f}x)")
+
+
+def _legacy_clean_csv_line_breaks(csv_text):
+    """Regex cleaner that google_drive_utils used before the streaming state machine."""
+    def replace_breaks(match):
+        return '"' + ' '.join(match.group(1).split()) + '"'
+    return re.sub(r'"([^"]*(?:[\n\r]+[^"]*)*)"', replace_breaks, csv_text)
+
+
+def run_clean(n_rows=200000):
+    """Time the streaming cleaner against the legacy regex and its scaling on adversarial input."""
+    text = to_csv_text(make_rows(n_rows, datetime(2025, 1, 1), 300, seed=4))
+    legacy = _timed(_legacy_clean_csv_line_breaks, text)
+    engine = _timed(lambda: "".join(gdu._iter_clean_csv_lines([text])))
+    print(f"Export de {n_rows} filas: regex {legacy:.2f}s, streaming {engine:.2f}s")
+
+    # Comilla sin cerrar seguida de muchos saltos de línea: el regex retrocede exponencialmente
+    timings = []
+    for n in (100000, 200000, 400000, 800000):
+        adversarial = '"' + 'a\n' * n
+        chunks = [adversarial[i:i + 65536] for i in range(0, len(adversarial), 65536)]
+        timings.append(_timed(lambda: all(True for _ in gdu._iter_clean_csv_lines(chunks))))
+        print(f"Adversarial n={n}: {timings[-1]:.3f}s")
+    print(f"Crecimiento x{timings[-1] / max(timings[0], 1e-9):.1f} para x8 de entrada")
+
+
+class _RecordingStore(gdu.LocalCsvStore):
+    """LocalCsvStore that records how many bytes each upload/create wrote."""
+
+    def __init__(self, root_dir):
+        super().__init__(root_dir)
+        self.written = {}
+
+    def upload(self, file_id, text):
+        self.written[file_id] = len(text.encode("utf-8"))
+        super().upload(file_id, text)
+
+
+def run_partition(history_rows=200000, new_rows=5000):
+    """Time the one-time split and a monthly partitioned sync on LocalCsvStore, and the bytes it uploads."""
+    today = datetime(2025, 11, 20)
+    history = to_csv_text(make_rows(history_rows, today - timedelta(days=700), 700, seed=1))
+    with tempfile.TemporaryDirectory() as tmp, _settings():
+        new_path = _write_text(os.path.join(tmp, "production.csv"),
+                               to_csv_text(make_rows(new_rows, today - timedelta(days=7), 7, seed=2), bom=True))
+        store = gdu.LocalCsvStore(os.path.join(tmp, "drive"))
+        store.upload("history", history)
+        t0 = time.perf_counter()
+        manifest_id = gdu.split_drive_history("history", "Date", "production", store=store)
+        split_s = time.perf_counter() - t0
+
+        store = _RecordingStore(store.root_dir)
+        elapsed = _timed(gdu.update_drive_partitioned, manifest_id, new_path, "Date", "production", store=store)
+        manifest = json.loads(store.download(manifest_id))
+    full_bytes = len(history.encode("utf-8"))
+    print(f"Particiones: {len(manifest['partitions'])}, reescritas: {len(store.written) - 1} (+ manifiesto)")
+    print(f"Tiempo split_drive_history: {split_s:.2f}s, update_drive_partitioned: {elapsed:.2f}s")
+    print(f"Bytes subidos: {sum(store.written.values())} vs {full_bytes} reescribiendo todo el historial")
+
+
+def run_memory(n_rows=200000):
+    """Compare the memory of list-of-dict rows against CsvTable for the same export."""
+    text = to_csv_text(make_rows(n_rows, datetime(2025, 1, 1), 300, seed=5))
+    with _settings():
+        results = {}
+        readers = (
+            ("dict por fila", lambda t: [dict(r) for r in csv.DictReader(gdu._iter_clean_csv_lines([t]))]),
+            ("CsvTable", gdu._read_csv_to_table),
+        )
+        for label, read in readers:
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            parsed = read(text)
+            elapsed = time.perf_counter() - t0
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[label] = current
+            print(f"{label:>14}: {current / 2**20:7.1f} MB retenidos, pico {peak / 2**20:7.1f} MB, {elapsed:.2f}s")
+            del parsed
+    print(f"CsvTable usa {results['CsvTable'] / results['dict por fila']:.0%} de la memoria")
+
+
+def run_formats(history_rows=200000, new_rows=5000):
+    """Time publishing the gzip/Parquet copies on a full and on an indexed merge."""
+    today = datetime(2025, 11, 20)
+    history = to_csv_text(make_rows(history_rows, today - timedelta(days=700), 700, seed=1))
+    formats = "gzip,parquet" if gdu.pa is not None else "gzip"
+    with tempfile.TemporaryDirectory() as tmp:
+        with _settings(DRIVE_CACHE_DIR=os.path.join(tmp, "cache"), DRIVE_EXTRA_FORMATS=formats), \
+                _FakeDrive({"bench": history}) as drive:
+            for step in range(2):
+                new_path = _write_text(os.path.join(tmp, f"production-{step}.csv"), to_csv_text(
+                    make_rows(new_rows, today - timedelta(days=7 - step), 7, seed=2 + step), bom=True))
+                elapsed = _timed(gdu.update_drive_csv_file, "bench", new_path, "Date")
+                sizes = [f"CSV {len(drive.files['bench'].encode('utf-8')) / 2**20:.1f} MB",
+                         f"gzip {len(drive.files['bench.csv.gz']) / 2**20:.1f} MB"]
+                if gdu.pa is not None:
+                    sizes.append(f"Parquet {len(drive.files['bench.parquet']) / 2**20:.1f} MB")
+                print(f"{'índice' if step else 'completo'}: {elapsed:.2f}s, {', '.join(sizes)}")
+    if gdu.pa is None:
+        print("(pyarrow no instalado: Parquet omitido)")
+
+
+def run_store(history_rows=200000, new_rows=5000):
+    """Time syncs through the SQLite history store: initial load, up to date, new column and no changes."""
+    today = datetime(2025, 11, 20)
+    history = to_csv_text(make_rows(history_rows, today - timedelta(days=700), 700, seed=1))
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "history.sqlite")
+        with _settings(DRIVE_CACHE_DIR=os.path.join(tmp, "cache"), DRIVE_HISTORY_DB=db_path), \
+                _FakeDrive({"bench": history}):
+            # (etapa, días hacia atrás del export, semilla, con columna Shift)
+            steps = [("carga inicial", 7, 2, False), ("base al día", 6, 3, False), ("columna nueva", 5, 4, True),
+                     ("sin cambios", 5, 4, True)]
+            for step, (label, back, seed, shift) in enumerate(steps):
+                rows = [row + [str(i % 3 + 1)] * shift
+                        for i, row in enumerate(make_rows(new_rows, today - timedelta(days=back), 7, seed=seed))]
+                new_path = _write_text(os.path.join(tmp, f"production-{step}.csv"), to_csv_text(
+                    rows, header=PRODUCTION_HEADER + ["Shift"] * shift, bom=True))
+                elapsed = _timed(gdu.update_drive_csv_file, "bench", new_path, "Date", report="production")
+                print(f"{label}: {elapsed:.2f}s")
+            (info,) = gdu.HistoryStore(db_path).reports()
+        print(f"Base: {info['rows']} filas de {info['first']} a {info['last']}, "
+              f"{os.path.getsize(db_path) / 2**20:.1f} MB")
+
+
+SUITE_SIZES = (10000, 100000, 1000000)
+SUITE_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+SUITE_TIME_TOLERANCE = 0.50
+SUITE_MEMORY_TOLERANCE = 0.15
+SUITE_MIN_SECONDS = 0.25
+SUITE_REPEATS = 3
+
+
+def _suite_cases(ctx):
+    """(name, setup) pairs; setup() returns the zero-argument call to measure."""
+    date_column = ctx["date_column"]
+
+    def rows():
+        table = gdu._read_csv_to_table(ctx["history"])
+        fieldnames, dicts = table.fieldnames, table.to_dicts()
+        return lambda: gdu._write_rows_to_csv_text(fieldnames, dicts)
+
+    def table():
+        parsed = gdu._read_csv_to_table(ctx["history"])
+        return lambda: gdu._write_table_to_csv_text(parsed)
+
+    def merge_tables():
+        old = gdu._read_csv_to_table(ctx["history"])
+        new = gdu._read_csv_file_to_table(ctx["new_path"])
+        return lambda: gdu.merge_tables_by_date(old, new, date_column)
+
+    return [
+        ("_clean_csv_line_breaks", lambda: lambda: gdu._clean_csv_line_breaks(ctx["history"])),
+        ("_read_csv_to_rows", lambda: lambda: gdu._read_csv_to_rows(ctx["history"])),
+        ("_read_csv_to_table", lambda: lambda: gdu._read_csv_to_table(ctx["history"])),
+        ("_normalize_date_for_key", lambda: lambda: [gdu._normalize_date_for_key(v, True) for v in ctx["dates"]]),
+        ("_build_date_key_fn", lambda: lambda: list(map(
+            gdu._build_date_key_fn(ctx["dates"][:gdu._DATE_SNIFF_SAMPLE], True), ctx["dates"]))),
+        ("merge_csv_by_date", lambda: lambda: gdu.merge_csv_by_date(ctx["history"], ctx["new_path"], date_column)),
+        ("merge_tables_by_date", merge_tables),
+        ("_write_rows_to_csv_text", rows),
+        ("_write_table_to_csv_text", table),
+    ]
+
+
+def _suite_context(kind, n, tmp):
+    """Synthetic history of n rows plus a new export (written into tmp) for _suite_cases."""
+    date_column = "Report Date" if kind == "scrap" else "Date"
+    today = datetime(2025, 11, 20)
+    history = to_csv_text(make_rows(n, today - timedelta(days=700), 700, seed=11, kind=kind), kind, bom=True,
+                          lineterminator="\r\n")
+    new_path = os.path.join(tmp, f"{kind}.csv")
+    new_rows = make_rows(max(n // 40, 100), today - timedelta(days=7), 7, seed=12, kind=kind)
+    with open(new_path, "w", encoding="utf-8", newline="") as f:
+        f.write(to_csv_text(new_rows, kind, bom=True, lineterminator="\r\n"))
+    return {
+        "history": history,
+        "new_path": new_path,
+        "date_column": date_column,
+        "dates": gdu._read_csv_to_table(history).column(date_column),
+    }
+
+
+def _calibrate():
+    """Seconds this machine takes for a fixed csv/str workload, to compare timings across machines."""
+    data = [[str(i), f"P{i % 400:05d}", "01", f"WC-{i % 30}", f"{i % 7}/{i % 28 + 1}/2025"] for i in range(50000)]
+    best = float("inf")
+    for _ in range(10):
+        t0 = time.perf_counter()
+        buf = io.StringIO()
+        csv.writer(buf).writerows(data)
+        parsed = list(csv.reader(io.StringIO(buf.getvalue())))
+        sorted({row[4].split("/")[0].zfill(2) for row in parsed})
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _measure(setup, repeats, memory):
+    """Best wall time of `repeats` calls and, with memory=True, the tracemalloc peak of one more."""
+    call = setup()
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = call()
+        best = min(best, time.perf_counter() - t0)
+        del result
+    peak = None
+    if memory:
+        tracemalloc.start()
+        result = call()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del result
+    return best, peak
+
+
+def run_parallel(n_rows=300000, workers=0):
+    """Time parsing an export serially and with CSV_PARSE_WORKERS processes."""
+    workers = workers or max(os.cpu_count() or 1, 2)
+    rows = make_rows(n_rows, datetime(2025, 1, 1), 300, seed=13, kind="scrap")
+    text = to_csv_text(rows, "scrap", bom=True, lineterminator="\r\n")
+    with _settings(CSV_PARSE_WORKERS=None, CSV_PARSE_PARALLEL_MIN_MB="0"):
+        serial_s = _timed(lambda: gdu._table_date_keys(gdu._read_csv_to_table(text), "Report Date", True))
+    with _settings(CSV_PARSE_WORKERS=str(workers), CSV_PARSE_PARALLEL_MIN_MB="0"):
+        parallel_s = _timed(gdu._read_csv_to_table, text, "Report Date", True)
+    print(f"{len(text.encode('utf-8')) / 2**20:.1f} MB, {n_rows} filas, {os.cpu_count()} CPUs")
+    print(f"Serial (parseo + claves):  {serial_s:.2f}s")
+    print(f"{workers} procesos:             {parallel_s:.2f}s ({serial_s / parallel_s:.1f}x)")
+
+
+def run_suite(argv):
+    """Time and measure the merge engine functions on production and scrap exports of several sizes.
+
+    python benchmark_merge.py suite [10000,100000,1000000] [--baseline PATH] [--save-baseline] [--no-memory]
+                                    [--repeats N]
+
+    Every case takes the best of N runs (SUITE_REPEATS) and times are divided by a calibration
+    workload (the best of one run before and one after the cases) before comparing with the
+    baseline, so it can be recorded on one machine and checked on another; memory (tracemalloc
+    peak) is compared as is. A case over the time tolerance is measured again before counting as
+    a regression, so one noisy run can't fail the check. Exits with an error listing every
+    regression and every case missing from the baseline.
+    --save-baseline updates the baseline with the sizes just run and keeps the others.
+    """
+    args = list(argv)
+    baseline_path = SUITE_BASELINE
+    if "--baseline" in args:
+        i = args.index("--baseline")
+        baseline_path = args[i + 1]
+        del args[i:i + 2]
+    repeats = SUITE_REPEATS
+    if "--repeats" in args:
+        i = args.index("--repeats")
+        repeats = int(args[i + 1])
+        del args[i:i + 2]
+    save = "--save-baseline" in args
+    memory = "--no-memory" not in args
+    args = [a for a in args if not a.startswith("--")]
+    sizes = [int(s) for s in args[0].split(",")] if args else list(SUITE_SIZES)
+
+    calibration = _calibrate()
+    print(f"Calibración: {calibration * 1000:.1f} ms")
+    results = {}
+    original_log = gdu._log
+    gdu._log = lambda msg: None
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for kind in ("production", "scrap"):
+                for n in sizes:
+                    ctx = _suite_context(kind, n, tmp)
+                    history = ctx["history"]
+                    print(f"\n{kind} {n} filas ({len(history.encode('utf-8')) / 2**20:.1f} MB)")
+                    for name, setup in _suite_cases(ctx):
+                        seconds, peak = _measure(setup, repeats, memory)
+                        results[f"{kind}/{n}/{name}"] = {
+                            "seconds": round(seconds, 4),
+                            "peak_mb": round(peak / 2**20, 1) if peak is not None else None,
+                        }
+                        mem_txt = f"{peak / 2**20:9.1f} MB" if peak is not None else ""
+                        print(f"  {name:<26}{seconds:9.3f}s{mem_txt}")
+                    del ctx, history
+    finally:
+        gdu._log = original_log
+    calibration = min(calibration, _calibrate())
+    for got in results.values():
+        got["relative"] = round(got["seconds"] / calibration, 2)
+
+    if save:
+        saved = {}
+        if os.path.isfile(baseline_path):
+            with open(baseline_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)["results"]
+        saved.update(results)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump({"calibration_s": round(calibration, 4), "python": sys.version.split()[0],
+                       "results": saved}, f, indent=1, sort_keys=True)
+            f.write("\n")
+        print(f"\n✓ Línea base guardada en {baseline_path}")
+        return
+
+    if not os.path.isfile(baseline_path):
+        print(f"\nSin línea base en {baseline_path} (usa --save-baseline para crearla)")
+        return
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    def too_slow(key):
+        got, base = results[key], baseline[key]
+        return (got["seconds"] >= SUITE_MIN_SECONDS
+                and got["relative"] > base["relative"] * (1 + SUITE_TIME_TOLERANCE))
+
+    missing = sorted(key for key in results if key not in baseline)
+    slow = [key for key in results if key in baseline and too_slow(key)]
+    if slow:
+        # Una sola medición ruidosa no basta: se repiten los casos lentos con una calibración nueva
+        print(f"\nRepitiendo {len(slow)} casos sobre la tolerancia...")
+        _remeasure(results, slow, repeats, min(calibration, _calibrate()))
+    regressions = []
+    for key, got in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if too_slow(key):
+            regressions.append(f"{key}: {got['relative']:.2f} vs {base['relative']:.2f} (tiempo relativo)")
+        if (got["peak_mb"] is not None and base.get("peak_mb")
+                and got["peak_mb"] > base["peak_mb"] * (1 + SUITE_MEMORY_TOLERANCE) + 1):
+            regressions.append(f"{key}: {got['peak_mb']:.1f} MB vs {base['peak_mb']:.1f} MB (memoria)")
+    problems = ["✗ Regresiones frente a la línea base:\n  " + "\n  ".join(regressions)] if regressions else []
+    if missing:
+        problems.append(f"✗ {len(missing)} casos sin línea base en {baseline_path} (usa --save-baseline):\n  "
+                        + "\n  ".join(missing))
+    if problems:
+        raise SystemExit("\n".join(problems))
+    print(f"\n✓ {len(results)} casos dentro de la tolerancia de la línea base")
+
+
+def _remeasure(results, keys, repeats, calibration):
+    """Time the cases at keys ("kind/rows/name") again and keep the faster result of each."""
+    original_log = gdu._log
+    gdu._log = lambda msg: None
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for kind, n in sorted({tuple(key.split("/")[:2]) for key in keys}):
+                ctx = _suite_context(kind, int(n), tmp)
+                for name, setup in _suite_cases(ctx):
+                    if f"{kind}/{n}/{name}" not in keys:
+                        continue
+                    seconds, _ = _measure(setup, repeats, memory=False)
+                    got = results[f"{kind}/{n}/{name}"]
+                    got["seconds"] = round(min(got["seconds"], seconds), 4)
+                    got["relative"] = round(got["seconds"] / calibration, 2)
+                    print(f"  {kind + '/' + n + '/' + name:<48}{got['seconds']:9.3f}s")
+    finally:
+        gdu._log = original_log
+
+
+if __name__ == "__main__":
+    mode = sys.argv[1] if len(sys.argv) > 1 else "merge"
+    if mode == "suite":
+        run_suite(sys.argv[2:])
+        sys.exit(0)
+    args = [int(a) for a in sys.argv[2:4]]
+    if mode == "dates":
+        run_dates(*args)
+    elif mode == "clean":
+        run_clean(*args)
+    elif mode == "partition":
+        run_partition(*args)
+    elif mode == "memory":
+        run_memory(*args)
+    elif mode == "formats":
+        run_formats(*args)
+    elif mode == "parallel":
+        run_parallel(*args)
+    elif mode == "store":
+        run_store(*args)
+    else:
+        run_merge(*args)
@@ -1,17 +1,47 @@
+import codecs
+import contextlib
 import csv
+import glob
+import gzip
+import hashlib
 import io
+import itertools
+import multiprocessing
 import os
+import pickle
+import random
 import re
-from typing import List, Dict, Optional, Tuple
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Tuple
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
+import httplib2
 from google.oauth2.service_account import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
-from datetime import datetime
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest, MediaIoBaseDownload, MediaIoBaseUpload
+from datetime import date, datetime
 import json
 import base64
 
+from history_store import HistoryStore, supports_fieldnames
+from run_metrics import current_span, span
+
+# Parquet artifact (optional)
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except Exception:
+    pa = None
+
 
 def _log(msg: str) -> None:
     from datetime import datetime as _dt
@@ -19,82 +49,269 @@ def _log(msg: str) -> None:
     print(f"[Drive {_dt.now().strftime('%H:%M:%S')}] {msg}")
 
 
-def get_drive_service():
-    """Create and return an authenticated Google Drive service using a Service Account.
+_DRIVE_SCOPES = ["https://www.googleapis.com/auth/drive"]
+_DRIVE_HTTP_TIMEOUT = 120
+
+# Process-wide Drive client: credentials and service are built once and shared by every sync
+_drive_lock = threading.Lock()
+_drive_credentials = None
+_drive_service = None
+_drive_generation = 0
+_drive_http = threading.local()
+_drive_metrics: Dict[str, float] = {"startup_s": 0.0, "calls": 0, "call_s_total": 0.0, "call_s_max": 0.0}
+
+
+def _load_drive_credentials():
+    """Load Service Account credentials.
 
     Supports three methods (in order):
     - GOOGLE_CREDENTIALS_JSON: full JSON content of the service account.
     - GOOGLE_CREDENTIALS_B64: same JSON, base64-encoded.
     - GOOGLE_APPLICATION_CREDENTIALS: path to the JSON key file.
     """
-    scopes = ["https://www.googleapis.com/auth/drive"]
-
     info_json = os.getenv("GOOGLE_CREDENTIALS_JSON")
     info_b64 = os.getenv("GOOGLE_CREDENTIALS_B64")
     creds_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 
-    creds = None
     if info_json:
         try:
             info = json.loads(info_json)
-            creds = Credentials.from_service_account_info(info, scopes=scopes)
+            return Credentials.from_service_account_info(info, scopes=_DRIVE_SCOPES)
         except Exception as e:
             raise RuntimeError(f"GOOGLE_CREDENTIALS_JSON inválido: {e}")
     elif info_b64:
         try:
             decoded = base64.b64decode(info_b64)
             info = json.loads(decoded)
-            creds = Credentials.from_service_account_info(info, scopes=scopes)
+            return Credentials.from_service_account_info(info, scopes=_DRIVE_SCOPES)
         except Exception as e:
             raise RuntimeError(f"GOOGLE_CREDENTIALS_B64 inválido: {e}")
-    else:
-        if not creds_path or not os.path.isfile(creds_path):
-            raise RuntimeError(
-                "Configura GOOGLE_CREDENTIALS_JSON (o GOOGLE_CREDENTIALS_B64) o un archivo en GOOGLE_APPLICATION_CREDENTIALS"
+    if not creds_path or not os.path.isfile(creds_path):
+        raise RuntimeError(
+            "Configura GOOGLE_CREDENTIALS_JSON (o GOOGLE_CREDENTIALS_B64) o un archivo en GOOGLE_APPLICATION_CREDENTIALS"
+        )
+    return Credentials.from_service_account_file(creds_path, scopes=_DRIVE_SCOPES)
+
+
+class _TimedAuthorizedHttp(AuthorizedHttp):
+    """AuthorizedHttp that records the latency of every Drive HTTP call in _drive_metrics."""
+
+    def request(self, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return super().request(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - t0
+            with _drive_lock:
+                _drive_metrics["calls"] += 1
+                _drive_metrics["call_s_total"] += elapsed
+                _drive_metrics["call_s_max"] = max(_drive_metrics["call_s_max"], elapsed)
+
+
+def _thread_http() -> AuthorizedHttp:
+    # httplib2.Http is not thread-safe: each thread keeps its own keep-alive connections
+    if getattr(_drive_http, "generation", None) != _drive_generation:
+        _drive_http.http = _TimedAuthorizedHttp(_drive_credentials, http=httplib2.Http(timeout=_DRIVE_HTTP_TIMEOUT))
+        _drive_http.generation = _drive_generation
+    return _drive_http.http
+
+
+def _build_drive_request(http, *args, **kwargs) -> HttpRequest:
+    """requestBuilder for the shared service: run every request on the calling thread's transport."""
+    return HttpRequest(_thread_http(), *args, **kwargs)
+
+
+def get_drive_service():
+    """Return the process-wide authenticated Google Drive service (built on first use).
+
+    Credentials are read once (see _load_drive_credentials) and the service uses the
+    discovery document bundled with google-api-python-client, so no network is needed to
+    build it. The service is safe to share between threads: each request runs on a
+    per-thread pooled connection.
+    """
+    global _drive_credentials, _drive_service
+    if _drive_service is not None:
+        return _drive_service
+    with _drive_lock:
+        if _drive_service is None:
+            t0 = time.perf_counter()
+            _drive_credentials = _load_drive_credentials()
+            _drive_service = build(
+                "drive", "v3",
+                http=_thread_http(),
+                requestBuilder=_build_drive_request,
+                static_discovery=True,
+                cache_discovery=False,
             )
-        creds = Credentials.from_service_account_file(creds_path, scopes=scopes)
+            _drive_metrics["startup_s"] = time.perf_counter() - t0
+            _log(f"Cliente de Drive listo en {_drive_metrics['startup_s'] * 1000:.0f} ms")
+    return _drive_service
 
-    service = build("drive", "v3", credentials=creds)
-    return service
 
+def reset_drive_service() -> None:
+    """Drop the cached credentials, service and connections (next call rebuilds them)."""
+    global _drive_credentials, _drive_service, _drive_generation
+    with _drive_lock:
+        _drive_credentials = None
+        _drive_service = None
+        _drive_generation += 1
 
-def download_csv_text(file_id: str) -> str:
-    """Download a Drive file by ID or share URL and return its content as UTF-8 text."""
+
+def get_drive_metrics() -> Dict[str, float]:
+    """Return client startup time and Drive HTTP call count/latency (seconds) for this process."""
+    with _drive_lock:
+        metrics = dict(_drive_metrics)
+    metrics["call_s_avg"] = metrics["call_s_total"] / metrics["calls"] if metrics["calls"] else 0.0
+    return metrics
+
+
+def _env_number(name: str, default: float) -> float:
+    """Numeric setting from the environment; empty or invalid values fall back to default.
+
+    Read when used, not at import, so a bad value can't break the import of this module.
+    """
+    setting = os.getenv(name, "").strip()
+    if not setting:
+        return default
+    try:
+        return float(setting)
+    except ValueError:
+        _log(f"   {name}={setting!r} no es un número, se usa {default:g}")
+        return default
+
+
+def _download_chunk_size() -> int:
+    """Download chunk size in bytes (DRIVE_DOWNLOAD_CHUNK_MB, 8MB by default)."""
+    megabytes = _env_number("DRIVE_DOWNLOAD_CHUNK_MB", 8)
+    return int(megabytes * 1024 * 1024) if megabytes > 0 else 8 * 1024 * 1024
+
+
+_DOWNLOAD_MAX_RETRIES = 5
+_DOWNLOAD_BACKOFF_S = 1.0
+_TRANSIENT_HTTP_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+def _is_transient_download_error(exc: Exception) -> bool:
+    """True for errors worth retrying: throttling, 5xx and dropped connections."""
+    if isinstance(exc, HttpError):
+        return int(getattr(exc.resp, "status", 0) or 0) in _TRANSIENT_HTTP_STATUSES
+    return isinstance(exc, (httplib2.HttpLib2Error, ConnectionError, TimeoutError, socket.timeout))
+
+
+def _run_download(downloader, max_retries: int = _DOWNLOAD_MAX_RETRIES,
+                  backoff_s: float = _DOWNLOAD_BACKOFF_S) -> Iterator[None]:
+    """Drive a MediaIoBaseDownload-like object to completion, yielding after each chunk lands.
+
+    A failed chunk is not written and the downloader keeps its byte offset, so transient errors
+    are retried with exponential backoff and the retry resumes where the transfer broke.
+    """
+    failures = 0
+    done = False
+    while not done:
+        t0 = time.perf_counter()
+        try:
+            status, done = downloader.next_chunk()
+        except Exception as e:
+            current_span().add(network_s=time.perf_counter() - t0)
+            if not _is_transient_download_error(e) or failures >= max_retries:
+                raise
+            failures += 1
+            current_span().add(retries=1)
+            delay = backoff_s * (2 ** (failures - 1)) * (1 + random.random())
+            _log(f"   Descarga interrumpida ({e.__class__.__name__}); reintento {failures}/{max_retries} en {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        current_span().add(network_s=time.perf_counter() - t0)
+        failures = 0
+        yield
+
+
+def _iter_downloaded_text(downloader, fh, max_retries: int = _DOWNLOAD_MAX_RETRIES,
+                          backoff_s: float = _DOWNLOAD_BACKOFF_S) -> Iterator[str]:
+    """Run a download into fh (a temp file) and yield the text of each chunk as it lands.
+
+    Only the newest chunk is read back and decoded, so memory stays bounded by the chunk size.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    position = 0
+    for _ in _run_download(downloader, max_retries, backoff_s):
+        fh.seek(position)
+        data = fh.read()
+        position = fh.tell()
+        text = decoder.decode(data)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def iter_download_text(file_id: str, chunk_size: Optional[int] = None) -> Iterator[str]:
+    """Stream a Drive file by ID or share URL as UTF-8 text chunks (BOM removed).
+
+    Bytes are spooled to a temporary file in chunk_size pieces (DRIVE_DOWNLOAD_CHUNK_MB, 8MB by
+    default) and transient failures are retried with exponential backoff, resuming from the last
+    completed chunk.
+    """
     service = get_drive_service()
     file_id = _normalize_file_id(file_id)
     request = service.files().get_media(fileId=file_id)
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fd=fh, request=request)
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-    fh.seek(0)
-    return fh.read().decode("utf-8", errors="replace")
+    with tempfile.TemporaryFile() as fh:
+        downloader = MediaIoBaseDownload(fd=fh, request=request, chunksize=chunk_size or _download_chunk_size())
+        yield from _iter_downloaded_text(downloader, fh)
 
 
-def upload_csv_text(file_id: str, text: str) -> None:
-    """Overwrite an existing Drive file (by ID or share URL) with provided CSV text."""
+def download_file_to(file_id: str, fh, chunk_size: Optional[int] = None) -> int:
+    """Download the raw bytes of a Drive file into the binary file object fh; return the byte count."""
+    service = get_drive_service()
+    file_id = _normalize_file_id(file_id)
+    request = service.files().get_media(fileId=file_id)
+    start = fh.tell()
+    downloader = MediaIoBaseDownload(fd=fh, request=request, chunksize=chunk_size or _download_chunk_size())
+    for _ in _run_download(downloader):
+        pass
+    return fh.tell() - start
+
+
+def iter_drive_csv_rows(file_id: str) -> Iterator[List[str]]:
+    """Yield the rows of a Drive CSV (header first) while it downloads, with line breaks cleaned."""
+    return csv.reader(_iter_clean_csv_lines(iter_download_text(file_id)))
+
+
+def download_csv_text(file_id: str) -> str:
+    """Download a Drive file by ID or share URL and return its content as UTF-8 text."""
+    return "".join(iter_download_text(file_id))
+
+
+_UPLOAD_CHUNK_SIZE = 1024 * 1024
+_UPLOAD_SPOOL_MAX_BYTES = 16 * 1024 * 1024
+
+
+def upload_csv_stream(file_id: str, fh, size: int, mimetype: str = "text/csv") -> Dict[str, str]:
+    """Overwrite an existing Drive file (by ID or share URL) with the CSV bytes in fh.
+
+    fh is any seekable binary file object positioned at the start; size is its length in bytes.
+    Other content types (gzip, Parquet, JSON) can be uploaded by passing their mimetype.
+    Returns the file's new id, version and md5Checksum.
+    """
     service = get_drive_service()
     file_id = _normalize_file_id(file_id)
     
-    # Usar resumable=True para archivos grandes (más confiable)
-    file_bytes = text.encode("utf-8")
-    file_size_mb = len(file_bytes) / (1024 * 1024)
-    
-    # Si el archivo es mayor a 5MB, usar resumable upload
-    use_resumable = file_size_mb > 5
+    # Si el archivo es mayor a 5MB, usar resumable upload (más confiable)
+    use_resumable = size > 5 * 1024 * 1024
     
     media = MediaIoBaseUpload(
-        io.BytesIO(file_bytes), 
-        mimetype="text/csv", 
+        fh, 
+        mimetype=mimetype, 
         resumable=use_resumable,
-        chunksize=1024*1024  # 1MB chunks
+        chunksize=_UPLOAD_CHUNK_SIZE
     )
     
     result = service.files().update(
         fileId=file_id, 
         media_body=media, 
-        body={"mimeType": "text/csv"}
+        body={"mimeType": mimetype},
+        fields="id,version,md5Checksum"
     ).execute()
     
     # Verificar que el upload fue exitoso
@@ -104,6 +321,224 @@ def upload_csv_text(file_id: str, text: str) -> None:
     return result
 
 
+def upload_csv_text(file_id: str, text: str) -> Dict[str, str]:
+    """Overwrite an existing Drive file (by ID or share URL) with provided CSV text.
+
+    Returns the file's new id, version and md5Checksum.
+    """
+    file_bytes = text.encode("utf-8")
+    return upload_csv_stream(file_id, io.BytesIO(file_bytes), len(file_bytes))
+
+
+def get_file_metadata(file_id: str) -> Dict[str, str]:
+    """Return the id, name, version, md5Checksum, size and appProperties of a Drive file without downloading it."""
+    service = get_drive_service()
+    file_id = _normalize_file_id(file_id)
+    return service.files().get(fileId=file_id, fields="id,name,version,md5Checksum,size,appProperties").execute()
+
+
+def set_app_properties(file_id: str, properties: Dict[str, str]) -> None:
+    """Set private appProperties (key/value strings) on a Drive file."""
+    service = get_drive_service()
+    file_id = _normalize_file_id(file_id)
+    service.files().update(fileId=file_id, body={"appProperties": properties}, fields="id").execute()
+
+
+_rejected_cache_dirs = set()
+
+
+def _private_cache_dir(cache_dir: str) -> bool:
+    """Create cache_dir (mode 0o700) if needed; True if only this user can write to it.
+
+    The cache holds pickles and CSV bytes that go back to Drive, so a directory another user can
+    write to (or one they created first) would let them run code or change the history.
+    """
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        st = os.stat(cache_dir)
+    except OSError as e:
+        problem = f"no se pudo crear ({e})"
+    else:
+        if not hasattr(os, "geteuid"):
+            return True  # Windows: el directorio hereda los permisos del perfil del usuario
+        if st.st_uid != os.geteuid():
+            problem = "pertenece a otro usuario"
+        elif st.st_mode & 0o022:
+            problem = "otros usuarios pueden escribir en él (usa chmod 700)"
+        else:
+            return True
+    if cache_dir not in _rejected_cache_dirs:
+        _rejected_cache_dirs.add(cache_dir)
+        _log(f"   Cache local desactivado: {cache_dir} {problem}")
+    return False
+
+
+def _drive_cache_path(file_id: str, suffix: str = ".pickle") -> Optional[str]:
+    """Path of the local cache entry for file_id, or None if DRIVE_CACHE_DIR is unset, off or not private."""
+    cache_dir = os.getenv("DRIVE_CACHE_DIR", "").strip()
+    if not cache_dir or cache_dir.lower() in ("off", "false", "0") or not _private_cache_dir(cache_dir):
+        return None
+    return os.path.join(cache_dir, f"{file_id}{suffix}")
+
+
+def _cache_matches(cached: Dict[str, str], metadata: Dict[str, str]) -> bool:
+    # md5Checksum identifies the content; version also changes on renames, so it's only a fallback
+    if cached.get("md5Checksum") and metadata.get("md5Checksum"):
+        return cached["md5Checksum"] == metadata["md5Checksum"]
+    return bool(cached.get("version")) and cached.get("version") == metadata.get("version")
+
+
+def _load_cached_table(file_id: str, metadata: Dict[str, str]) -> Optional["CsvTable"]:
+    path = _drive_cache_path(file_id)
+    if not path or not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            entry = pickle.load(f)
+    except Exception as e:
+        _log(f"   Cache local ilegible, se ignora: {e}")
+        return None
+    if "table" not in entry or not _cache_matches(entry["metadata"], metadata):
+        return None
+    return entry["table"]
+
+
+def _store_cached_table(file_id: str, metadata: Dict[str, str], table: "CsvTable") -> None:
+    """Save a parsed table with the Drive metadata it corresponds to. Failures are only logged."""
+    path = _drive_cache_path(file_id)
+    if not path or not (metadata.get("md5Checksum") or metadata.get("version")):
+        return
+    try:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"metadata": metadata, "table": table}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        _log(f"   No se pudo guardar cache local: {e}")
+
+
+def download_csv_table(file_id: str, metadata: Optional[Dict[str, str]] = None,
+                       date_column: Optional[str] = None, normalize_date: bool = True) -> "CsvTable":
+    """Return a Drive CSV as a CsvTable, downloading it only if it changed since last time.
+
+    A metadata request compares Drive's md5Checksum/version with the local cache entry (only with
+    DRIVE_CACHE_DIR set, see _private_cache_dir); on a match the parsed table is loaded from the cache and no bytes are
+    downloaded. Otherwise the file is downloaded, parsed and cached. Pass metadata if the caller
+    already fetched it. A large file parsed in parallel (CSV_PARSE_WORKERS) is downloaded whole
+    first and gets the date keys of date_column computed by the workers.
+    """
+    file_id = _normalize_file_id(file_id)
+    metadata = metadata or get_file_metadata(file_id)
+    cached = _load_cached_table(file_id, metadata)
+    if cached is not None:
+        _log(f"   Cache local vigente (versión {metadata.get('version')}): descarga omitida")
+        return cached
+    size = int(metadata.get("size") or 0)
+    with span("drive_download") as s:
+        if _parse_workers(size) > 1:
+            table = _read_csv_to_table("".join(iter_download_text(file_id)), date_column, normalize_date)
+        else:
+            table = _read_text_chunks_to_table(iter_download_text(file_id))
+        s.set(bytes=size, rows=len(table))
+    _store_cached_table(file_id, metadata, table)
+    return table
+
+
+def create_file_stream(name: str, fh, size: int, sibling_file_id: str, mimetype: str = "text/csv") -> str:
+    """Create a new file with the bytes in fh in the same Drive folder as sibling_file_id and return its ID."""
+    service = get_drive_service()
+    sibling_file_id = _normalize_file_id(sibling_file_id)
+    parents = service.files().get(fileId=sibling_file_id, fields="parents").execute().get("parents")
+
+    media = MediaIoBaseUpload(
+        fh,
+        mimetype=mimetype,
+        resumable=size > 5 * 1024 * 1024,
+        chunksize=_UPLOAD_CHUNK_SIZE
+    )
+    body = {"name": name, "mimeType": mimetype}
+    if parents:
+        body["parents"] = parents
+    result = service.files().create(body=body, media_body=media, fields="id").execute()
+
+    if not result or 'id' not in result:
+        raise RuntimeError("Creación falló: respuesta inválida de Drive API")
+    return result["id"]
+
+
+def find_sibling_file(name: str, sibling_file_id: str) -> Optional[str]:
+    """ID of the file called `name` in the same Drive folder as sibling_file_id, or None."""
+    service = get_drive_service()
+    sibling_file_id = _normalize_file_id(sibling_file_id)
+    parents = service.files().get(fileId=sibling_file_id, fields="parents").execute().get("parents")
+    if not parents:
+        return None
+    escaped = name.replace("\\", "\\\\").replace("'", "\\'")
+    query = f"name = '{escaped}' and '{parents[0]}' in parents and trashed = false"
+    files = service.files().list(q=query, fields="files(id)", pageSize=10).execute().get("files") or []
+    return files[0]["id"] if files else None
+
+
+def create_csv_file(name: str, text: str, sibling_file_id: str) -> str:
+    """Create a new CSV file in the same Drive folder as sibling_file_id and return its ID."""
+    file_bytes = text.encode("utf-8")
+    return create_file_stream(name, io.BytesIO(file_bytes), len(file_bytes), sibling_file_id)
+
+
+_DATE_FORMATS = [
+    "%m/%d/%Y, %I:%M %p",  # 11/6/2025, 2:32 PM (formato con coma y AM/PM)
+    "%m/%d/%Y %I:%M %p",   # 11/6/2025 2:32 PM (sin coma)
+    "%m/%d/%Y, %H:%M",     # 11/6/2025, 14:32 (formato 24h con coma)
+    "%m/%d/%Y",
+    "%m/%d/%y",
+    "%Y-%m-%d",
+    "%Y/%m/%d",
+    "%d/%m/%Y",
+    "%d-%m-%Y",
+    "%m/%d/%Y %H:%M",
+    "%m/%d/%Y %H:%M:%S",
+    "%Y-%m-%d %H:%M:%S",
+]
+
+# Same directive patterns datetime.strptime uses, so a fast match accepts exactly what strptime accepts
+_DATE_DIRECTIVE_PATTERNS = {
+    "d": r"(?P<d>3[01]|[12]\d|0[1-9]|[1-9]| [1-9])",
+    "m": r"(?P<m>1[0-2]|0[1-9]|[1-9])",
+    "Y": r"(?P<Y>\d\d\d\d)",
+    "y": r"(?P<y>\d\d)",
+    "H": r"(?:2[0-3]|[0-1]\d|\d)",
+    "I": r"(?:1[0-2]|0[1-9]|[1-9]| [1-9])",
+    "M": r"(?:[0-5]\d|\d)",
+    "S": r"(?:6[0-1]|[0-5]\d|\d)",
+    "p": r"(?:am|pm)",
+}
+
+_DATE_KEY_CACHE_SIZE = 65536
+_DATE_SNIFF_SAMPLE = 200
+
+
+def _compile_date_format(fmt: str) -> "re.Pattern[str]":
+    """Compile a strptime format from _DATE_FORMATS into an equivalent regex."""
+    parts = []
+    i = 0
+    while i < len(fmt):
+        ch = fmt[i]
+        if ch == "%":
+            parts.append(_DATE_DIRECTIVE_PATTERNS[fmt[i + 1]])
+            i += 2
+        elif ch.isspace():
+            while i < len(fmt) and fmt[i].isspace():
+                i += 1
+            parts.append(r"\s+")
+        else:
+            parts.append(re.escape(ch))
+            i += 1
+    return re.compile("".join(parts), re.IGNORECASE)
+
+
+_DATE_FORMAT_REGEXES = [_compile_date_format(f) for f in _DATE_FORMATS]
+
+
 def _try_parse_date(val: str) -> Optional[datetime]:
     """Try parsing a date from a variety of common formats. Return datetime or None."""
     if val is None:
@@ -111,21 +546,7 @@ def _try_parse_date(val: str) -> Optional[datetime]:
     val = val.strip()
     if not val:
         return None
-    formats = [
-        "%m/%d/%Y, %I:%M %p",  # 11/6/2025, 2:32 PM (formato con coma y AM/PM)
-        "%m/%d/%Y %I:%M %p",   # 11/6/2025 2:32 PM (sin coma)
-        "%m/%d/%Y, %H:%M",     # 11/6/2025, 14:32 (formato 24h con coma)
-        "%m/%d/%Y",
-        "%m/%d/%y",
-        "%Y-%m-%d",
-        "%Y/%m/%d",
-        "%d/%m/%Y",
-        "%d-%m-%Y",
-        "%m/%d/%Y %H:%M",
-        "%m/%d/%Y %H:%M:%S",
-        "%Y-%m-%d %H:%M:%S",
-    ]
-    for fmt in formats:
+    for fmt in _DATE_FORMATS:
         try:
             return datetime.strptime(val, fmt)
         except Exception:
@@ -144,92 +565,415 @@ def _normalize_date_for_key(val: str, normalize: bool) -> str:
     return dt.date().isoformat()
 
 
+def _detect_date_format(sample: List[str]) -> Optional[int]:
+    """Return the index in _DATE_FORMATS that parses most of the sample values, or None."""
+    hits: Counter = Counter()
+    for val in sample:
+        val = (val or "").strip()
+        if not val:
+            continue
+        for idx, fmt in enumerate(_DATE_FORMATS):
+            try:
+                datetime.strptime(val, fmt)
+            except Exception:
+                continue
+            hits[idx] += 1
+            break
+    if not hits:
+        return None
+    return hits.most_common(1)[0][0]
+
+
+def _build_date_key_fn(sample: List[str], normalize: bool,
+                       cache_size: int = _DATE_KEY_CACHE_SIZE) -> Callable[[str], str]:
+    """Return a memoized equivalent of _normalize_date_for_key for one date column.
+
+    The column's format is sniffed from `sample` and values are matched against its compiled
+    regex. Values that don't match (or that an earlier format in _DATE_FORMATS would also
+    accept) fall back to _normalize_date_for_key, so the keys are always identical to it.
+    Raw value → key lookups are cached; the cache is cleared once it reaches cache_size.
+    """
+    if not normalize:
+        return lambda val: (val or "").strip()
+
+    fmt_idx = _detect_date_format(sample[:_DATE_SNIFF_SAMPLE])
+    fast = _DATE_FORMAT_REGEXES[fmt_idx] if fmt_idx is not None else None
+    earlier = _DATE_FORMAT_REGEXES[:fmt_idx] if fmt_idx is not None else []
+    cache: Dict[str, str] = {}
+
+    def date_key(val: str) -> str:
+        key = cache.get(val)
+        if key is not None:
+            return key
+        if fast is not None:
+            stripped = (val or "").strip()
+            m = fast.fullmatch(stripped)
+            if m and not any(r.fullmatch(stripped) for r in earlier):
+                groups = m.groupdict()
+                if groups.get("Y") is not None:
+                    year = int(groups["Y"])
+                else:
+                    # Same pivot as strptime's %y
+                    year = int(groups["y"])
+                    year += 2000 if year <= 68 else 1900
+                try:
+                    key = date(year, int(groups["m"]), int(groups["d"])).isoformat()
+                except ValueError:
+                    key = None
+        if key is None:
+            key = _normalize_date_for_key(val, True)
+        if len(cache) >= cache_size:
+            cache.clear()
+        cache[val] = key
+        return key
+
+    return date_key
+
+
+_CSV_CHUNK_SIZE = 1024 * 1024
+
+# One quoted field; no nested quantifiers, so matching is linear even on unbalanced quotes
+_QUOTED_FIELD_RE = re.compile(r'"([^"]*)"')
+
+
+def _collapse_quoted_field(match) -> str:
+    # Reemplazar saltos de línea y limpiar espacios múltiples
+    return '"' + ' '.join(match.group(1).split()) + '"'
+
+
+def _iter_clean_csv_lines(chunks: Iterable[str], counts: Optional[Dict[str, int]] = None) -> Iterator[str]:
+    """Yield CSV lines with line breaks inside quoted cell values flattened.
+
+    Single pass over `chunks` (any iterable of text pieces) that carries the open-quote state
+    from one chunk to the next. Quotes are paired in order and the content of each pair has its
+    whitespace collapsed to single spaces, so the output is identical to the historical regex
+    cleaner without its backtracking or a full copy of the text. An unterminated trailing quote
+    is left untouched.
+
+    The yielded lines can be passed straight to csv.reader. If `counts` is given it is filled
+    with 'original_lines' and 'cleaned_lines' (number of '\\n' before and after cleaning).
+    """
+    original_lines = 0
+    cleaned_lines = 0
+    line_tail = ""              # cleaned text after the last yielded '\n'
+    open_field: List[str] = []  # raw text from an unpaired quote onwards
+
+    for chunk in chunks:
+        original_lines += chunk.count('\n')
+        if open_field and '"' not in chunk:
+            open_field.append(chunk)
+            continue
+        t0 = time.perf_counter()
+        text = ''.join(open_field) + chunk
+        open_field = []
+        if text.count('"') % 2:
+            # Campo entre comillas que continúa en el siguiente chunk
+            cut = text.rfind('"')
+            open_field.append(text[cut:])
+            text = text[:cut]
+        text = line_tail + _QUOTED_FIELD_RE.sub(_collapse_quoted_field, text)
+        last_nl = text.rfind('\n')
+        line_tail = text[last_nl + 1:]
+        current_span().add(clean_s=time.perf_counter() - t0)
+        if last_nl >= 0:
+            cleaned_lines += text.count('\n')
+            # StringIO splits on '\n' only, in C
+            yield from io.StringIO(text[:last_nl + 1])
+
+    # Comilla sin cerrar al final: se deja el texto tal cual
+    text = line_tail + ''.join(open_field)
+    cleaned_lines += text.count('\n')
+    if text:
+        yield from io.StringIO(text)
+
+    if counts is not None:
+        counts['original_lines'] = original_lines
+        counts['cleaned_lines'] = cleaned_lines
+
+
 def _clean_csv_line_breaks(csv_text: str) -> str:
     """Clean line breaks within CSV cell values that break row structure.
     
-    This handles cases where cell values contain \n or \r characters that
+    This handles cases where cell values contain \\n or \\r characters that
     would normally break CSV parsing by creating extra rows.
     """
-    # Pattern mejorado: captura campos entre comillas que contienen cualquier cantidad de saltos de línea
-    # Usa un patrón más robusto que captura TODO el contenido entre comillas, incluyendo múltiples saltos
-    pattern = r'"([^"]*(?:[\n\r]+[^"]*)*)"'
-    
-    def replace_breaks(match):
-        # Replace \n and \r with space within the quoted field
-        value = match.group(1)
-        # Reemplazar todos los saltos de línea con espacios
-        value = value.replace('\n', ' ').replace('\r', ' ')
-        # Limpiar espacios múltiples
-        value = ' '.join(value.split())
-        return f'"{value}"'
-    
-    cleaned = re.sub(pattern, replace_breaks, csv_text)
+    counts: Dict[str, int] = {}
+    cleaned = ''.join(_iter_clean_csv_lines([csv_text], counts))
     
     # Log de cuántos campos fueron limpiados (solo si hubo cambios)
-    if cleaned != csv_text:
-        original_lines = csv_text.count('\n')
-        cleaned_lines = cleaned.count('\n')
-        if original_lines != cleaned_lines:
-            _log(f"   Line breaks limpiados: {original_lines} → {cleaned_lines} líneas")
+    if counts['original_lines'] != counts['cleaned_lines']:
+        _log(f"   Line breaks limpiados: {counts['original_lines']} → {counts['cleaned_lines']} líneas")
     
     return cleaned
 
 
-def _read_csv_to_rows(csv_text: str) -> Tuple[List[str], List[Dict[str, str]]]:
-    """Read CSV text into (fieldnames, rows). Removes BOM if present and cleans line breaks."""
-    original_line_count = csv_text.count('\n')
+_TABLE_BATCH_ROWS = 10000
+
+
+class CsvTable:
+    """Column-oriented CSV table used by the merge path.
+
+    Holds the header and one list per column; repeated values (part numbers, workcenters,
+    timestamps...) share a single string object. Rows are addressed by index and missing
+    cells are "". date_keys keeps the row date keys computed while parsing, by
+    (date_column, normalize_date).
+    """
+
+    def __init__(self, fieldnames: List[str], columns: List[List[str]]):
+        self.fieldnames = fieldnames
+        self.columns = columns
+        self.date_keys: Dict[Tuple[str, bool], List[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def column(self, name: str) -> Optional[List[str]]:
+        """Return the values of column `name`, or None if the table doesn't have it."""
+        for i in range(len(self.fieldnames) - 1, -1, -1):  # last duplicate wins, like DictReader
+            if self.fieldnames[i] == name:
+                return self.columns[i]
+        return None
+
+    def select(self, fieldnames: List[str], indices: Optional[List[int]] = None) -> List[List[str]]:
+        """Return the columns for `fieldnames` restricted to the rows at `indices` (all if None)."""
+        n = len(self) if indices is None else len(indices)
+        selected = []
+        for name in fieldnames:
+            col = self.column(name)
+            if col is None:
+                selected.append([""] * n)
+            elif indices is None:
+                selected.append(col)
+            else:
+                selected.append(list(map(col.__getitem__, indices)))
+        return selected
+
+    def take(self, indices: List[int]) -> "CsvTable":
+        """Return a new table with the rows at `indices`."""
+        return CsvTable(self.fieldnames, self.select(self.fieldnames, indices))
+
+    def to_dicts(self) -> List[Dict[str, str]]:
+        """Return the rows as dicts (for callers that still use the row-dict API)."""
+        return [dict(zip(self.fieldnames, row)) for row in zip(*self.columns)]
+
+
+def _read_clean_lines_to_table(lines: Iterable[str], fieldnames: Optional[List[str]] = None) -> CsvTable:
+    """Parse cleaned CSV lines into a CsvTable, removing a BOM from the header.
+
+    Like csv.DictReader, blank lines are skipped, short rows are padded and extra cells dropped.
+    If fieldnames is given the lines are all data rows (a piece of a larger CSV).
+    """
+    reader = csv.reader(lines)
+    if fieldnames is None:
+        fieldnames = next(reader, [])
+    
+    # Clean BOM from fieldnames if present
+    if fieldnames and fieldnames[0].startswith('\ufeff'):
+        fieldnames[0] = fieldnames[0][1:]
     
+    n = len(fieldnames)
+    columns: List[List[str]] = [[] for _ in range(n)]
+    pool: Dict[str, str] = {}  # one shared object per distinct value
+
+    def flush(batch):
+        for col, values in zip(columns, zip(*batch)):
+            col.extend(map(pool.setdefault, values, values))
+
+    batch = []
+    for row in reader:
+        if not row:
+            continue
+        if len(row) != n:
+            row = (row + [""] * n)[:n]
+        batch.append(row)
+        if len(batch) >= _TABLE_BATCH_ROWS:
+            flush(batch)
+            batch = []
+    flush(batch)
+    return CsvTable(fieldnames, columns)
+
+
+def _check_row_count(table: CsvTable, counts: Dict[str, int]) -> None:
+    if len(table) != (counts['cleaned_lines'] - 1):  # -1 for header
+        _log(f"   ⚠️ Advertencia: Se esperaban {counts['cleaned_lines'] - 1} filas pero se leyeron {len(table)}")
+
+
+def _parse_workers(size: int) -> int:
+    """Number of processes to parse a CSV of `size` bytes with; 1 means serial.
+
+    Parallel parsing is opt-in through CSV_PARSE_WORKERS (a number, or "auto" for
+    os.cpu_count()). CSVs under CSV_PARSE_PARALLEL_MIN_MB are always parsed serially: starting
+    the pool would cost more than it saves.
+    """
+    setting = os.getenv("CSV_PARSE_WORKERS", "").strip().lower()
+    if setting == "auto":
+        workers = os.cpu_count() or 1
+    else:
+        try:
+            workers = int(setting or 1)
+        except ValueError:
+            workers = 1
+    if workers <= 1 or size < _env_number("CSV_PARSE_PARALLEL_MIN_MB", 16) * 1024 * 1024:
+        return 1
+    return workers
+
+
+def _row_starts(text: str, targets: Iterable[int]) -> Iterator[int]:
+    """Yield, for each increasing target offset, the first row start at or after it.
+
+    A row starts right after a '\n' preceded by an even number of quotes, i.e. outside any
+    quoted cell, so the text on each side of it cleans and parses exactly as inside the whole.
+    Stops early if no such '\n' is left (e.g. an unterminated quote).
+    """
+    pos = quotes = 0  # quotes counts the '"' in text[:pos]
+    for target in targets:
+        cut = text.find('\n', max(target, pos))
+        while cut != -1:
+            quotes += text.count('"', pos, cut)
+            pos = cut
+            if quotes % 2 == 0:
+                break
+            # Dentro de una celda entre comillas: saltar a la siguiente comilla
+            quote = text.find('"', cut)
+            cut = text.find('\n', quote + 1) if quote != -1 else -1
+        if cut == -1:
+            return
+        pos = cut + 1
+        yield pos
+
+
+def _parse_csv_piece(args) -> Tuple[List[List[str]], Dict[str, int], Optional[List[str]]]:
+    """Process-pool worker: clean and parse a piece of data rows and key their dates."""
+    fieldnames, piece, date_column, normalize_date = args
+    counts: Dict[str, int] = {}
+    table = _read_clean_lines_to_table(_iter_clean_csv_lines([piece], counts), list(fieldnames))
+    keys = None
+    dates = table.column(date_column) if date_column else None
+    if dates is not None:
+        date_key = _build_date_key_fn(dates[:_DATE_SNIFF_SAMPLE], normalize_date)
+        keys = list(map(date_key, dates))
+    return table.columns, counts, keys
+
+
+def _read_csv_text_parallel(csv_text: str, workers: int, date_column: Optional[str],
+                            normalize_date: bool) -> Optional[Tuple[CsvTable, Dict[str, int]]]:
+    """Parse BOM-free CSV text in a pool of `workers` processes; None if it should go serial.
+
+    The text is cut at row starts (see _row_starts) into one piece per worker; each worker
+    cleans and parses its piece and computes the date keys of date_column, and the pieces are
+    joined back in order into one table whose values share a single string pool, identical to
+    the serial result. The keys go into table.date_keys for merge_tables_by_date.
+    """
+    targets = [0] + [len(csv_text) * i // workers for i in range(1, workers)]
+    starts = list(_row_starts(csv_text, targets))
+    if len(starts) < 2:
+        return None
+    counts: Dict[str, int] = {}
+    header = _read_clean_lines_to_table(_iter_clean_csv_lines([csv_text[:starts[0]]], counts))
+    fieldnames = header.fieldnames
+    if not fieldnames:
+        return None
+    pieces = [(fieldnames, csv_text[a:b], date_column, normalize_date)
+              for a, b in zip(starts, starts[1:] + [len(csv_text)])]
+    try:
+        # spawn: el proceso principal tiene hilos (Playwright, syncs de Drive) y fork no es seguro
+        with ProcessPoolExecutor(max_workers=len(pieces), mp_context=multiprocessing.get_context("spawn")) as pool:
+            results = list(pool.map(_parse_csv_piece, pieces))
+    except Exception as e:
+        _log(f"   Parseo en paralelo falló, se usa el serial: {e}")
+        return None
+
+    columns: List[List[str]] = [[] for _ in fieldnames]
+    pool_values: Dict[str, str] = {}
+    keys: Optional[List[str]] = [] if date_column and header.column(date_column) is not None else None
+    for piece_columns, piece_counts, piece_keys in results:
+        for col, values in zip(columns, piece_columns):
+            col.extend(map(pool_values.setdefault, values, values))
+        for name, value in piece_counts.items():
+            counts[name] += value
+        if keys is not None:
+            keys.extend(map(pool_values.setdefault, piece_keys, piece_keys))
+    table = CsvTable(fieldnames, columns)
+    if keys is not None:
+        table.date_keys[(date_column, normalize_date)] = keys
+    current_span().set(workers=len(pieces))
+    return table, counts
+
+
+def _read_csv_to_table(csv_text: str, date_column: Optional[str] = None,
+                       normalize_date: bool = True) -> CsvTable:
+    """Read CSV text into a CsvTable. Removes BOM if present and cleans line breaks.
+
+    Large texts are parsed in parallel when CSV_PARSE_WORKERS allows it (see _parse_workers);
+    that path also keys date_column, if given, while parsing.
+    """
     # Remove BOM if present at the start of the text
     if csv_text.startswith('\ufeff'):
         csv_text = csv_text[1:]
+
+    workers = _parse_workers(len(csv_text))
+    parsed = _read_csv_text_parallel(csv_text, workers, date_column, normalize_date) if workers > 1 else None
+    if parsed is not None:
+        table, counts = parsed
+        if counts['original_lines'] != counts['cleaned_lines']:
+            _log(f"   Limpieza CSV: {counts['original_lines']} → {counts['cleaned_lines']} líneas")
+        _check_row_count(table, counts)
+        return table
+
+    chunks = (csv_text[i:i + _CSV_CHUNK_SIZE] for i in range(0, len(csv_text), _CSV_CHUNK_SIZE))
+    return _read_text_chunks_to_table(chunks)
+
+
+def _read_text_chunks_to_table(chunks: Iterable[str]) -> CsvTable:
+    """Read BOM-free CSV text chunks (e.g. a download in progress) into a CsvTable."""
+    # Clean line breaks within cell values while parsing
+    counts: Dict[str, int] = {}
+    table = _read_clean_lines_to_table(_iter_clean_csv_lines(chunks, counts))
     
-    # Clean line breaks within cell values
-    csv_text = _clean_csv_line_breaks(csv_text)
-    cleaned_line_count = csv_text.count('\n')
-    
-    if original_line_count != cleaned_line_count:
-        _log(f"   Limpieza CSV: {original_line_count} → {cleaned_line_count} líneas")
-    
-    buf = io.StringIO(csv_text)
-    reader = csv.DictReader(buf)
-    fieldnames = reader.fieldnames or []
-    
-    # Clean BOM from fieldnames if present
-    if fieldnames and fieldnames[0].startswith('\ufeff'):
-        fieldnames[0] = fieldnames[0][1:]
+    if counts['original_lines'] != counts['cleaned_lines']:
+        _log(f"   Limpieza CSV: {counts['original_lines']} → {counts['cleaned_lines']} líneas")
+    _check_row_count(table, counts)
     
-    rows = [dict(r) for r in reader]
+    return table
+
+
+def _read_csv_file_to_table(csv_path: str, date_column: Optional[str] = None,
+                            normalize_date: bool = True) -> CsvTable:
+    """Read CSV file into a CsvTable. Cleans line breaks within cell values.
+
+    The file is streamed in _CSV_CHUNK_SIZE pieces; its full text is never held in memory,
+    except for large files parsed in parallel (see _parse_workers and _read_csv_to_table).
+    """
+    counts: Dict[str, int] = {}
+    with span("csv_parse") as s, open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        workers = _parse_workers(os.path.getsize(csv_path))
+        parsed = _read_csv_text_parallel(f.read(), workers, date_column, normalize_date) if workers > 1 else None
+        if parsed is not None:
+            table, counts = parsed
+        else:
+            f.seek(0)
+            chunks = iter(lambda: f.read(_CSV_CHUNK_SIZE), "")
+            table = _read_clean_lines_to_table(_iter_clean_csv_lines(chunks, counts))
+        s.set(bytes=f.tell(), rows=len(table))
     
-    if len(rows) != (cleaned_line_count - 1):  # -1 for header
-        _log(f"   ⚠️ Advertencia: Se esperaban {cleaned_line_count - 1} filas pero se leyeron {len(rows)}")
+    _log(f"   Archivo local: {counts['original_lines']} líneas en archivo")
+    if counts['original_lines'] != counts['cleaned_lines']:
+        _log(f"   Limpieza aplicada: {counts['original_lines']} → {counts['cleaned_lines']} líneas")
+    _check_row_count(table, counts)
     
-    return fieldnames, rows
+    return table
+
+
+def _read_csv_to_rows(csv_text: str) -> Tuple[List[str], List[Dict[str, str]]]:
+    """Read CSV text into (fieldnames, rows). Removes BOM if present and cleans line breaks."""
+    table = _read_csv_to_table(csv_text)
+    return table.fieldnames, table.to_dicts()
 
 
 def _read_csv_file_to_rows(csv_path: str) -> Tuple[List[str], List[Dict[str, str]]]:
     """Read CSV file into (fieldnames, rows). Cleans line breaks within cell values."""
-    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
-        csv_text = f.read()
-    
-    original_line_count = csv_text.count('\n')
-    _log(f"   Archivo local: {original_line_count} líneas en archivo")
-    
-    # Clean line breaks within cell values
-    csv_text = _clean_csv_line_breaks(csv_text)
-    cleaned_line_count = csv_text.count('\n')
-    
-    if original_line_count != cleaned_line_count:
-        _log(f"   Limpieza aplicada: {original_line_count} → {cleaned_line_count} líneas")
-    
-    buf = io.StringIO(csv_text)
-    reader = csv.DictReader(buf)
-    fieldnames = reader.fieldnames or []
-    rows = [dict(r) for r in reader]
-    
-    if len(rows) != (cleaned_line_count - 1):  # -1 for header
-        _log(f"   ⚠️ Advertencia: Se esperaban {cleaned_line_count - 1} filas pero se leyeron {len(rows)}")
-    
-    return fieldnames, rows
+    table = _read_csv_file_to_table(csv_path)
+    return table.fieldnames, table.to_dicts()
 
 
 def _write_rows_to_csv_text(fieldnames: List[str], rows: List[Dict[str, str]]) -> str:
@@ -241,104 +985,710 @@ def _write_rows_to_csv_text(fieldnames: List[str], rows: List[Dict[str, str]]) -
     return buf.getvalue()
 
 
-def merge_csv_by_date(existing_csv_text: str,
-                      new_csv_path: str,
-                      date_column: str,
-                      normalize_date: bool = True,
-                      preserve_order: bool = True) -> str:
-    """Merge two CSVs replacing all rows for matching dates with rows from new CSV.
+def _write_table_to_csv_text(table: CsvTable) -> str:
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    writer.writerow(table.fieldnames)
+    writer.writerows(zip(*table.columns))
+    return buf.getvalue()
 
-    - existing_csv_text: current CSV content from Drive
-    - new_csv_path: local path to newly downloaded CSV
-    - date_column: column name that carries the date
-    - normalize_date: if True, attempt to parse and compare by date-only (YYYY-MM-DD)
-    - preserve_order: if True, keep original order for non-replaced rows; appended new rows go at the end
 
-    Returns merged CSV as text.
+def _write_table_to_stream(table: CsvTable, fh) -> int:
+    """Write table as UTF-8 CSV into the binary file object fh and return the bytes written."""
+    start = fh.tell()
+    text = io.TextIOWrapper(fh, encoding="utf-8", newline="", write_through=True)
+    writer = csv.writer(text, lineterminator='\n')
+    writer.writerow(table.fieldnames)
+    writer.writerows(zip(*table.columns))
+    text.flush()
+    text.detach()  # keep fh open
+    return fh.tell() - start
+
+
+class _ByteCountingBuffer:
+    """Write target for csv.writer that collects the text and returns each write's UTF-8 length."""
+
+    def __init__(self):
+        self.parts: List[str] = []
+
+    def write(self, s: str) -> int:
+        self.parts.append(s)
+        return len(s) if s.isascii() else len(s.encode("utf-8"))
+
+
+def _write_rows_indexed(rows: Iterable, keys: List[str], fh, offset: int, runs: List[list]) -> int:
+    """Write CSV rows into the binary file object fh, indexing them by date key.
+
+    keys holds the date key of each row. Every group of consecutive rows with the same key is
+    recorded in runs as [key, start_byte, end_byte, row_count] (offsets count from `offset`, the
+    position of fh's first byte in the file). Returns the offset after the last row.
     """
-    # Read both datasets
-    old_fields, old_rows = _read_csv_to_rows(existing_csv_text)
-    new_fields, new_rows = _read_csv_file_to_rows(new_csv_path)
-    
-    _log(f"DEBUG: Archivo local leído - {len(new_rows)} filas totales")
+    buf = _ByteCountingBuffer()
+    writer = csv.writer(buf, lineterminator='\n')
+    rows = iter(rows)
+    run = runs[-1] if runs else None
+    for i in range(0, len(keys), _TABLE_BATCH_ROWS):
+        batch_keys = keys[i:i + _TABLE_BATCH_ROWS]
+        lengths = list(map(writer.writerow, itertools.islice(rows, len(batch_keys))))
+        fh.write("".join(buf.parts).encode("utf-8"))
+        buf.parts.clear()
+        for key, n in zip(batch_keys, lengths):
+            if run is not None and run[0] == key:
+                run[2] += n
+                run[3] += 1
+            else:
+                run = [key, offset, offset + n, 1]
+                runs.append(run)
+            offset += n
+    return offset
+
+
+def _date_fingerprints(rows: Iterable, keys: Iterable[str]) -> Dict[str, str]:
+    """Fingerprint the rows of each date key: SHA-1 of the date's CSV lines in sorted order.
+
+    The same rows give the same fingerprint whatever their order, so comparing the old and new
+    fingerprints of a date tells whether replacing it changes anything.
+    """
+    buf = _ByteCountingBuffer()
+    writer = csv.writer(buf, lineterminator='\n')
+    lines_by_key: Dict[str, List[str]] = {}
+    for key, row in zip(keys, rows):
+        writer.writerow(row)
+        lines_by_key.setdefault(key, []).append(buf.parts.pop())
+    return {key: hashlib.sha1("".join(sorted(lines)).encode("utf-8")).hexdigest()
+            for key, lines in lines_by_key.items()}
+
 
-    if not old_fields:
+def _write_table_indexed(table: CsvTable, keys: List[str], fh) -> Tuple[int, Dict[str, object]]:
+    """Write table as UTF-8 CSV into fh (like _write_table_to_stream) and return (bytes, index).
+
+    The index holds the fieldnames, the header length in bytes and the date-key runs of the
+    rows (see _write_rows_indexed); keys is the date key of each row.
+    """
+    header = io.StringIO()
+    csv.writer(header, lineterminator='\n').writerow(table.fieldnames)
+    header_bytes = header.getvalue().encode("utf-8")
+    fh.write(header_bytes)
+    runs: List[list] = []
+    size = _write_rows_indexed(zip(*table.columns), keys, fh, len(header_bytes), runs)
+    return size, {"fieldnames": table.fieldnames, "header_bytes": len(header_bytes), "runs": runs}
+
+
+def _table_date_keys(table: CsvTable, date_column: str, normalize_date: bool) -> List[str]:
+    """Date key of every row of table, reusing the keys computed while parsing it if there are any."""
+    keys = getattr(table, "date_keys", {}).get((date_column, normalize_date))
+    if keys is not None and len(keys) == len(table):
+        return keys
+    dates = table.column(date_column) or [""] * len(table)
+    date_key = _build_date_key_fn(dates[:_DATE_SNIFF_SAMPLE], normalize_date)
+    return list(map(date_key, dates))
+
+
+def merge_tables_by_date(old: CsvTable,
+                         new: CsvTable,
+                         date_column: str,
+                         normalize_date: bool = True) -> Tuple[CsvTable, Dict[str, object]]:
+    """Merge two parsed tables replacing all old rows whose date appears in the new table.
+
+    The date key of every row is computed exactly once and old rows are selected by index.
+    Returns (merged, stats) where stats holds:
+    - new_date_keys: set of date keys present in the new rows
+    - inserted_by_date: Counter of new rows per date key
+    - removed_by_date: Counter of old rows dropped per date key
+    - kept_rows: number of old rows preserved
+    - date_keys: date key of every merged row, in output order
+    - changed_date_keys: new date keys whose rows differ from the old ones (see _date_fingerprints);
+      empty means the merge reproduces the old content
+    """
+    # Validar que la columna de fecha existe y tiene valores
+    if not date_column:
+        raise ValueError("date_column está vacío!")
+
+    # Calculate date keys to replace (one key per new row)
+    new_dates = new.column(date_column) or [""] * len(new)
+    with span("date_keys", side="new", rows=len(new_dates)):
+        new_row_keys = _table_date_keys(new, date_column, normalize_date)
+    inserted_by_date: Counter = Counter(new_row_keys)
+    rows_with_date = sum(1 for raw in new_dates if raw.strip())
+    new_date_keys = set(inserted_by_date)
+
+    stats: Dict[str, object] = {
+        "new_date_keys": new_date_keys,
+        "inserted_by_date": inserted_by_date,
+        "removed_by_date": Counter(),
+        "kept_rows": 0,
+        "date_keys": new_row_keys,
+        "changed_date_keys": new_date_keys,
+    }
+
+    if not old.fieldnames:
         # If Drive file is empty or missing header, just adopt new CSV structure fully
-        fieldnames = new_fields
-        return _write_rows_to_csv_text(fieldnames, new_rows)
+        return new, stats
 
     # Build unified header
-    field_set = list(dict.fromkeys([*old_fields, *new_fields]))  # ordered union
-    
+    field_set = list(dict.fromkeys([*old.fieldnames, *new.fieldnames]))  # ordered union
+
     # Check for potential column mismatches
-    if len(field_set) != len(old_fields) and len(old_fields) == len(new_fields):
+    if len(field_set) != len(old.fieldnames) and len(old.fieldnames) == len(new.fieldnames):
         _log(f"⚠ Advertencia: Diferencia en nombres de columnas detectada")
-        diff_old = set(old_fields) - set(new_fields)
-        diff_new = set(new_fields) - set(old_fields)
+        diff_old = set(old.fieldnames) - set(new.fieldnames)
+        diff_new = set(new.fieldnames) - set(old.fieldnames)
         if diff_old:
             _log(f"  Columnas solo en archivo viejo: {', '.join(list(diff_old)[:3])}")
         if diff_new:
             _log(f"  Columnas solo en archivo nuevo: {', '.join(list(diff_new)[:3])}")
 
-    # Calculate date keys to replace
-    new_date_keys = set(_normalize_date_for_key(r.get(date_column, ""), normalize_date) for r in new_rows)
-    
-    # Validar que la columna de fecha existe y tiene valores
-    if not date_column:
-        raise ValueError("date_column está vacío!")
-    
     # Verificar que al menos algunas filas tienen la columna de fecha
-    rows_with_date = sum(1 for r in new_rows if r.get(date_column, "").strip())
     if rows_with_date == 0:
         _log(f"⚠️ ADVERTENCIA CRÍTICA: Ninguna fila tiene la columna '{date_column}'!")
-        _log(f"   Columnas disponibles: {', '.join(list(new_rows[0].keys())[:5]) if new_rows else 'N/A'}")
+        _log(f"   Columnas disponibles: {', '.join(new.fieldnames[:5]) if len(new) else 'N/A'}")
     else:
-        _log(f"   Columna '{date_column}': {rows_with_date}/{len(new_rows)} filas con valor")
-    
-    # Count rows per date in new file
-    new_date_counts = Counter(_normalize_date_for_key(r.get(date_column, ""), normalize_date) for r in new_rows)
-    
+        _log(f"   Columna '{date_column}': {rows_with_date}/{len(new)} filas con valor")
+
     # Debug: Show sample dates from new file
     sample_new_dates = list(new_date_keys)[:3]
-    _log(f"→ Archivo nuevo tiene {len(new_rows)} filas con {len(new_date_keys)} fechas únicas")
+    _log(f"→ Archivo nuevo tiene {len(new)} filas con {len(new_date_keys)} fechas únicas")
     if sample_new_dates:
         _log(f"   Ejemplos de fechas nuevas: {', '.join(sample_new_dates)}")
 
     # Filter out old rows whose date is in new set and track what's being replaced
-    kept_old_rows: List[Dict[str, str]] = []
-    removed_rows_by_date = Counter()
+    kept: List[int] = []
+    kept_keys: List[str] = []
+    removed: List[int] = []
+    removed_keys: List[str] = []
+    removed_rows_by_date: Counter = stats["removed_by_date"]
     old_date_keys = set()
-    
-    for r in old_rows:
-        key = _normalize_date_for_key(r.get(date_column, ""), normalize_date)
-        old_date_keys.add(key)
-        if key not in new_date_keys:
-            kept_old_rows.append(r)
-        else:
-            removed_rows_by_date[key] += 1
-    
+
+    with span("date_keys", side="old", rows=len(old)):
+        for i, key in enumerate(_table_date_keys(old, date_column, normalize_date)):
+            old_date_keys.add(key)
+            if key not in new_date_keys:
+                kept.append(i)
+                kept_keys.append(key)
+            else:
+                removed.append(i)
+                removed_keys.append(key)
+                removed_rows_by_date[key] += 1
+    stats["kept_rows"] = len(kept)
+    stats["date_keys"] = kept_keys + new_row_keys
+    if field_set == old.fieldnames:
+        with span("fingerprint", rows=len(removed) + len(new)):
+            old_fingerprints = _date_fingerprints(zip(*old.select(field_set, removed)), removed_keys)
+            new_fingerprints = _date_fingerprints(zip(*new.select(field_set)), new_row_keys)
+        stats["changed_date_keys"] = {k for k in new_date_keys if old_fingerprints.get(k) != new_fingerprints[k]}
+
     # Debug: Show sample dates from old file
     sample_old_dates = list(old_date_keys)[:3]
-    _log(f"→ Archivo viejo tiene {len(old_rows)} filas con {len(old_date_keys)} fechas únicas")
+    _log(f"→ Archivo viejo tiene {len(old)} filas con {len(old_date_keys)} fechas únicas")
     if sample_old_dates:
         _log(f"   Ejemplos de fechas viejas: {', '.join(sample_old_dates)}")
-    
+
     # Summary logging
     if removed_rows_by_date:
-        _log(f"→ Reemplazando {len(removed_rows_by_date)} fechas ({sum(removed_rows_by_date.values())} → {len(new_rows)} filas)")
+        _log(f"→ Reemplazando {len(removed_rows_by_date)} fechas ({sum(removed_rows_by_date.values())} → {len(new)} filas)")
     else:
-        _log(f"→ Agregando {len(new_rows)} filas nuevas (sin fechas coincidentes)")
+        _log(f"→ Agregando {len(new)} filas nuevas (sin fechas coincidentes)")
+
+    # Combine: non-replaced old rows keep their order, new rows go at the end
+    with span("merge", rows=len(kept) + len(new)):
+        kept_columns = old.select(field_set, None if len(kept) == len(old) else kept)
+        merged = CsvTable(field_set, [k + n for k, n in zip(kept_columns, new.select(field_set))])
+
+    _log(f"→ Resultado merge: {len(kept)} viejas mantenidas + {len(new)} nuevas = {len(merged)} total")
+
+    return merged, stats
+
+
+def merge_csv_by_date(existing_csv_text: str,
+                      new_csv_path: str,
+                      date_column: str,
+                      normalize_date: bool = True,
+                      preserve_order: bool = True) -> str:
+    """Merge two CSVs replacing all rows for matching dates with rows from new CSV.
+
+    - existing_csv_text: current CSV content from Drive
+    - new_csv_path: local path to newly downloaded CSV
+    - date_column: column name that carries the date
+    - normalize_date: if True, attempt to parse and compare by date-only (YYYY-MM-DD)
+    - preserve_order: if True, keep original order for non-replaced rows; appended new rows go at the end
+
+    Returns merged CSV as text. Callers that already hold parsed tables should use
+    merge_tables_by_date directly to avoid parsing twice.
+    """
+    # Read both datasets
+    old = _read_csv_to_table(existing_csv_text, date_column, normalize_date)
+    new = _read_csv_file_to_table(new_csv_path, date_column, normalize_date)
+
+    _log(f"DEBUG: Archivo local leído - {len(new)} filas totales")
+
+    merged, _ = merge_tables_by_date(old, new, date_column, normalize_date=normalize_date)
+    return _write_table_to_csv_text(merged)
+
+
+def combine_csv_files(csv_paths: List[str], out_path: str) -> int:
+    """Concatenate CSV exports (e.g. the windows of a backfill) into one CSV and return its rows.
+
+    Every file is cleaned and parsed like a regular export; the header is the ordered union of
+    theirs and missing cells are "". The result at out_path can go through a single merge.
+    """
+    tables = [_read_csv_file_to_table(path) for path in csv_paths]
+    fieldnames = list(dict.fromkeys(name for table in tables for name in table.fieldnames))
+    columns: List[List[str]] = [[] for _ in fieldnames]
+    for table in tables:
+        for col, values in zip(columns, table.select(fieldnames)):
+            col.extend(values)
+    combined = CsvTable(fieldnames, columns)
+    with open(out_path, "wb") as fh:
+        _write_table_to_stream(combined, fh)
+    return len(combined)
+
+
+_DATE_INDEX_PROPERTY = "dateIndexFileId"
+_DATE_INDEX_VERSION = 1
+
 
-    # Combine
-    if preserve_order:
-        merged_rows = kept_old_rows + new_rows
+def _date_index_enabled() -> bool:
+    return os.getenv("DRIVE_DATE_INDEX", "on").strip().lower() not in ("off", "false", "0")
+
+
+def _load_date_index(file_id: str, metadata: Dict[str, str], date_column: str,
+                     normalize_date: bool) -> Optional[Dict[str, object]]:
+    """Return the date index of a Drive CSV if it still describes the file's current content.
+
+    The index lives in a JSON file next to the CSV whose ID is stored in the CSV's appProperties
+    (a local copy in DRIVE_CACHE_DIR saves downloading it). It is ignored (None) if it is missing,
+    was built for another date column/normalization or its md5Checksum doesn't match the file
+    (e.g. someone edited the CSV by hand).
+    """
+    index_id = (metadata.get("appProperties") or {}).get(_DATE_INDEX_PROPERTY)
+    if not index_id or not _date_index_enabled():
+        return None
+    local_path = _drive_cache_path(file_id, f".{metadata.get('md5Checksum')}.index.json")
+    try:
+        if local_path and os.path.isfile(local_path):
+            with open(local_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        else:
+            index = json.loads(download_csv_text(index_id))
+    except Exception as e:
+        _log(f"   Índice de fechas ilegible, se hará merge completo: {e}")
+        return None
+    if (index.get("version") != _DATE_INDEX_VERSION
+            or not metadata.get("md5Checksum")
+            or index.get("md5Checksum") != metadata.get("md5Checksum")
+            or index.get("date_column") != date_column
+            or index.get("normalize_date") != normalize_date):
+        _log("   Índice de fechas desactualizado, se hará merge completo")
+        return None
+    return index
+
+
+def _save_date_index(file_id: str, metadata: Dict[str, str], result: Dict[str, str],
+                     index: Dict[str, object], date_column: str, normalize_date: bool) -> None:
+    """Upload the index of the CSV just uploaded (result) and link it from the CSV's appProperties.
+
+    The index is an optimization: failures are only logged and the next run does a full merge.
+    """
+    if not result.get("md5Checksum") or not _date_index_enabled():
+        return
+    runs = index["runs"]
+    if len(runs) > 1000 and len(runs) * 4 > sum(run[3] for run in runs):
+        # Filas sin agrupar por fecha: el índice sería casi tan grande como el archivo
+        _log(f"   Historial sin orden por fecha ({len(runs)} tramos): índice de fechas omitido")
+        return
+    index = dict(index, version=_DATE_INDEX_VERSION, md5Checksum=result["md5Checksum"],
+                 date_column=date_column, normalize_date=normalize_date)
+    text = json.dumps(index, separators=(",", ":"))
+    data = text.encode("utf-8")
+    _store_cached_file(file_id, f".{result['md5Checksum']}.index.json", io.BytesIO(data))
+    try:
+        _publish_sidecar(file_id, metadata, _DATE_INDEX_PROPERTY, f"{metadata.get('name') or file_id}.date-index.json",
+                         io.BytesIO(data), len(data), "application/json")
+    except Exception as e:
+        _log(f"   No se pudo guardar el índice de fechas: {e}")
+
+
+def _publish_sidecar(file_id: str, metadata: Dict[str, str], prop: str, name: str,
+                     fh, size: int, mimetype: str) -> Optional[str]:
+    """Overwrite the file linked from file_id's appProperties[prop] with fh, creating it if needed.
+
+    Without a link, a file called `name` in file_id's folder (e.g. left by a run that failed
+    before linking it) is reused; only if there is none a new one is created. Either way it is
+    linked from the CSV's appProperties. Without the CSV's metadata the link is unknown, so
+    nothing is published (None); otherwise returns the sidecar's ID.
+    """
+    if not metadata.get("id"):
+        _log(f"   Sin metadatos del CSV: {name} no se publica en esta ejecución")
+        return None
+    sidecar_id = (metadata.get("appProperties") or {}).get(prop)
+    if sidecar_id:
+        upload_csv_stream(sidecar_id, fh, size, mimetype=mimetype)
+        return sidecar_id
+    sidecar_id = find_sibling_file(name, file_id)
+    if sidecar_id:
+        upload_csv_stream(sidecar_id, fh, size, mimetype=mimetype)
+        _log(f"   Archivo existente junto al CSV reutilizado: {name} ({sidecar_id})")
     else:
-        # Optionally sort by date after combining (not default)
-        merged_rows = kept_old_rows + new_rows
-    
-    _log(f"→ Resultado merge: {len(kept_old_rows)} viejas mantenidas + {len(new_rows)} nuevas = {len(merged_rows)} total")
-    
-    return _write_rows_to_csv_text(field_set, merged_rows)
+        sidecar_id = create_file_stream(name, fh, size, file_id, mimetype=mimetype)
+        _log(f"   Archivo creado junto al CSV: {name} ({sidecar_id})")
+    set_app_properties(file_id, {prop: sidecar_id})
+    metadata.setdefault("appProperties", {})[prop] = sidecar_id
+    return sidecar_id
+
+
+# Optimized copies published next to the CSV (DRIVE_EXTRA_FORMATS): appProperties key, mimetype
+_EXTRA_FORMATS = {
+    "gzip": ("gzipFileId", "application/gzip"),
+    "parquet": ("parquetFileId", "application/vnd.apache.parquet"),
+}
+
+
+def _extra_formats() -> List[str]:
+    """Formats requested in DRIVE_EXTRA_FORMATS (comma-separated: gzip, parquet)."""
+    formats = []
+    for fmt in os.getenv("DRIVE_EXTRA_FORMATS", "").lower().split(","):
+        fmt = fmt.strip()
+        if not fmt or fmt in formats:
+            continue
+        if fmt not in _EXTRA_FORMATS:
+            _log(f"⚠ DRIVE_EXTRA_FORMATS: formato desconocido '{fmt}' (usa gzip, parquet)")
+        elif fmt == "parquet" and pa is None:
+            _log("⚠ DRIVE_EXTRA_FORMATS=parquet requiere pyarrow (pip install pyarrow): se omite")
+        else:
+            formats.append(fmt)
+    return formats
+
+
+def _write_gzip_artifact(csv_fh, out_fh) -> int:
+    """Gzip the CSV bytes in csv_fh into out_fh and return the compressed size."""
+    csv_fh.seek(0)
+    start = out_fh.tell()
+    # mtime=0 keeps the output identical for identical CSVs
+    with gzip.GzipFile(filename="", mode="wb", fileobj=out_fh, compresslevel=6, mtime=0) as gz:
+        shutil.copyfileobj(csv_fh, gz, _CSV_CHUNK_SIZE)
+    return out_fh.tell() - start
+
+
+def _typed_parquet_column(values):
+    """Narrow a string column to int64/float64 when every non-empty value round-trips unchanged
+    (so codes like '00123' stay text); otherwise dictionary-encode it. Empty cells become null."""
+    present = pc.filter(values, pc.not_equal(values, ""))
+    if len(present):
+        for target in (pa.int64(), pa.float64()):
+            try:
+                typed = pc.cast(present, target)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                continue
+            if pc.all(pc.equal(pc.cast(typed, pa.string()), present)).as_py():
+                return pc.cast(pc.if_else(pc.equal(values, ""), pa.scalar(None, pa.string()), values), target)
+    return pc.dictionary_encode(values)
+
+
+def _write_parquet_artifact(csv_fh, index: Dict[str, object], date_column: str, out_fh) -> int:
+    """Convert the merged CSV in csv_fh to Parquet in out_fh and return its size.
+
+    Columns are typed with _typed_parquet_column and '<date_column>_date' holds each row's
+    date key (from the date index runs) as a date. Requires pyarrow.
+    """
+    fieldnames: List[str] = index["fieldnames"]
+    csv_fh.seek(0)
+    table = pa_csv.read_csv(
+        csv_fh,
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={name: pa.string() for name in fieldnames},
+            strings_can_be_null=False,
+        ),
+    )
+    columns = [_typed_parquet_column(table.column(i)) for i in range(table.num_columns)]
+    keys = pa.array([run[0] for run in index["runs"] for _ in range(run[3])], pa.string())
+    dates = pc.cast(pc.strptime(keys, format="%Y-%m-%d", unit="s", error_is_null=True), pa.date32())
+    typed = pa.table(columns + [dates], names=list(table.column_names) + [f"{date_column}_date"])
+    start = out_fh.tell()
+    pq.write_table(typed, out_fh)
+    return out_fh.tell() - start
+
+
+def _publish_extra_formats(file_id: str, metadata: Dict[str, str], csv_fh, csv_size: int,
+                           index: Dict[str, object], date_column: str) -> None:
+    """Publish the DRIVE_EXTRA_FORMATS copies of the CSV just uploaded. Failures are only logged."""
+    base_name = metadata.get("name") or file_id
+    stem = base_name[:-4] if base_name.lower().endswith(".csv") else base_name
+    for fmt in _extra_formats():
+        prop, mimetype = _EXTRA_FORMATS[fmt]
+        try:
+            with tempfile.SpooledTemporaryFile(max_size=_UPLOAD_SPOOL_MAX_BYTES) as out:
+                if fmt == "gzip":
+                    size = _write_gzip_artifact(csv_fh, out)
+                    name = f"{base_name}.gz"
+                else:
+                    size = _write_parquet_artifact(csv_fh, index, date_column, out)
+                    name = f"{stem}.parquet"
+                out.seek(0)
+                _publish_sidecar(file_id, metadata, prop, name, out, size, mimetype)
+            _log(f"   Copia {fmt}: {size / (1024 * 1024):.2f} MB ({size / max(csv_size, 1):.0%} del CSV)")
+        except Exception as e:
+            _log(f"   No se pudo publicar la copia {fmt}: {e}")
+
+
+def _store_cached_file(file_id: str, suffix: str, fh) -> None:
+    """Copy fh into the local cache as '<file_id><suffix>', where suffix is '.<md5>.<ext>'.
+
+    Copies of older versions (same file_id and extension) are removed. Failures are only logged.
+    """
+    path = _drive_cache_path(file_id, suffix)
+    if not path:
+        return
+    try:
+        fh.seek(0)
+        with open(path + ".tmp", "wb") as f:
+            shutil.copyfileobj(fh, f)
+        os.replace(path + ".tmp", path)
+        ext = suffix.split(".", 2)[2]
+        for stale in glob.glob(_drive_cache_path(glob.escape(file_id), f".*.{ext}")):
+            if stale != path and stale.count(".") == path.count("."):
+                os.remove(stale)
+    except Exception as e:
+        _log(f"   No se pudo guardar copia local: {e}")
+
+
+@contextlib.contextmanager
+def _open_history_bytes(file_id: str, md5: str):
+    """Yield a binary file with the Drive CSV's bytes: the local copy if it matches md5, else a download."""
+    path = _drive_cache_path(file_id, f".{md5}.csv")
+    if path and os.path.isfile(path):
+        _log("   Copia local vigente: descarga omitida")
+        with open(path, "rb") as f:
+            yield f
+        return
+    with tempfile.TemporaryFile() as f:
+        with span("drive_download", raw=True) as s:
+            s.set(bytes=download_file_to(file_id, f))
+        yield f
+
+
+def _copy_byte_span(src, start: int, end: int, dst) -> None:
+    src.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        data = src.read(min(remaining, _CSV_CHUNK_SIZE))
+        if not data:
+            raise RuntimeError(f"Archivo más corto que su índice de fechas (faltan {remaining} bytes)")
+        dst.write(data)
+        remaining -= len(data)
+
+
+def _merge_with_date_index(file_id: str,
+                           index: Dict[str, object],
+                           new: CsvTable,
+                           date_column: str,
+                           normalize_date: bool,
+                           out_fh) -> Tuple[int, Dict[str, object], Dict[str, object]]:
+    """Merge `new` into the Drive CSV described by `index`, writing the result into out_fh.
+
+    Only the new rows are parsed and date-keyed: old rows of dates absent from the new export
+    are copied through as raw byte spans, so the cost follows the replaced window rather than
+    the history. The caller must check that new's columns are a subset of index["fieldnames"].
+    Returns (bytes written, index of the output, stats like merge_tables_by_date's).
+    """
+    fieldnames: List[str] = index["fieldnames"]
+    new_dates = new.column(date_column) or [""] * len(new)
+    with span("date_keys", side="new", rows=len(new_dates)):
+        new_row_keys = _table_date_keys(new, date_column, normalize_date)
+    inserted_by_date: Counter = Counter(new_row_keys)
+    new_date_keys = set(inserted_by_date)
+
+    removed_by_date: Counter = Counter()
+    kept_runs = []
+    for run in index["runs"]:
+        if run[0] in new_date_keys:
+            removed_by_date[run[0]] += run[3]
+        else:
+            kept_runs.append(run)
+    kept_rows = sum(run[3] for run in kept_runs)
+
+    _log(f"→ Archivo nuevo tiene {len(new)} filas con {len(new_date_keys)} fechas únicas")
+    _log(f"→ Índice de fechas: {len(kept_runs)} de {len(index['runs'])} tramos se copian sin parsear")
+    if removed_by_date:
+        _log(f"→ Reemplazando {len(removed_by_date)} fechas ({sum(removed_by_date.values())} → {len(new)} filas)")
+    else:
+        _log(f"→ Agregando {len(new)} filas nuevas (sin fechas coincidentes)")
+
+    header_bytes: int = index["header_bytes"]
+    runs: List[list] = []
+    offset = header_bytes
+    with _open_history_bytes(file_id, index["md5Checksum"]) as old_file:
+        # Only the replaced window is parsed, to tell whether its rows actually changed
+        with span("fingerprint", rows=sum(removed_by_date.values()) + len(new)):
+            old_rows: List[List[str]] = []
+            old_keys: List[str] = []
+            for key, start, end, rows in index["runs"]:
+                if key in new_date_keys:
+                    old_file.seek(start)
+                    parsed = list(csv.reader(io.StringIO(old_file.read(end - start).decode("utf-8"))))
+                    old_rows.extend(parsed)
+                    old_keys.extend([key] * len(parsed))
+            old_fingerprints = _date_fingerprints(old_rows, old_keys)
+            new_fingerprints = _date_fingerprints(zip(*new.select(fieldnames)), new_row_keys)
+
+        with span("merge", indexed=True, rows=kept_rows + len(new)) as s:
+            _copy_byte_span(old_file, 0, header_bytes, out_fh)
+            span_start = span_end = None
+            for key, start, end, rows in kept_runs:
+                # Adjacent runs are copied in one go
+                if start != span_end:
+                    if span_start is not None:
+                        _copy_byte_span(old_file, span_start, span_end, out_fh)
+                    span_start = start
+                span_end = end
+                if runs and runs[-1][0] == key and runs[-1][2] == offset:
+                    runs[-1][2] += end - start
+                    runs[-1][3] += rows
+                else:
+                    runs.append([key, offset, offset + end - start, rows])
+                offset += end - start
+            if span_start is not None:
+                _copy_byte_span(old_file, span_start, span_end, out_fh)
+
+            size = _write_rows_indexed(zip(*new.select(fieldnames)), new_row_keys, out_fh, offset, runs)
+            s.set(bytes=size)
+    _log(f"→ Resultado merge: {kept_rows} viejas mantenidas + {len(new)} nuevas = {kept_rows + len(new)} total")
+
+    stats: Dict[str, object] = {
+        "new_date_keys": new_date_keys,
+        "inserted_by_date": inserted_by_date,
+        "removed_by_date": removed_by_date,
+        "kept_rows": kept_rows,
+        "changed_date_keys": {k for k in new_date_keys if old_fingerprints.get(k) != new_fingerprints[k]},
+    }
+    return size, {"fieldnames": fieldnames, "header_bytes": header_bytes, "runs": runs}, stats
+
+
+def _history_store() -> Optional[HistoryStore]:
+    """SQLite copy of the histories (DRIVE_HISTORY_DB=path), or None if it isn't configured."""
+    path = os.getenv("DRIVE_HISTORY_DB", "").strip()
+    if not path or path.lower() in ("off", "false", "0"):
+        return None
+    return HistoryStore(path)
+
+
+def _sync_history_store(store: HistoryStore, report: str, file_id: str, metadata: Dict[str, str],
+                        date_column: str, normalize_date: bool) -> bool:
+    """Make sure the store holds the current Drive CSV of `report`, loading it if it doesn't.
+
+    The store is current if its rows came from this file at its current md5Checksum with the
+    same date keys; otherwise (first run, someone edited the CSV by hand) the CSV is downloaded
+    once and replaces the report's rows. Returns False if the store can't be used this time
+    (including database errors such as a lock held too long or a corrupt file).
+    """
+    source = {"file_id": file_id, "md5": metadata.get("md5Checksum"),
+              "date_column": date_column, "normalize_date": normalize_date}
+    try:
+        state = store.state(report)
+    except Exception as e:
+        _log(f"   No se pudo leer la base de historial, se hará merge sin ella: {e}")
+        return False
+    if state is not None and source["md5"] and all(state[k] == v for k, v in source.items()):
+        return True
+    _log(f"   Base de historial desactualizada para {report}, se carga desde Drive")
+    try:
+        old = download_csv_table(file_id, metadata, date_column, normalize_date)
+    except Exception as e:
+        _log(f"   No se pudo descargar el historial para la base local: {e}")
+        return False
+    if not supports_fieldnames(old.fieldnames):
+        _log("   Encabezado del CSV no admitido por la base de historial, se hará merge sin ella")
+        return False
+    try:
+        with span("history_load", rows=len(old)):
+            keys = _table_date_keys(old, date_column, normalize_date)
+            store.replace(report, old.fieldnames, zip(*old.columns), keys, source)
+    except Exception as e:
+        _log(f"   No se pudo cargar la base de historial, se hará merge sin ella: {e}")
+        return False
+    _log(f"   Base de historial cargada: {len(old)} filas")
+    return True
+
+
+def _merge_with_history_store(store: HistoryStore,
+                              report: str,
+                              new: CsvTable,
+                              date_column: str,
+                              normalize_date: bool,
+                              out_fh) -> Tuple[int, Dict[str, object], Dict[str, object]]:
+    """Merge `new` into the stored history of `report`, writing the resulting CSV into out_fh.
+
+    The replaced dates are read through the store's date index to fingerprint them, and the
+    rest of the history is streamed from one query in CSV order; the store itself is not
+    modified (see _upsert_history_store). Returns (bytes written, index of the output, stats
+    like merge_tables_by_date's plus new_row_keys, the date key of each new row).
+    """
+    fieldnames = list(store.state(report)["fieldnames"])
+    fieldnames += [name for name in new.fieldnames if name not in fieldnames]
+    with span("date_keys", side="new", rows=len(new)):
+        new_row_keys = _table_date_keys(new, date_column, normalize_date)
+    inserted_by_date: Counter = Counter(new_row_keys)
+    new_date_keys = set(inserted_by_date)
+    _log(f"→ Archivo nuevo tiene {len(new)} filas con {len(new_date_keys)} fechas únicas")
+
+    with span("fingerprint", rows=len(new)) as s:
+        old_keys: List[str] = []
+        old_rows: List[tuple] = []
+        for key, row in store.rows_for_dates(report, fieldnames, sorted(new_date_keys)):
+            old_keys.append(key)
+            old_rows.append(row)
+        removed_by_date: Counter = Counter(old_keys)
+        old_fingerprints = _date_fingerprints(old_rows, old_keys)
+        new_fingerprints = _date_fingerprints(zip(*new.select(fieldnames)), new_row_keys)
+        s.add(rows=len(old_rows))
+    del old_rows, old_keys
+    if removed_by_date:
+        _log(f"→ Reemplazando {len(removed_by_date)} fechas ({sum(removed_by_date.values())} → {len(new)} filas)")
+    else:
+        _log(f"→ Agregando {len(new)} filas nuevas (sin fechas coincidentes)")
+
+    header = io.StringIO()
+    csv.writer(header, lineterminator='\n').writerow(fieldnames)
+    header_bytes = header.getvalue().encode("utf-8")
+    with span("merge", history_store=True) as s:
+        out_fh.write(header_bytes)
+        runs: List[list] = []
+        offset = len(header_bytes)
+        kept_rows = 0
+        for batch in store.iter_batches(report, fieldnames, skip_dates=new_date_keys):
+            kept_rows += len(batch)
+            offset = _write_rows_indexed((row[1:] for row in batch), [row[0] for row in batch],
+                                         out_fh, offset, runs)
+        size = _write_rows_indexed(zip(*new.select(fieldnames)), new_row_keys, out_fh, offset, runs)
+        s.set(bytes=size, rows=kept_rows + len(new))
+    _log(f"→ Resultado merge: {kept_rows} viejas mantenidas + {len(new)} nuevas = {kept_rows + len(new)} total")
+
+    stats: Dict[str, object] = {
+        "new_date_keys": new_date_keys,
+        "inserted_by_date": inserted_by_date,
+        "removed_by_date": removed_by_date,
+        "kept_rows": kept_rows,
+        "changed_date_keys": {k for k in new_date_keys if old_fingerprints.get(k) != new_fingerprints[k]},
+        "new_row_keys": new_row_keys,
+    }
+    return size, {"fieldnames": fieldnames, "header_bytes": len(header_bytes), "runs": runs}, stats
+
+
+def _upsert_history_store(store: HistoryStore, report: str, file_id: str, result: Dict[str, str],
+                          new: CsvTable, fieldnames: List[str], new_row_keys: List[str],
+                          date_column: str, normalize_date: bool) -> None:
+    """Apply an uploaded merge to the store: delete the new dates and bulk insert the new rows.
+
+    Runs after the upload so the store always matches what Drive has; if it fails, the next run
+    reloads the store from Drive (the recorded md5Checksum no longer matches).
+    """
+    source = {"file_id": file_id, "md5": result.get("md5Checksum"),
+              "date_column": date_column, "normalize_date": normalize_date}
+    try:
+        with span("history_upsert", rows=len(new)):
+            store.upsert(report, fieldnames, zip(*new.select(fieldnames)), new_row_keys, source)
+    except Exception as e:
+        _log(f"   No se pudo actualizar la base de historial: {e}")
 
 
 def update_drive_csv_file(file_id: str,
@@ -346,73 +1696,316 @@ def update_drive_csv_file(file_id: str,
                           date_column: str,
                           normalize_date: bool = True,
                           dry_run: bool = False,
-                          preview_path: Optional[str] = None) -> None:
+                          preview_path: Optional[str] = None,
+                          report: Optional[str] = None) -> None:
     """Download, merge by date and upload CSV back to Drive.
 
+    Each input is parsed exactly once and handed to merge_tables_by_date as parsed tables; the
+    Drive file is only downloaded if it changed since the cached copy (see download_csv_table).
+    Every upload also saves a date index of the file (DRIVE_DATE_INDEX); while it's current the
+    next merge copies untouched dates as raw bytes instead of parsing the history. If no date's
+    rows changed (same per-date fingerprints) the upload is skipped.
+    With DRIVE_HISTORY_DB the merge reads the history from a local SQLite copy instead (table
+    `report`, the file ID if not given) and applies the new rows to it once Drive has them.
     If dry_run=True, don't upload; optionally write merged preview to preview_path and log summary.
     """
     _log(f"Procesando actualización de Drive...")
     file_id = _normalize_file_id(file_id)
-    
-    existing_text = ""
-    old_fields: List[str] = []
-    old_rows: List[Dict[str, str]] = []
+
+    metadata: Dict[str, str] = {}
+    index = None
     try:
-        existing_text = download_csv_text(file_id)
-        old_fields, old_rows = _read_csv_to_rows(existing_text)
-        _log(f"Descargado archivo existente: {len(old_rows)} filas")
+        with span("drive_metadata"):
+            metadata = get_file_metadata(file_id)
+            index = _load_date_index(file_id, metadata, date_column, normalize_date)
     except Exception as e:
-        _log(f"No se pudo descargar archivo existente: {e}")
+        _log(f"No se pudo leer el archivo existente: {e}")
 
-    # Read new data for info
-    new_fields, new_rows = _read_csv_file_to_rows(new_csv_path)
-    _log(f"Archivo nuevo: {len(new_rows)} filas")
-    
-    # Build new date keys set for summary
-    new_date_keys = set(_normalize_date_for_key(r.get(date_column, ""), normalize_date) for r in new_rows)
-    
-    removed_count = 0
-    if old_rows:
-        for r in old_rows:
-            key = _normalize_date_for_key(r.get(date_column, ""), normalize_date)
-            if key in new_date_keys:
-                removed_count += 1
-    
-    merged_text = merge_csv_by_date(existing_text, new_csv_path, date_column, normalize_date=normalize_date)
+    # Read new data once; the parsed table feeds the merge directly
+    new = _read_csv_file_to_table(new_csv_path, date_column, normalize_date)
+    _log(f"Archivo nuevo: {len(new)} filas")
 
-    if dry_run:
-        _log(f"DRY_RUN: {len(new_date_keys)} fechas, {removed_count} filas reemplazadas, {len(new_rows)} filas nuevas")
-        if preview_path:
+    store = _history_store() if metadata else None
+    report = report or file_id
+    if store is not None and not (supports_fieldnames(new.fieldnames)
+                                  and _sync_history_store(store, report, file_id, metadata,
+                                                          date_column, normalize_date)):
+        store = None
+
+    if index is not None and not set(new.fieldnames) <= set(index["fieldnames"]):
+        _log("   Columnas nuevas respecto al índice de fechas, se hará merge completo")
+        index = None
+
+    # El CSV combinado se escribe a un archivo temporal (en memoria hasta 16MB) y se sube desde ahí
+    with tempfile.SpooledTemporaryFile(max_size=_UPLOAD_SPOOL_MAX_BYTES) as merged_file:
+        if store is not None:
             try:
-                os.makedirs(os.path.dirname(preview_path) or '.', exist_ok=True)
-                with open(preview_path, 'w', encoding='utf-8', newline='') as f:
-                    f.write(merged_text)
-                _log(f"Preview guardado: {preview_path}")
+                size, merged_index, stats = _merge_with_history_store(
+                    store, report, new, date_column, normalize_date, merged_file
+                )
+                merged = None
+                merged_rows = stats["kept_rows"] + len(new)
             except Exception as e:
-                _log(f"Error al escribir preview: {e}")
+                # La base queda desactualizada (su md5 ya no coincide) y se recarga en la próxima ejecución
+                _log(f"   Error en la base de historial, se hará merge sin ella: {e}")
+                store = None
+                merged_file.seek(0)
+                merged_file.truncate()
+        if store is None and index is not None:
+            size, merged_index, stats = _merge_with_date_index(
+                file_id, index, new, date_column, normalize_date, merged_file
+            )
+            merged = None
+            merged_rows = stats["kept_rows"] + len(new)
+        elif store is None:
+            old = CsvTable([], [])
+            if metadata:
+                try:
+                    old = download_csv_table(file_id, metadata, date_column, normalize_date)
+                    _log(f"Descargado archivo existente: {len(old)} filas")
+                except Exception as e:
+                    _log(f"No se pudo descargar archivo existente: {e}")
+
+            merged, stats = merge_tables_by_date(old, new, date_column, normalize_date=normalize_date)
+            del old
+            with span("write_csv", rows=len(merged)) as s:
+                size, merged_index = _write_table_indexed(merged, stats["date_keys"], merged_file)
+                s.set(bytes=size)
+            merged_rows = len(merged)
+        merged_file.seek(0)
+        new_date_keys = stats["new_date_keys"]
+        removed_count = sum(stats["removed_by_date"].values())
+        changed = sorted(stats["changed_date_keys"])
+        if changed:
+            more = f" y {len(changed) - 10} más" if len(changed) > 10 else ""
+            _log(f"→ Fechas con cambios: {len(changed)} de {len(new_date_keys)} ({', '.join(changed[:10])}{more})")
+        else:
+            _log(f"→ Fechas con cambios: ninguna de {len(new_date_keys)}")
+
+        if dry_run:
+            _log(f"DRY_RUN: {len(new_date_keys)} fechas, {removed_count} filas reemplazadas, {len(new)} filas nuevas")
+            if preview_path:
+                try:
+                    os.makedirs(os.path.dirname(preview_path) or '.', exist_ok=True)
+                    with open(preview_path, 'wb') as f:
+                        shutil.copyfileobj(merged_file, f)
+                    _log(f"Preview guardado: {preview_path}")
+                except Exception as e:
+                    _log(f"Error al escribir preview: {e}")
+            return
+
+        if metadata and not changed:
+            _log(f"✓ Sin cambios respecto a Drive: upload omitido ({size / (1024 * 1024):.2f} MB ahorrados)")
+            current_span().set(upload_skipped=True, bytes_saved=size)
+            return
+
+        _log("Subiendo archivo combinado a Drive...")
+        _log(f"   Tamaño del archivo: {size / (1024 * 1024):.2f} MB")
+        _log(f"   Filas finales en merge: {merged_rows}")
+
+        try:
+            with span("upload", bytes=size, rows=merged_rows):
+                result = upload_csv_stream(file_id, merged_file, size)
+            if store is not None:
+                _upsert_history_store(store, report, file_id, result, new, merged_index["fieldnames"],
+                                      stats["new_row_keys"], date_column, normalize_date)
+            # La próxima ejecución reutiliza estas filas si nadie más modifica el archivo
+            if merged is not None:
+                _store_cached_table(file_id, result, merged)
+            if _date_index_enabled() and result.get("md5Checksum"):
+                _store_cached_file(file_id, f".{result['md5Checksum']}.csv", merged_file)
+            with span("date_index"):
+                _save_date_index(file_id, metadata, result, merged_index, date_column, normalize_date)
+            with span("extra_formats"):
+                _publish_extra_formats(file_id, metadata, merged_file, size, merged_index, date_column)
+            _log(f"✓ Actualización completada: {len(new_date_keys)} fechas, {removed_count} filas actualizadas")
+            _log(f"✓ Upload exitoso confirmado")
+        except Exception as e:
+            _log(f"✗ Error al subir a Drive: {e}")
+            _log(f"✗ Tipo de error: {type(e).__name__}")
+            import traceback
+            _log(f"✗ Traceback: {traceback.format_exc()}")
+            raise
+
+
+class DriveCsvStore:
+    """CSV text files on Google Drive, addressed by file ID (used by the partitioned sync)."""
+
+    def download(self, file_id: str) -> str:
+        return download_csv_text(file_id)
+
+    def upload(self, file_id: str, text: str) -> None:
+        upload_csv_text(file_id, text)
+
+    def create(self, name: str, text: str, sibling_file_id: str) -> str:
+        return create_csv_file(name, text, sibling_file_id)
+
+
+class LocalCsvStore:
+    """Local stand-in for DriveCsvStore: every file ID is a file inside root_dir.
+
+    Downloading an ID that doesn't exist returns "" like an empty Drive file.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+
+    def _path(self, file_id: str) -> str:
+        return os.path.join(self.root_dir, _normalize_file_id(file_id))
+
+    def download(self, file_id: str) -> str:
+        path = self._path(file_id)
+        if not os.path.isfile(path):
+            return ""
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            return f.read()
+
+    def upload(self, file_id: str, text: str) -> None:
+        with open(self._path(file_id), "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+
+    def create(self, name: str, text: str, sibling_file_id: str) -> str:
+        file_id = f"local-{name}"
+        self.upload(file_id, text)
+        return file_id
+
+
+def _partition_for_date_key(key: str, partition: str) -> str:
+    """Return the partition name for a normalized date key: 'YYYY-MM', 'YYYY-Www' or 'undated'."""
+    try:
+        d = date.fromisoformat(key)
+    except ValueError:
+        return "undated"
+    if partition == "week":
+        iso_year, iso_week, _ = d.isocalendar()
+        return f"{iso_year}-W{iso_week:02d}"
+    return f"{d.year}-{d.month:02d}"
+
+
+def update_drive_partitioned(manifest_file_id: str,
+                             new_csv_path: str,
+                             date_column: str,
+                             name_prefix: str,
+                             partition: str = "month",
+                             normalize_date: bool = True,
+                             dry_run: bool = False,
+                             store=None) -> None:
+    """Merge the new export into a history split in one file per month (or ISO week).
+
+    The file at manifest_file_id holds a JSON manifest mapping each partition to its file ID.
+    Only the partitions whose dates appear in the new export are downloaded, merged with
+    merge_tables_by_date and uploaded; partitions missing from the manifest are created next to
+    it as '<name_prefix>-<partition>.csv' and the manifest is saved right away, so a later
+    failure can't leave a created file unrecorded (and duplicated by the next run). `store`
+    defaults to DriveCsvStore; LocalCsvStore works as a local stand-in.
+    """
+    if partition not in ("month", "week"):
+        raise ValueError(f"partition inválida: {partition!r} (usa 'month' o 'week')")
+    store = store or DriveCsvStore()
+    manifest_file_id = _normalize_file_id(manifest_file_id)
+    _log(f"Procesando actualización particionada ({partition})...")
+
+    manifest_text = store.download(manifest_file_id)
+    try:
+        manifest = json.loads(manifest_text) if manifest_text.strip() else {}
+    except ValueError:
+        raise RuntimeError(
+            f"{manifest_file_id} no es un manifiesto JSON de particiones. Si es el historial en un solo CSV, "
+            f"divídelo una vez con: python plex_downloader.py --split-history {name_prefix}"
+        ) from None
+    if manifest and manifest.get("partition") != partition:
+        raise RuntimeError(
+            f"El manifiesto usa partición '{manifest.get('partition')}', no '{partition}'"
+        )
+    manifest.setdefault("partition", partition)
+    manifest["date_column"] = date_column
+    partitions: Dict[str, Dict[str, object]] = manifest.setdefault("partitions", {})
+
+    def save_manifest() -> None:
+        store.upload(manifest_file_id, json.dumps(manifest, indent=2, sort_keys=True))
+
+    new = _read_csv_file_to_table(new_csv_path, date_column, normalize_date)
+    rows_by_partition: Dict[str, List[int]] = {}
+    for i, key in enumerate(_table_date_keys(new, date_column, normalize_date)):
+        name = _partition_for_date_key(key, partition)
+        rows_by_partition.setdefault(name, []).append(i)
+    _log(f"Archivo nuevo: {len(new)} filas en {len(rows_by_partition)} particiones "
+         f"({', '.join(sorted(rows_by_partition))})")
+
+    for name in sorted(rows_by_partition):
+        entry = partitions.get(name)
+        old = CsvTable([], [])
+        if entry:
+            with span("drive_download", partition=name) as s:
+                old = _read_csv_to_table(store.download(entry["file_id"]), date_column, normalize_date)
+                s.set(rows=len(old))
+        merged, stats = merge_tables_by_date(
+            old, new.take(rows_by_partition[name]), date_column, normalize_date=normalize_date
+        )
+        merged_text = _write_table_to_csv_text(merged)
+        removed_count = sum(stats["removed_by_date"].values())
+        _log(f"   Partición {name}: {removed_count} filas reemplazadas, {len(merged)} filas finales")
+        if dry_run:
+            continue
+        with span("upload", partition=name, bytes=len(merged_text), rows=len(merged)):
+            if entry:
+                store.upload(entry["file_id"], merged_text)
+            else:
+                entry = {"file_id": store.create(f"{name_prefix}-{name}.csv", merged_text, manifest_file_id)}
+                partitions[name] = entry
+                entry["rows"] = len(merged)
+                save_manifest()
+                _log(f"   Partición {name} creada: {entry['file_id']}")
+        entry["rows"] = len(merged)
+
+    if dry_run:
+        _log(f"DRY_RUN: {len(rows_by_partition)} particiones sin subir")
         return
 
-        
-    _log("Subiendo archivo combinado a Drive...")
-    
-    # Verificar tamaño del archivo antes de subir
-    file_size_mb = len(merged_text.encode('utf-8')) / (1024 * 1024)
-    _log(f"   Tamaño del archivo: {file_size_mb:.2f} MB")
-    
-    # Contar filas finales
-    final_rows = merged_text.count('\n') - 1  # -1 for header
-    _log(f"   Filas finales en merge: {final_rows}")
-    
+    save_manifest()
+    _log(f"✓ Actualización particionada completada: {len(rows_by_partition)} de {len(partitions)} particiones reescritas")
+
+
+def split_drive_history(history_file_id: str,
+                        date_column: str,
+                        name_prefix: str,
+                        partition: str = "month",
+                        normalize_date: bool = True,
+                        manifest_file_id: Optional[str] = None,
+                        store=None) -> str:
+    """Split a single-file history into partitions once and return the ID of the new manifest.
+
+    The CSV at history_file_id is left as it is. A manifest '<name_prefix>-manifest.json' and
+    one file per partition are created next to it by update_drive_partitioned, so the result is
+    the same as if the history had always been partitioned. Pass the manifest_file_id of an
+    interrupted split to finish it: partitions already created are merged again, not duplicated.
+    """
+    if partition not in ("month", "week"):
+        raise ValueError(f"partition inválida: {partition!r} (usa 'month' o 'week')")
+    store = store or DriveCsvStore()
+    history_file_id = _normalize_file_id(history_file_id)
+    _log(f"Dividiendo el historial {history_file_id} en particiones ({partition})...")
+    text = store.download(history_file_id)
+    if not text.strip():
+        raise RuntimeError(f"El historial {history_file_id} está vacío")
+    if text.lstrip().startswith("{"):
+        raise RuntimeError(f"{history_file_id} ya es un manifiesto de particiones")
+    if not manifest_file_id:
+        manifest = {"partition": partition, "date_column": date_column, "partitions": {}}
+        manifest_file_id = store.create(f"{name_prefix}-manifest.json",
+                                        json.dumps(manifest, indent=2, sort_keys=True), history_file_id)
+        _log(f"   Manifiesto creado: {manifest_file_id} (si se interrumpe, reanuda con este ID)")
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", encoding="utf-8", newline="", delete=False) as f:
+        f.write(text)
+        tmp_path = f.name
+    del text
     try:
-        upload_csv_text(file_id, merged_text)
-        _log(f"✓ Actualización completada: {len(new_date_keys)} fechas, {removed_count} filas actualizadas")
-        _log(f"✓ Upload exitoso confirmado")
-    except Exception as e:
-        _log(f"✗ Error al subir a Drive: {e}")
-        _log(f"✗ Tipo de error: {type(e).__name__}")
-        import traceback
-        _log(f"✗ Traceback: {traceback.format_exc()}")
-        raise
+        update_drive_partitioned(manifest_file_id, tmp_path, date_column, name_prefix, partition=partition,
+                                 normalize_date=normalize_date, store=store)
+    finally:
+        os.remove(tmp_path)
+    return manifest_file_id
 
 
 def _normalize_file_id(file_id_or_url: str) -> str:
@@ -0,0 +1,192 @@
+"""Local SQLite copy of the report histories kept in Drive (DRIVE_HISTORY_DB).
+
+Each report is a table with one TEXT column per CSV column plus _row (insertion order, the row
+order of the CSV) and _date (the normalized date key, indexed). A _reports table records the
+columns of each report and the Drive file (ID + md5Checksum) its rows match, so the merge knows
+when the copy is still current:
+
+    store = HistoryStore("sync_history.sqlite")
+    for key, row in store.iter_rows("production", fieldnames, skip_dates={"2025-11-20"}):
+        ...
+    store.upsert("production", fieldnames, rows, keys, source)
+
+The tables can be queried directly for analysis. Running this module lists the reports or runs
+a query and prints the result as CSV:
+
+    python history_store.py sync_history.sqlite ["SELECT _date, COUNT(*) FROM production GROUP BY 1"]
+"""
+import csv
+import json
+import os
+import sqlite3
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+_BATCH_ROWS = 5000
+_RESERVED = ("_row", "_date")
+
+
+def _q(name: str) -> str:
+    """Quote an SQL identifier."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def supports_fieldnames(fieldnames: List[str]) -> bool:
+    """Whether a CSV header can be stored as columns (non-empty, unique, not _row/_date)."""
+    return (all(fieldnames) and len(set(fieldnames)) == len(fieldnames)
+            and not set(fieldnames) & set(_RESERVED))
+
+
+class HistoryStore:
+    """Report tables in the SQLite file at `path`. Every call uses its own connection."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS _reports (report TEXT PRIMARY KEY, fieldnames TEXT NOT NULL,"
+                         " file_id TEXT, md5 TEXT, date_column TEXT, normalize_date INTEGER, updated TEXT)")
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def state(self, report: str) -> Optional[Dict[str, object]]:
+        """Columns and source (file_id, md5, date_column, normalize_date) of a report, or None."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT fieldnames, file_id, md5, date_column, normalize_date FROM _reports"
+                               " WHERE report = ?", (report,)).fetchone()
+        if row is None:
+            return None
+        return {"fieldnames": json.loads(row[0]), "file_id": row[1], "md5": row[2],
+                "date_column": row[3], "normalize_date": bool(row[4])}
+
+    @staticmethod
+    def _save_state(conn: sqlite3.Connection, report: str, fieldnames: List[str], source: Dict[str, object]) -> None:
+        conn.execute("INSERT OR REPLACE INTO _reports VALUES (?, ?, ?, ?, ?, ?, ?)", (
+            report, json.dumps(fieldnames), source.get("file_id"), source.get("md5"), source.get("date_column"),
+            int(bool(source.get("normalize_date"))), datetime.now().isoformat(timespec="seconds"),
+        ))
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, report: str, fieldnames: List[str],
+                rows: Iterable, keys: Iterable[str]) -> None:
+        sql = (f"INSERT INTO {_q(report)} (_date, {', '.join(map(_q, fieldnames))})"
+               f" VALUES ({', '.join('?' * (len(fieldnames) + 1))})")
+        conn.executemany(sql, ((key, *row) for key, row in zip(keys, rows)))
+
+    def replace(self, report: str, fieldnames: List[str], rows: Iterable, keys: Iterable[str],
+                source: Dict[str, object]) -> None:
+        """Replace all rows of a report (rows in CSV order, keys their date keys) in one transaction."""
+        columns = "".join(f", {_q(name)} TEXT NOT NULL DEFAULT ''" for name in fieldnames)
+        with self._transaction() as conn:
+            conn.execute(f"DROP TABLE IF EXISTS {_q(report)}")
+            conn.execute(f"CREATE TABLE {_q(report)} (_row INTEGER PRIMARY KEY, _date TEXT NOT NULL{columns})")
+            self._insert(conn, report, fieldnames, rows, keys)
+            # The index is built once after the bulk insert instead of row by row
+            conn.execute(f"CREATE INDEX {_q(report + '_date')} ON {_q(report)} (_date)")
+            self._save_state(conn, report, fieldnames, source)
+
+    def upsert(self, report: str, fieldnames: List[str], rows: Iterable, keys: List[str],
+               source: Dict[str, object]) -> None:
+        """Replace the rows of the dates in keys with rows, appended after the kept ones, in one transaction.
+
+        fieldnames must start with the report's current columns; the others are added.
+        """
+        with self._transaction() as conn:
+            stored = json.loads(conn.execute("SELECT fieldnames FROM _reports WHERE report = ?",
+                                             (report,)).fetchone()[0])
+            for name in fieldnames[len(stored):]:
+                conn.execute(f"ALTER TABLE {_q(report)} ADD COLUMN {_q(name)} TEXT NOT NULL DEFAULT ''")
+            conn.executemany(f"DELETE FROM {_q(report)} WHERE _date = ?", ((key,) for key in set(keys)))
+            self._insert(conn, report, fieldnames, rows, keys)
+            self._save_state(conn, report, fieldnames, source)
+
+    def _select(self, stored: List[str], fieldnames: List[str]) -> str:
+        return ", ".join(_q(name) if name in stored else "''" for name in fieldnames)
+
+    def rows_for_dates(self, report: str, fieldnames: List[str],
+                       keys: Iterable[str]) -> Iterator[Tuple[str, tuple]]:
+        """(date key, row) of the stored rows of the given dates, through the _date index."""
+        state = self.state(report)
+        sql = f"SELECT {self._select(state['fieldnames'], fieldnames)} FROM {_q(report)} WHERE _date = ? ORDER BY _row"
+        with self._connect() as conn:
+            for key in keys:
+                for row in conn.execute(sql, (key,)):
+                    yield key, row
+
+    def iter_batches(self, report: str, fieldnames: List[str],
+                     skip_dates: Set[str] = frozenset()) -> Iterator[List[tuple]]:
+        """Stream the rows in CSV order as batches of (date key, *values), leaving out skip_dates."""
+        state = self.state(report)
+        with self._connect() as conn:
+            # A temp table is private to the connection: skipping dates doesn't take the write lock
+            conn.execute("CREATE TEMP TABLE _skip (d TEXT PRIMARY KEY)")
+            conn.executemany("INSERT OR IGNORE INTO _skip VALUES (?)", ((key,) for key in skip_dates))
+            cursor = conn.execute(f"SELECT _date, {self._select(state['fieldnames'], fieldnames)} FROM {_q(report)}"
+                                  " WHERE _date NOT IN (SELECT d FROM _skip) ORDER BY _row")
+            while True:
+                batch = cursor.fetchmany(_BATCH_ROWS)
+                if not batch:
+                    return
+                yield batch
+
+    def iter_rows(self, report: str, fieldnames: List[str],
+                  skip_dates: Set[str] = frozenset()) -> Iterator[Tuple[str, tuple]]:
+        """Like iter_batches, one (date key, row) at a time."""
+        for batch in self.iter_batches(report, fieldnames, skip_dates):
+            for row in batch:
+                yield row[0], row[1:]
+
+    def reports(self) -> List[Dict[str, object]]:
+        """Name, rows, date range and source md5 of every stored report."""
+        with self._connect() as conn:
+            names = [row[0] for row in conn.execute("SELECT report FROM _reports ORDER BY report")]
+            summary = []
+            for name in names:
+                rows, first, last = conn.execute(f"SELECT COUNT(*), MIN(_date), MAX(_date) FROM {_q(name)}").fetchone()
+                summary.append({"report": name, "rows": rows, "first": first, "last": last,
+                                **(self.state(name) or {})})
+        return summary
+
+
+def main(argv: List[str]) -> int:
+    path = argv[0] if argv else os.getenv("DRIVE_HISTORY_DB", "")
+    if not path or not os.path.isfile(path):
+        print(f"No existe la base de historial: {path or '(DRIVE_HISTORY_DB no configurado)'}")
+        return 1
+    store = HistoryStore(path)
+    if len(argv) > 1:
+        with store._connect() as conn:
+            cursor = conn.execute(argv[1])
+            writer = csv.writer(sys.stdout, lineterminator="\n")
+            writer.writerow([c[0] for c in cursor.description or ()])
+            writer.writerows(cursor)
+        return 0
+    print(f"{'reporte':<20}{'filas':>10}  {'desde':<12}{'hasta':<12}{'columna fecha':<16}md5 Drive")
+    for r in store.reports():
+        print(f"{r['report']:<20}{r['rows']:>10}  {r['first'] or '-':<12}{r['last'] or '-':<12}"
+              f"{r.get('date_column') or '-':<16}{r.get('md5') or '-'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,12 +1,51 @@
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeout
+import greenlet  # installed with Playwright, whose sync API runs on it
+import base64
+import hashlib
+import json
 import os
-from datetime import datetime
+import queue
+import random
+import re
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from string import Template
+
+from run_metrics import span, start_run, finish_run
 
 # Drive sync
 try:
-    from google_drive_utils import update_drive_csv_file
-except Exception:
+    from google_drive_utils import (update_drive_csv_file, update_drive_partitioned, get_drive_metrics,
+                                    reset_drive_service, combine_csv_files, split_drive_history)
+    _drive_import_error = None
+except Exception as e:
+    _drive_import_error = e
+    combine_csv_files = None
+    split_drive_history = None
     update_drive_csv_file = None
+    update_drive_partitioned = None
+    get_drive_metrics = None
+    reset_drive_service = None
+
+# YAML report registry (optional; JSON works without it)
+try:
+    import yaml
+except Exception:
+    yaml = None
+
+# Encrypted session persistence
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except Exception:
+    Fernet = None
 
 # Load environment variables
 try:
@@ -19,6 +58,9 @@ def log(msg):
     """Print timestamped message"""
     print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
 
+if _drive_import_error is not None:
+    log(f"Drive sync disabled: google_drive_utils failed to import: {type(_drive_import_error).__name__}: {_drive_import_error}")
+
 def get_credentials():
     """Get Plex credentials from environment"""
     username = os.getenv('PLEX_USERNAME')
@@ -27,134 +69,951 @@ def get_credentials():
         raise RuntimeError('Missing PLEX_USERNAME or PLEX_PASSWORD')
     return username, password
 
+# Requests the exports never need: images, fonts, media and analytics/telemetry beacons
+_BLOCKED_RESOURCES = {
+    'images': r'\.(?:png|jpe?g|gif|svg|ico|webp|bmp)(?:[?#]|$)',
+    'fonts': r'\.(?:woff2?|ttf|otf|eot)(?:[?#]|$)',
+    'media': r'\.(?:mp4|webm|mp3|wav|ogg)(?:[?#]|$)',
+    'telemetry': r'^https?://[^/]*(?:google-analytics\.com|googletagmanager\.com|doubleclick\.net|'
+                 r'nr-data\.net|newrelic\.com|hotjar\.com|segment\.(?:io|com)|sentry\.io|'
+                 r'fullstory\.com|pendo\.io|appdynamics\.com|clarity\.ms|mixpanel\.com)/',
+}
+
+def block_resources(context):
+    """Abort requests for the PLEX_BLOCK_RESOURCES kinds (default all of _BLOCKED_RESOURCES) in context.
+
+    The filter is a URL regex, so allowed requests never go through a Python route handler.
+    Extra hosts can be blocked with PLEX_BLOCK_HOSTS (comma separated); "off" disables blocking.
+    """
+    setting = os.getenv('PLEX_BLOCK_RESOURCES', ','.join(_BLOCKED_RESOURCES)).lower()
+    if setting in ('off', 'false', '0', ''):
+        return
+    patterns = [_BLOCKED_RESOURCES[kind.strip()] for kind in setting.split(',') if kind.strip() in _BLOCKED_RESOURCES]
+    hosts = [h.strip() for h in os.getenv('PLEX_BLOCK_HOSTS', '').split(',') if h.strip()]
+    if hosts:
+        patterns.append(r'^https?://[^/]*(?:' + '|'.join(re.escape(h) for h in hosts) + ')/')
+    if patterns:
+        context.route(re.compile('|'.join(patterns), re.IGNORECASE), lambda route: route.abort())
+
+def new_report_context(browser, storage_state=None):
+    """Browser context for the exports: accepts downloads and skips unneeded resources"""
+    context = browser.new_context(storage_state=storage_state, accept_downloads=True)
+    block_resources(context)
+    return context
+
+def goto_ready(page, url, selector, timeout=30000):
+    """Open url and return as soon as selector is visible instead of waiting for the network to go idle"""
+    page.goto(url, wait_until='domcontentloaded')
+    page.wait_for_selector(selector, state='visible', timeout=timeout)
+
+DATE_PICKER_OK = 'button.plex-datetimepicker-button.btn.default-action'
+
 def click_ok_button(page):
-    """Click OK button in date picker"""
-    page.wait_for_timeout(500)
-    page.evaluate('document.querySelector("button.plex-datetimepicker-button.btn.default-action").click()')
+    """Click OK button in date picker as soon as it is shown"""
+    page.wait_for_selector(DATE_PICKER_OK, state='visible')
+    page.evaluate(f'document.querySelector({json.dumps(DATE_PICKER_OK)}).click()')
+
+def set_date_range(page, anchor, preset='plex.dates.DateRange.LastSevenDays'):
+    """Open the date picker at anchor and choose preset (Last 7 Days)"""
+    page.click(anchor)
+    page.select_option('#DateRangePickerRangeSelect', value=preset)
+    click_ok_button(page)
+    # The range is applied when the picker closes
+    page.wait_for_selector('#DateRangePickerRangeSelect', state='hidden')
 
 def export_csv(page, filepath):
     """Export and save CSV file"""
-    page.click('a:has(i.plex-action-export):has(span:text("Export As"))')
-    with page.expect_download(timeout=180000) as download_info:
-        page.click('a:has-text("Export to CSV")')
-        download = download_info.value
-        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
-        download.save_as(filepath)
+    with span('export_download', method='ui') as s:
+        page.click('a:has(i.plex-action-export):has(span:text("Export As"))')
+        with page.expect_download(timeout=180000) as download_info:
+            page.click('a:has-text("Export to CSV")')
+            download = download_info.value
+            os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+            download.save_as(filepath)
+        s.set(bytes=os.path.getsize(filepath))
     log(f"Saved: {filepath}")
 
-def update_drive(file_id, local_path, date_column):
-    """Update Google Drive file if configured"""
-    if not update_drive_csv_file or not file_id:
-        return
+def export_via_http(url, cookies, filepath, body=None, timeout=180):
+    """Download a report export straight from its endpoint and stream it to filepath.
+
+    cookies are Playwright cookie dicts from the logged-in context. With body the request
+    is a JSON POST. Raises if the response isn't a CSV (e.g. the sign-in page after the
+    session expired) or is shorter than its Content-Length; filepath is only replaced once the
+    whole file arrived.
+    """
+    headers = {
+        'Accept': 'text/csv, application/octet-stream, */*',
+        'Cookie': '; '.join(f"{c['name']}={c['value']}" for c in cookies),
+    }
+    data = None
+    if body is not None:
+        data = body.encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+    request = urllib.request.Request(url, data=data, headers=headers, method='POST' if data else 'GET')
+    
+    os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+    tmp_path = filepath + '.part'
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            content_type = response.headers.get('Content-Type', '')
+            if 'html' in content_type:
+                raise RuntimeError(f"Unexpected response type {content_type!r} (session expired?)")
+            with open(tmp_path, 'wb') as f:
+                shutil.copyfileobj(response, f, 1024 * 1024)
+                received = f.tell()
+            # Chunked reads don't raise on a connection cut short, so check the announced size
+            expected = response.headers.get('Content-Length')
+            if expected and expected.isdigit() and received < int(expected):
+                raise RuntimeError(f"Connection closed after {received} of {expected} bytes")
+        with open(tmp_path, 'rb') as f:
+            if f.read(64).lstrip(b'\xef\xbb\xbf \r\n').startswith(b'<'):
+                raise RuntimeError("Response is HTML, not CSV (session expired?)")
+        os.replace(tmp_path, filepath)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def fast_export_template(name):
+    """(url, body) of the report's direct export request, or None if it isn't configured or usable"""
+    url = os.getenv(f'PLEX_{name.upper()}_EXPORT_URL')
+    if not url:
+        return None
+    body = os.getenv(f'PLEX_{name.upper()}_EXPORT_BODY')
+    missing = [p for p in ('$start_date', '$end_date') if p not in url + (body or '')]
+    if missing:
+        log(f"PLEX_{name.upper()}_EXPORT_URL/_BODY have no {' or '.join(missing)}, using the UI")
+        return None
+    return url, body
+
+def export_fast(page, name, filepath, date_range=None):
+    """Try the direct HTTP export for a report; True if it saved filepath.
+
+    Enabled per report with PLEX_<NAME>_EXPORT_URL (the export request recorded from the
+    browser) and optionally PLEX_<NAME>_EXPORT_BODY for a JSON POST body, where $start_date
+    and $end_date are replaced with the last 7 days, or the (start, end) dates of date_range
+    (MM/DD/YYYY). Both placeholders are required: without them every run would export the range
+    fixed when the request was recorded, so the UI export is used instead.
+    """
+    template = fast_export_template(name)
+    if template is None:
+        return False
+    url, body = template
+    today = datetime.now()
+    start_date, end_date = date_range or (today - timedelta(days=7), today)
+    dates = {'start_date': start_date.strftime('%m/%d/%Y'), 'end_date': end_date.strftime('%m/%d/%Y')}
+    url = Template(url).safe_substitute(dates)
+    if body:
+        body = Template(body).safe_substitute(dates)
+    start = datetime.now()
+    try:
+        with span('export_download', method='http') as s:
+            export_via_http(url, page.context.cookies(url), filepath, body=body)
+            s.set(bytes=os.path.getsize(filepath))
+    except Exception as e:
+        log(f"Direct export failed for {name}{', using the UI' if date_range is None else ''}: {e}")
+        return False
+    log(f"Saved: {filepath} (direct export, {(datetime.now() - start).total_seconds():.1f}s)")
+    return True
+
+def update_drive(file_id, local_path, date_column, name):
+    """Update Google Drive file if configured.
+
+    With DRIVE_PARTITION_MODE=month|week, file_id is the partition manifest instead of the full history.
+    """
+    if not file_id:
+        return None
+    if not update_drive_csv_file:
+        # A configured Drive file that can't be synced is a failure, not "Drive not configured"
+        log(f"Drive update failed ({name}): google_drive_utils could not be imported: "
+            f"{type(_drive_import_error).__name__}: {_drive_import_error}")
+        return False
     try:
         normalize = os.getenv('NORMALIZE_DATE', 'true').lower() == 'true'
-        update_drive_csv_file(file_id, local_path, date_column, normalize_date=normalize)
+        partition = os.getenv('DRIVE_PARTITION_MODE', '').lower()
+        if partition:
+            update_drive_partitioned(file_id, local_path, date_column, name, partition=partition, normalize_date=normalize)
+        else:
+            update_drive_csv_file(file_id, local_path, date_column, normalize_date=normalize, report=name)
         log(f"Drive updated: {file_id}")
+        return True
     except Exception as e:
-        log(f"Drive update failed: {e}")
+        log(f"Drive update failed ({name}): {e}")
+        return False
 
-def download_production(page, save_dir):
-    """Download production report (Last 7 Days, Part Key = 'fg')"""
-    log("Downloading production report...")
-    
-    page.goto('https://cloud.plex.com/ProductionTracking/ProductionHistory/ViewProductionHistoryDetailedProductionHistoryGrid')
-    page.wait_for_load_state('networkidle')
-    
-    # Set date range
-    page.click('#autoID14_Anchor')
-    page.select_option('#DateRangePickerRangeSelect', value='plex.dates.DateRange.LastSevenDays')
-    click_ok_button(page)
-    page.wait_for_timeout(500)
+def submit_drive_sync(sync_pool, file_id, local_path, date_column, name):
+    """Run update_drive on the background pool so the browser can move on to the next report.
+
+    Returns a future resolving to (ok, elapsed_seconds); ok is None if Drive isn't configured.
+    """
+    def job():
+        start = datetime.now()
+        with span('drive_sync', report=name) as s:
+            ok = update_drive(file_id, local_path, date_column, name)
+            s.set(ok=ok)
+        return ok, (datetime.now() - start).total_seconds()
+    return sync_pool.submit(job)
+
+def wait_for_drive_syncs(syncs):
+    """Wait for every Drive sync future and log its result; a failed report doesn't stop the others"""
+    for name, future in syncs.items():
+        try:
+            ok, elapsed = future.result()
+        except Exception as e:
+            log(f"Drive sync {name}: error {e}")
+            continue
+        if ok is None:
+            continue
+        log(f"Drive sync {name}: {'ok' if ok else 'FAILED'} in {elapsed:.1f}s")
+
+REPORTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports.json')
+
+_REPORT_DEFAULTS = {
+    'date_range': None,      # {"anchor": selector of the date picker, "preset": range option}
+    'filters': [],           # [{"selector": ..., "fill": text} or {"selector": ..., "select": option value}]
+    'search': None,          # button to click after the filters
+    'data_response': None,   # part of the URL of the grid data request the search waits for
+    'ready_timeout_ms': 30000,
+    'settle_ms': 0,          # extra wait after the ready selector appears
+    'priority': 0,           # higher starts first
+    'enabled': True,
+}
+_REPORT_REQUIRED = ('name', 'url', 'ready', 'date_column')
+
+def load_report_registry(path=None):
+    """Read the report registry: PLEX_REPORTS_FILE, default reports.json (.yaml/.yml needs PyYAML).
+
+    Returns (settings, reports): the top-level settings (e.g. max_pages) and the enabled reports
+    with defaults filled in, highest priority first and in file order otherwise. file,
+    drive_file_env and date_column_env default to <name>.csv, DRIVE_<NAME>_FILE_ID and
+    <NAME>_DATE_COLUMN.
+    """
+    path = path or os.getenv('PLEX_REPORTS_FILE') or REPORTS_FILE
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.lower().endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise RuntimeError(f"{path} is YAML but PyYAML is not installed (pip install pyyaml)")
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    if isinstance(data, list):
+        data = {'reports': data}
     
-    # Filter and search
-    page.fill('#autoID29', 'fg')
-    page.click('button.btn[data-bind="event: { mousedown: search }"]')
-    page.wait_for_selector('td[data-col-index="0"][id="featurable_el_1"]', timeout=30000)
+    reports = []
+    known = set(_REPORT_REQUIRED) | set(_REPORT_DEFAULTS) | {'file', 'drive_file_env', 'date_column_env'}
+    for entry in data.get('reports') or []:
+        missing = [key for key in _REPORT_REQUIRED if not entry.get(key)]
+        unknown = set(entry) - known
+        if missing or unknown:
+            raise RuntimeError(f"Invalid report {entry.get('name', '?')!r} in {path}: "
+                               f"missing {missing or '-'}, unknown {sorted(unknown) or '-'}")
+        report = {**_REPORT_DEFAULTS, **entry}
+        name = report['name']
+        report.setdefault('file', f"{name}.csv")
+        report.setdefault('drive_file_env', f"DRIVE_{name.upper()}_FILE_ID")
+        report.setdefault('date_column_env', f"{name.upper()}_DATE_COLUMN")
+        if report['enabled']:
+            reports.append(report)
+    names = [r['name'] for r in reports]
+    if len(set(names)) != len(names):
+        raise RuntimeError(f"Duplicate report names in {path}")
+    reports.sort(key=lambda r: -r['priority'])
+    return {k: v for k, v in data.items() if k != 'reports'}, reports
+
+def report_date_column(report):
+    return os.getenv(report['date_column_env'], report['date_column'])
+
+def first_control(report):
+    """Selector of the first control export_report uses on the report page"""
+    return ((report['date_range'] or {}).get('anchor')
+            or next((f['selector'] for f in report['filters']), None)
+            or report['search'] or report['ready'])
+
+def export_report(page, report, filepath, date_range=None):
+    """Export a registry report for its default range (Last 7 Days) or date_range to filepath.
+
+    A date_range is only exported through the direct export: the UI flow only knows the preset.
+    """
+    name = report['name']
+    if export_fast(page, name, filepath, date_range):
+        return
+    if date_range is not None:
+        raise RuntimeError(f"Direct export of {name} failed; date ranges can't be exported through the UI")
+    with span('plex_search'):
+        # Ready as soon as the first control to use is on the page
+        goto_ready(page, report['url'], first_control(report), report['ready_timeout_ms'])
+        
+        # Set date range
+        if report['date_range']:
+            control = report['date_range']
+            if 'preset' in control:
+                set_date_range(page, control['anchor'], control['preset'])
+            else:
+                set_date_range(page, control['anchor'])
+        
+        # Filter and search
+        for f in report['filters']:
+            if 'select' in f:
+                page.select_option(f['selector'], value=f['select'])
+            else:
+                page.fill(f['selector'], f['fill'])
+        if report['search'] and report['data_response']:
+            with page.expect_response(lambda r: report['data_response'] in r.url,
+                                      timeout=report['ready_timeout_ms']):
+                page.click(report['search'])
+        elif report['search']:
+            page.click(report['search'])
+        page.wait_for_selector(report['ready'], timeout=report['ready_timeout_ms'])
+        if report['settle_ms']:
+            page.wait_for_timeout(report['settle_ms'])
     
     # Export
-    filepath = os.path.join(save_dir, 'production.csv')
     export_csv(page, filepath)
+
+def download_report(report, page, save_dir, sync_pool):
+    """Download a registry report and queue its Drive sync"""
+    log(f"Downloading {report['name']} report...")
+    filepath = os.path.join(save_dir, report['file'])
+    export_report(page, report, filepath)
     
-    # Update Drive
-    update_drive(
-        os.getenv('DRIVE_PRODUCTION_FILE_ID'),
+    # Update Drive in the background
+    return submit_drive_sync(
+        sync_pool,
+        os.getenv(report['drive_file_env']),
         filepath,
-        os.getenv('PRODUCTION_DATE_COLUMN', 'Date')
+        report_date_column(report),
+        report['name']
     )
 
-def download_scrap(page, save_dir):
-    """Download scrap report (Last 7 Days)"""
-    log("Downloading scrap report...")
-    
-    page.goto('https://cloud.plex.com/Inventory/ScrapLog')
-    page.wait_for_load_state('networkidle')
+def report_jobs(reports):
+    """run_reports entries for the registry reports, in priority order"""
+    return [(report['name'], partial(download_report, report)) for report in reports]
+
+# Elements of the Plex sign-in flow: a page showing any of them is not logged in
+SIGN_IN_SELECTOR = 'button#iamButton, #inputUsername3, #inputPassword3'
+
+def login(page, username, password):
+    """Log in to Plex Cloud"""
+    log("Logging in...")
+    goto_ready(page, 'https://cloud.plex.com/', 'button#iamButton')
+    page.click('button#iamButton')
     
-    # Set date range
-    page.click('#autoID56_Anchor')
-    page.select_option('#DateRangePickerRangeSelect', value='plex.dates.DateRange.LastSevenDays')
-    click_ok_button(page)
-    page.wait_for_timeout(500)
+    page.fill('#inputUsername3', username)
+    page.press('#inputUsername3', 'Enter')
     
-    # Search
-    page.click('button.btn[data-bind="event: { mousedown: search }"]')
-    page.wait_for_selector('td[data-col-index="0"][class="plex-date-text"]', timeout=30000)
-    page.wait_for_timeout(1000)
+    page.fill('#inputPassword3', password)
+    page.press('#inputPassword3', 'Enter')
+    # Signed in once the password form is gone and the landing page has loaded
+    page.wait_for_selector('#inputPassword3', state='detached', timeout=60000)
+    page.wait_for_load_state('load')
+
+def _session_path():
+    """Encrypted storage_state file, or None if PLEX_SESSION_FILE=off or cryptography is missing"""
+    path = os.getenv('PLEX_SESSION_FILE', os.path.join(tempfile.gettempdir(), 'plex-session.bin'))
+    if Fernet is None or not path or path.lower() in ('off', 'false', '0'):
+        return None
+    return path
+
+def _session_cipher(password):
+    """Fernet cipher from PLEX_SESSION_KEY, or derived from the Plex password"""
+    key = os.getenv('PLEX_SESSION_KEY')
+    if not key:
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), b'henniges-plex-session', 200000)
+        key = base64.urlsafe_b64encode(digest)
+    return Fernet(key)
+
+_session_missing_logged = False
+
+def load_session_state(password):
+    """Return the saved Playwright storage_state, or None if there is no usable saved session"""
+    global _session_missing_logged
+    path = _session_path()
+    if not path:
+        return None
+    if not os.path.isfile(path):
+        if not _session_missing_logged:
+            _session_missing_logged = True
+            log(f"No saved session at {path}, logging in. On a host whose disk is reset every run "
+                f"(e.g. a Render cron job) point PLEX_SESSION_FILE at a persistent disk or use daemon mode")
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return json.loads(_session_cipher(password).decrypt(f.read()))
+    except (InvalidToken, ValueError) as e:
+        log(f"Saved session unreadable, ignoring: {type(e).__name__}")
+        return None
+
+def save_session_state(storage_state, password):
+    """Encrypt and save the Playwright storage_state for the next run"""
+    path = _session_path()
+    if not path:
+        return
+    try:
+        data = _session_cipher(password).encrypt(json.dumps(storage_state).encode('utf-8'))
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        log(f"Could not save session: {e}")
+
+def discard_session_state():
+    """Delete the saved session so the next run logs in from scratch"""
+    path = _session_path()
+    if path and os.path.isfile(path):
+        os.remove(path)
+        log("Saved session discarded")
+
+def forget_session_if_signed_out(page):
+    """After a failed run: discard the saved session if the page ended on the sign-in flow; True if so"""
+    try:
+        signed_out = page.locator(SIGN_IN_SELECTOR).count() > 0
+    except Exception:
+        return False
+    if signed_out:
+        log("Run ended on the Plex sign-in page")
+        discard_session_state()
+    return signed_out
+
+def session_is_valid(page, report):
+    """True if the page's context is still logged in: the report page shows its first control.
+
+    Waits for either that control or the sign-in flow, so a page that hasn't rendered yet can't
+    pass for logged in.
+    """
+    page.goto(report['url'], wait_until='domcontentloaded')
+    sign_in = page.locator(SIGN_IN_SELECTOR)
+    page.locator(first_control(report)).or_(sign_in).first.wait_for(state='visible',
+                                                                     timeout=report['ready_timeout_ms'])
+    return not sign_in.first.is_visible()
+
+def ensure_logged_in(page, username, password, saved_state, report):
+    """Reuse the saved session when it's still valid on report's page, otherwise log in and save the new one"""
+    start = datetime.now()
+    with span('login') as s:
+        if saved_state is not None:
+            try:
+                if session_is_valid(page, report):
+                    elapsed = (datetime.now() - start).total_seconds()
+                    log(f"Login skipped: saved session still valid ({elapsed:.1f}s) [login_skipped=1 login_performed=0]")
+                    s.set(performed=False)
+                    return False
+            except PlaywrightTimeout:
+                pass
+            log("Saved session expired")
+            # A failed login below must not leave the expired session for the next run
+            discard_session_state()
+        login(page, username, password)
+        save_session_state(page.context.storage_state(), password)
+        s.set(performed=True)
+    elapsed = (datetime.now() - start).total_seconds()
+    log(f"Login performed ({elapsed:.1f}s) [login_skipped=0 login_performed=1]")
+    return True
+
+def _export_reports_from_queue(page, pending, save_dir, sync_pool, results):
+    """Export reports from the shared queue on one page until the queue is empty"""
+    while True:
+        try:
+            name, download = pending.get_nowait()
+        except queue.Empty:
+            return
+        start = datetime.now()
+        try:
+            with span('export', report=name):
+                results[name] = download(page, save_dir, sync_pool)
+            log(f"Report {name} exported in {(datetime.now() - start).total_seconds():.1f}s")
+        except Exception as e:
+            log(f"Report {name} failed: {e}")
+            results[name] = e
+
+def _start_in_greenlet(page, work):
+    """Start work() on this thread next to the caller, sharing page's Playwright instance.
+
+    A sync API call blocks by switching to Playwright's event loop, and the loop switches back
+    to the greenlet that made the call when it completes (Playwright's own event handlers run
+    this way). So work() starts as soon as the caller blocks on its next call and from then on
+    runs whenever the caller waits on Plex, and vice versa. Returns the greenlet.
+    """
+    def run():
+        try:
+            work()
+        except Exception as e:
+            log(f"Report page failed: {e}")
+    worker = greenlet.greenlet(run)
+    # page._loop is the sync API's event loop (SyncBase._loop)
+    page._loop.call_soon(worker.switch)
+    return worker
+
+def run_reports(page, reports, save_dir, sync_pool, max_pages):
+    """Export reports concurrently on up to max_pages logged-in pages of page's browser.
+
+    Every page takes reports from a shared queue. The extra pages are new contexts in the same
+    browser, logged in through the main page's storage_state, and are driven from this thread
+    (see _start_in_greenlet), so they add a renderer per page but no browser or Playwright
+    instance. Returns {name: drive sync future or the exception that report raised}.
+    """
+    pending = queue.Queue()
+    for report in reports:
+        pending.put(report)
+    results = {}
     
-    # Export
-    filepath = os.path.join(save_dir, 'scrap.csv')
-    export_csv(page, filepath)
+    contexts = []
+    workers = []
+    extra_pages = min(max_pages, len(reports)) - 1
+    try:
+        if extra_pages > 0:
+            log(f"Exporting on {extra_pages + 1} pages")
+            storage_state = page.context.storage_state()
+            for _ in range(extra_pages):
+                contexts.append(new_report_context(page.context.browser, storage_state))
+                extra_page = contexts[-1].new_page()
+                workers.append(_start_in_greenlet(page, partial(
+                    _export_reports_from_queue, extra_page, pending, save_dir, sync_pool, results)))
+        
+        _export_reports_from_queue(page, pending, save_dir, sync_pool, results)
+        while not all(worker.dead for worker in workers):
+            page.wait_for_timeout(200)
+    finally:
+        for context in contexts:
+            try:
+                context.close()
+            except Exception:
+                pass
+    # Reports left behind by a page that failed before taking them
+    _export_reports_from_queue(page, pending, save_dir, sync_pool, results)
+    return results
+
+def sync_reports(page, username, password, saved_state, reports, save_dir, sync_pool, max_pages):
+    """One sync on an open page: check the login, export every report and wait for its Drive sync"""
+    ensure_logged_in(page, username, password, saved_state, reports[0])
     
-    # Update Drive
-    update_drive(
-        os.getenv('DRIVE_SCRAP_FILE_ID'),
-        filepath,
-        os.getenv('SCRAP_DATE_COLUMN', 'Report Date')
-    )
+    # Export reports concurrently; each Drive sync runs while the browser keeps exporting
+    results = run_reports(page, report_jobs(reports), save_dir, sync_pool, max_pages)
+    failed = {name: r for name, r in results.items() if isinstance(r, Exception)}
+    wait_for_drive_syncs({name: r for name, r in results.items() if name not in failed})
+    if failed:
+        raise RuntimeError(f"Reports failed: {', '.join(failed)}")
+    # Refreshed cookies extend the saved session
+    save_session_state(page.context.storage_state(), password)
+
+def log_run_summary(record):
+    """Log the Drive client metrics and the slowest stages of a finished run"""
+    if get_drive_metrics:
+        m = get_drive_metrics()
+        log(f"Drive client: startup {m['startup_s'] * 1000:.0f}ms, {m['calls']} calls, "
+            f"avg {m['call_s_avg'] * 1000:.0f}ms, max {m['call_s_max'] * 1000:.0f}ms")
+    if record:
+        slowest = sorted(record['spans'], key=lambda s: -s['wall_s'])[:3]
+        log("Slowest stages: " + ", ".join(
+            f"{s['stage']}{'/' + s['report'] if s.get('report') else ''} {s['wall_s']:.1f}s" for s in slowest
+        ))
+
+def _sync_settings(registry):
+    """(save_dir, headless, max_pages, sync_workers) from the environment, then the registry settings"""
+    save_dir = os.getenv('PRODUCTION_SAVE_DIR') or os.getenv('SCRAP_SAVE_DIR') or os.path.dirname(__file__) or '.'
+    headless = os.getenv('HEADLESS', 'true').lower() == 'true'
+    max_pages = max(1, int(os.getenv('PLEX_MAX_PAGES') or registry.get('max_pages', 1)))
+    sync_workers = int(os.getenv('DRIVE_SYNC_WORKERS') or registry.get('sync_workers', 2))
+    return save_dir, headless, max_pages, sync_workers
 
 def main():
     """Main execution"""
     start = datetime.now()
     log("Starting Plex download...")
+    start_run('sync')
+    status = 'error'
     
     username, password = get_credentials()
-    save_dir = os.getenv('PRODUCTION_SAVE_DIR') or os.getenv('SCRAP_SAVE_DIR') or os.path.dirname(__file__) or '.'
+    registry, reports = load_report_registry()
+    save_dir, headless, max_pages, sync_workers = _sync_settings(registry)
     
-    with sync_playwright() as p:
-        browser = p.chromium.launch(
-            headless=os.getenv('HEADLESS', 'true').lower() == 'true'
-        )
-        page = browser.new_page(accept_downloads=True)
+    with ThreadPoolExecutor(max_workers=sync_workers, thread_name_prefix='drive-sync') as sync_pool, \
+            sync_playwright() as p:
+        with span('browser_start'):
+            browser = p.chromium.launch(headless=headless)
+            saved_state = load_session_state(password)
+            context = new_report_context(browser, saved_state)
+            page = context.new_page()
         
         try:
-            # Login
-            log("Logging in...")
-            page.goto('https://cloud.plex.com/')
-            page.wait_for_load_state('networkidle')
-            page.click('button#iamButton')
-            
-            page.fill('#inputUsername3', username)
-            page.press('#inputUsername3', 'Enter')
-            
-            page.fill('#inputPassword3', password)
-            page.press('#inputPassword3', 'Enter')
-            page.wait_for_load_state('networkidle')
-            
-            # Download reports
-            download_production(page, save_dir)
-            download_scrap(page, save_dir)
+            sync_reports(page, username, password, saved_state, reports, save_dir, sync_pool, max_pages)
+            status = 'ok'
             
             elapsed = (datetime.now() - start).total_seconds()
             log(f"Completed in {elapsed:.1f}s")
             
         except Exception as e:
             log(f"Error: {e}")
+            forget_session_if_signed_out(page)
             raise
         finally:
             browser.close()
+            record = finish_run(status)
+            log_run_summary(record)
+
+def next_run_time(now, minutes, jitter_s):
+    """First time after now at one of `minutes` past the hour, delayed by up to jitter_s seconds"""
+    base = now.replace(second=0, microsecond=0)
+    slots = [base.replace(minute=m) + timedelta(hours=h) for h in (0, 1) for m in minutes]
+    return min(t for t in slots if t > now) + timedelta(seconds=random.uniform(0, jitter_s))
+
+class DaemonHealth:
+    """State of the daemon for the health endpoint; unhealthy after repeated failures or no recent success"""
+    
+    def __init__(self, max_failures, stale_after_s):
+        self.lock = threading.Lock()
+        self.started = datetime.now()
+        self.max_failures = max_failures
+        self.stale_after_s = stale_after_s
+        self.runs = 0
+        self.consecutive_failures = 0
+        self.last_ok = None
+        self.last_error = None
+        self.next_run = None
+    
+    def record(self, ok, error=None):
+        with self.lock:
+            self.runs += 1
+            if ok:
+                self.consecutive_failures = 0
+                self.last_ok = datetime.now()
+            else:
+                self.consecutive_failures += 1
+                self.last_error = error
+    
+    def snapshot(self):
+        with self.lock:
+            since = self.last_ok or self.started
+            healthy = (self.consecutive_failures < self.max_failures
+                       and (datetime.now() - since).total_seconds() < self.stale_after_s)
+            return healthy, {
+                'status': 'ok' if healthy else 'unhealthy',
+                'started': self.started.isoformat(timespec='seconds'),
+                'runs': self.runs,
+                'consecutive_failures': self.consecutive_failures,
+                'last_ok': self.last_ok.isoformat(timespec='seconds') if self.last_ok else None,
+                'last_error': self.last_error,
+                'next_run': self.next_run.isoformat(timespec='seconds') if self.next_run else None,
+            }
+
+def serve_health(port, health):
+    """Answer GET requests on port with the daemon state as JSON (200 healthy, 503 unhealthy)"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            healthy, state = health.snapshot()
+            body = json.dumps(state).encode('utf-8')
+            self.send_response(200 if healthy else 503)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    threading.Thread(target=server.serve_forever, name='health', daemon=True).start()
+    log(f"Health check listening on :{port}")
+    return server
+
+def daemon():
+    """Run the sync on an internal schedule in one long-lived process.
+
+    The browser, its logged-in context and the Drive client stay warm between runs, so each run
+    only pays for the report exports and merges. Runs start at SYNC_SCHEDULE_MINUTES past the
+    hour (default 25,55, like the cron) plus up to SYNC_JITTER_S seconds. Each run re-checks the
+    session and logs in again if Plex expired it; after a failed run the browser and Drive
+    client are rebuilt. SIGTERM/SIGINT let the current run finish and then shut down cleanly.
+    """
+    username, password = get_credentials()
+    registry, reports = load_report_registry()
+    save_dir, headless, max_pages, sync_workers = _sync_settings(registry)
+    minutes = sorted({int(m) % 60 for m in os.getenv('SYNC_SCHEDULE_MINUTES', '25,55').split(',') if m.strip()})
+    jitter_s = float(os.getenv('SYNC_JITTER_S', '60'))
+    recycle_runs = int(os.getenv('SYNC_BROWSER_MAX_RUNS', '48'))
+    health = DaemonHealth(
+        max_failures=int(os.getenv('SYNC_MAX_FAILURES', '3')),
+        stale_after_s=float(os.getenv('SYNC_STALE_AFTER_MIN', '120')) * 60,
+    )
+    health_port = os.getenv('SYNC_HEALTH_PORT') or os.getenv('PORT')
+    server = serve_health(int(health_port), health) if health_port else None
+    
+    stop = threading.Event()
+    def request_stop(signum, frame):
+        if not stop.is_set():
+            log(f"Received {signal.Signals(signum).name}: stopping after the current run")
+        stop.set()
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    
+    log(f"Daemon started: runs at :{', :'.join(f'{m:02d}' for m in minutes)} + up to {jitter_s:.0f}s jitter")
+    browser = context = page = None
+    saved_state = load_session_state(password)
+    runs_on_browser = 0
+    with ThreadPoolExecutor(max_workers=sync_workers, thread_name_prefix='drive-sync') as sync_pool, \
+            sync_playwright() as p:
+        try:
+            run_now = os.getenv('SYNC_RUN_ON_START', 'true').lower() == 'true'
+            while not stop.is_set():
+                if not run_now:
+                    health.next_run = next_run_time(datetime.now(), minutes, jitter_s)
+                    log(f"Next run at {health.next_run.strftime('%H:%M:%S')}")
+                    if stop.wait((health.next_run - datetime.now()).total_seconds()):
+                        break
+                run_now = False
+                
+                start = datetime.now()
+                start_run('daemon')
+                status = 'error'
+                try:
+                    if browser is not None and (not browser.is_connected() or runs_on_browser >= recycle_runs):
+                        log("Restarting browser")
+                        saved_state = context.storage_state() if browser.is_connected() else saved_state
+                        browser.close()
+                        browser = None
+                    if browser is None:
+                        with span('browser_start'):
+                            browser = p.chromium.launch(headless=headless)
+                            context = new_report_context(browser, saved_state)
+                            page = context.new_page()
+                        runs_on_browser = 0
+                    sync_reports(page, username, password, saved_state, reports, save_dir, sync_pool, max_pages)
+                    # Later runs check this session and log in again only if Plex expired it
+                    saved_state = context.storage_state()
+                    runs_on_browser += 1
+                    status = 'ok'
+                    health.record(True)
+                    log(f"Run completed in {(datetime.now() - start).total_seconds():.1f}s")
+                except Exception as e:
+                    log(f"Run failed: {e}")
+                    health.record(False, str(e))
+                    if browser is not None and forget_session_if_signed_out(page):
+                        saved_state = None
+                    # Fresh browser and Drive client for the next run
+                    if browser is not None:
+                        try:
+                            browser.close()
+                        except Exception:
+                            pass
+                        browser = None
+                    if reset_drive_service:
+                        reset_drive_service()
+                finally:
+                    log_run_summary(finish_run(status))
+        finally:
+            if browser is not None:
+                browser.close()
+            if server is not None:
+                server.shutdown()
+    log("Daemon stopped")
+
+def backfill_windows(start, end, window='month'):
+    """Split the dates start..end (inclusive) into calendar week (Monday-Sunday) or month windows"""
+    windows = []
+    current = start
+    while current <= end:
+        if window == 'week':
+            last = current + timedelta(days=6 - current.weekday())
+        else:
+            last = (current.replace(day=1) + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        last = min(last, end)
+        windows.append((current, last))
+        current = last + timedelta(days=1)
+    return windows
+
+def _window_label(date_range):
+    start, end = date_range
+    return f"{start:%Y-%m-%d}_{end:%Y-%m-%d}"
+
+class BackfillProgress:
+    """Exported windows of a backfill, saved to a JSON file after each one so a rerun can resume"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = {}
+        if os.path.isfile(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.done = json.load(f).get('done', {})
+            except (OSError, ValueError) as e:
+                log(f"Backfill progress unreadable, starting over: {e}")
+    
+    def is_done(self, label):
+        filepath = self.done.get(label)
+        return bool(filepath) and os.path.isfile(filepath)
+    
+    def mark_done(self, label, filepath):
+        with self.lock:
+            self.done[label] = filepath
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'done': self.done}, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+    
+    def clear(self):
+        """Remove the progress file and the exported windows"""
+        with self.lock:
+            for filepath in list(self.done.values()) + [self.path]:
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+            self.done = {}
+
+def _export_window(report, progress, label, date_range, filepath, page, save_dir, sync_pool):
+    """run_reports entry for one backfill window: export it and record it as done"""
+    log(f"Exporting window {label}...")
+    export_report(page, report, filepath, date_range)
+    progress.mark_done(label, filepath)
+
+def backfill(start, end, window='month', report_names=None):
+    """Rebuild the history of start..end: export its windows concurrently, then merge and upload once.
+
+    Each report's windows are exported on up to BACKFILL_MAX_PAGES pages (default PLEX_MAX_PAGES)
+    into BACKFILL_DIR/<report>/ (default backfill/ in the save dir), where progress.json records
+    the finished ones: rerunning the same command after an interruption only exports the missing
+    windows. When all are there they're combined into one CSV that goes through a single merge
+    and upload; the window files are removed once Drive is updated. Windows only go through the
+    direct HTTP export (see fast_export_template), so reports without a usable export request
+    are refused before anything starts.
+    """
+    start_run('backfill')
+    status = 'error'
+    username, password = get_credentials()
+    registry, reports = load_report_registry()
+    unknown = set(report_names or []) - {r['name'] for r in reports}
+    if unknown:
+        raise RuntimeError(f"Unknown reports: {', '.join(sorted(unknown))}")
+    reports = [r for r in reports if not report_names or r['name'] in report_names]
+    # The Plex UI flow only selects presets; custom ranges need the recorded export request
+    unusable = [r['name'] for r in reports if fast_export_template(r['name']) is None]
+    if unusable:
+        raise RuntimeError("Backfill needs PLEX_<REPORT>_EXPORT_URL (or _BODY) with $start_date and $end_date for: "
+                           + ', '.join(unusable))
+    save_dir, headless, max_pages, _ = _sync_settings(registry)
+    max_pages = max(1, int(os.getenv('BACKFILL_MAX_PAGES', str(max_pages))))
+    backfill_dir = os.getenv('BACKFILL_DIR') or os.path.join(save_dir, 'backfill')
+    windows = backfill_windows(start, end, window)
+    log(f"Backfill {start:%Y-%m-%d} → {end:%Y-%m-%d}: {len(windows)} {window} windows "
+        f"x {len(reports)} reports on {max_pages} pages")
+    
+    progress = {}
+    jobs = []
+    for report in reports:
+        name = report['name']
+        report_dir = os.path.join(backfill_dir, name)
+        os.makedirs(report_dir, exist_ok=True)
+        progress[name] = BackfillProgress(os.path.join(report_dir, 'progress.json'))
+        for date_range in windows:
+            label = _window_label(date_range)
+            if not progress[name].is_done(label):
+                filepath = os.path.join(report_dir, f"{label}.csv")
+                jobs.append((f"{name} {label}", partial(_export_window, report, progress[name], label, date_range, filepath)))
+    resumed = len(windows) * len(reports) - len(jobs)
+    if resumed:
+        log(f"Resuming: {resumed} windows already exported")
+    
+    try:
+        if jobs:
+            with sync_playwright() as p:
+                with span('browser_start'):
+                    browser = p.chromium.launch(headless=headless)
+                    saved_state = load_session_state(password)
+                    context = new_report_context(browser, saved_state)
+                    page = context.new_page()
+                try:
+                    ensure_logged_in(page, username, password, saved_state, reports[0])
+                    results = run_reports(page, jobs, save_dir, None, max_pages)
+                    failed_any = any(isinstance(r, Exception) for r in results.values())
+                    if not (failed_any and forget_session_if_signed_out(page)):
+                        save_session_state(context.storage_state(), password)
+                except Exception:
+                    forget_session_if_signed_out(page)
+                    raise
+                finally:
+                    browser.close()
+            failed = [job for job, r in results.items() if isinstance(r, Exception)]
+            if failed:
+                raise RuntimeError(f"Windows failed (rerun to resume): {', '.join(failed)}")
+        
+        for report in reports:
+            name = report['name']
+            if combine_csv_files is None:
+                raise RuntimeError("google_drive_utils is not available to combine the windows")
+            combined = os.path.join(backfill_dir, name, 'combined.csv')
+            with span('combine', report=name) as s:
+                rows = combine_csv_files([progress[name].done[_window_label(w)] for w in windows], combined)
+                s.set(rows=rows)
+            log(f"Backfill {name}: {rows} rows from {len(windows)} windows")
+            with span('drive_sync', report=name) as s:
+                ok = update_drive(os.getenv(report['drive_file_env']), combined, report_date_column(report), name)
+                s.set(ok=ok)
+            if ok is False:
+                raise RuntimeError(f"Drive update failed for {name}; the exported windows are kept")
+            if ok:
+                progress[name].clear()
+                os.remove(combined)
+            else:
+                log(f"Drive not configured for {name}: combined CSV left at {combined}")
+        status = 'ok'
+    finally:
+        log_run_summary(finish_run(status))
+
+def _parse_backfill_args(args):
+    """(start, end, window, reports) from --backfill START END [--window week|month] [--reports a,b]"""
+    i = args.index('--backfill')
+    try:
+        start, end = date.fromisoformat(args[i + 1]), date.fromisoformat(args[i + 2])
+    except (IndexError, ValueError):
+        raise SystemExit("Usage: plex_downloader.py --backfill YYYY-MM-DD YYYY-MM-DD [--window week|month] [--reports production,scrap]")
+    window = args[args.index('--window') + 1] if '--window' in args else 'month'
+    reports = args[args.index('--reports') + 1].split(',') if '--reports' in args else None
+    if window not in ('week', 'month'):
+        raise SystemExit(f"Unknown window {window!r}: use week or month")
+    if end < start:
+        raise SystemExit("The end date is before the start date")
+    return start, end, window, reports
+
+def split_history(report_name, manifest_file_id=None):
+    """One-time move of a report to DRIVE_PARTITION_MODE: split its single Drive CSV into partitions.
+
+    The CSV at the report's DRIVE_<NAME>_FILE_ID is kept; the new manifest is created next to it
+    and its ID is logged, to be set as DRIVE_<NAME>_FILE_ID from then on.
+    """
+    if split_drive_history is None:
+        raise RuntimeError(f"google_drive_utils could not be imported: {_drive_import_error}")
+    _, reports = load_report_registry()
+    report = next((r for r in reports if r['name'] == report_name), None)
+    if report is None:
+        raise RuntimeError(f"Unknown report: {report_name}")
+    file_id = os.getenv(report['drive_file_env'])
+    if not file_id:
+        raise RuntimeError(f"{report['drive_file_env']} is not set")
+    partition = os.getenv('DRIVE_PARTITION_MODE', '').lower() or 'month'
+    normalize = os.getenv('NORMALIZE_DATE', 'true').lower() == 'true'
+    manifest_file_id = split_drive_history(file_id, report_date_column(report), report_name, partition=partition,
+                                           normalize_date=normalize, manifest_file_id=manifest_file_id)
+    log(f"History of {report_name} split by {partition}. Now set {report['drive_file_env']}={manifest_file_id} "
+        f"and DRIVE_PARTITION_MODE={partition}; the original CSV ({file_id}) is no longer updated")
+
+def _parse_split_args(args):
+    """(report, manifest) from --split-history REPORT [--manifest ID]"""
+    i = args.index('--split-history')
+    if i + 1 >= len(args) or args[i + 1].startswith('--'):
+        raise SystemExit("Usage: plex_downloader.py --split-history REPORT [--manifest ID of an interrupted split]")
+    manifest = args[args.index('--manifest') + 1] if '--manifest' in args else None
+    return args[i + 1], manifest
 
 if __name__ == "__main__":
     try:
-        main()
+        if '--backfill' in sys.argv[1:]:
+            backfill(*_parse_backfill_args(sys.argv[1:]))
+        elif '--split-history' in sys.argv[1:]:
+            split_history(*_parse_split_args(sys.argv[1:]))
+        elif '--daemon' in sys.argv[1:] or os.getenv('SYNC_MODE', '').lower() == 'daemon':
+            daemon()
+        else:
+            main()
     except KeyboardInterrupt:
         log("Stopped by user")
     except Exception as e:
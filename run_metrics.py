@@ -0,0 +1,298 @@
+"""Per-stage timing and resource records for the Plex → Drive sync.
+
+Stages are wrapped in spans that record wall time, bytes, rows and the process' resident memory
+(RSS) when the stage starts and ends:
+
+    with span("upload", report="production") as s:
+        ...
+        s.set(bytes=size, rows=len(merged))
+
+Labels passed to a span (e.g. report=) are inherited by the spans opened inside it on the same
+thread or greenlet, and code deep inside a stage can add to it through current_span(). start_run() and
+finish_run() bracket a sync; finish_run() appends the run and its spans as one JSON line to
+SYNC_METRICS_FILE. Running this module summarizes that history:
+
+    python run_metrics.py [sync_runs.jsonl] [--last N]
+"""
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _ru_maxrss_bytes(who: int) -> int:
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux reports KB
+
+
+def _windows_memory_counters():
+    """PROCESS_MEMORY_COUNTERS of this process, or None outside Windows."""
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class _Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                    "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage",
+                    "PagefileUsage", "PeakPagefileUsage",
+                )
+            ]
+
+        counters = _Counters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters
+    return None
+
+
+def current_rss_bytes() -> Optional[int]:
+    """Resident set size of this process right now, or None if the platform doesn't tell."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    counters = _windows_memory_counters()
+    return counters.WorkingSetSize if counters else None
+
+
+def children_peak_rss_bytes() -> Optional[int]:
+    """Largest peak RSS among the finished child processes (e.g. a parse pool), or None."""
+    return _ru_maxrss_bytes(resource.RUSAGE_CHILDREN) if resource is not None else None
+
+
+def _mb(value: Optional[int]) -> Optional[float]:
+    return round(value / 2**20, 1) if value is not None else None
+
+
+def metrics_path() -> Optional[str]:
+    """JSON-lines file for run records (SYNC_METRICS_FILE), or None if it's set to off."""
+    default = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sync_runs.jsonl")
+    path = os.getenv("SYNC_METRICS_FILE", default)
+    if not path or path.lower() in ("off", "false", "0"):
+        return None
+    return path
+
+
+class Span:
+    """One timed stage. Set bytes/rows (or any other JSON value) with set()."""
+
+    def __init__(self, stage: str, labels: Dict[str, object]):
+        self.stage = stage
+        self.fields: Dict[str, object] = dict(labels)
+
+    def set(self, **fields) -> None:
+        self.fields.update(fields)
+
+    def add(self, **fields) -> None:
+        """Add numeric fields to their current value (e.g. bytes of several chunks)."""
+        for name, value in fields.items():
+            self.fields[name] = self.fields.get(name, 0) + value
+
+
+_lock = threading.Lock()
+# Context variables rather than thread-locals: every thread and every greenlet (the report pages
+# driven from one thread) has its own context, so their spans don't nest inside each other
+_labels: ContextVar[Dict[str, object]] = ContextVar("span_labels", default={})
+_stack: ContextVar[Tuple[Span, ...]] = ContextVar("span_stack", default=())
+_run: Optional[Dict[str, object]] = None
+
+
+def start_run(kind: str = "sync") -> str:
+    """Start collecting spans for a new run and return its ID."""
+    global _run
+    with _lock:
+        _run = {
+            "run_id": uuid.uuid4().hex[:12],
+            "kind": kind,
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "t0": time.perf_counter(),
+            "rss_max": current_rss_bytes(),
+            "spans": [],
+        }
+        return _run["run_id"]
+
+
+@contextmanager
+def span(stage: str, **labels) -> Iterator[Span]:
+    """Time a stage. Spans outside start_run()/finish_run() are measured but not recorded.
+
+    rss_mb is the larger of the RSS samples at start and end and rss_delta_mb their difference
+    (what the stage kept). children_rss_mb is set when a child process finished during the stage
+    with a higher peak than any before, as the parse pool's workers do.
+    """
+    rss_start, children_start = current_rss_bytes(), children_peak_rss_bytes()
+    parent = _labels.get()
+    current = Span(stage, {**parent, **labels})
+    labels_token = _labels.set({**parent, **labels})
+    stack_token = _stack.set(_stack.get() + (current,))
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield current
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _labels.reset(labels_token)
+        _stack.reset(stack_token)
+        wall_s = time.perf_counter() - start
+        with _lock:
+            run = _run
+            if run is not None:
+                rss_end, children_end = current_rss_bytes(), children_peak_rss_bytes()
+                memory: Dict[str, object] = {}
+                if rss_start is not None and rss_end is not None:
+                    memory = {"rss_mb": _mb(max(rss_start, rss_end)), "rss_delta_mb": _mb(rss_end - rss_start)}
+                    run["rss_max"] = max(run["rss_max"] or 0, rss_start, rss_end)
+                if children_end and children_end > (children_start or 0):
+                    memory["children_rss_mb"] = _mb(children_end)
+                run["spans"].append({
+                    "stage": stage,
+                    "start_s": round(start - run["t0"], 3),
+                    "wall_s": round(wall_s, 4),
+                    "status": status,
+                    "thread": threading.current_thread().name,
+                    **memory,
+                    **{k: round(v, 4) if isinstance(v, float) else v for k, v in current.fields.items()},
+                })
+
+
+def current_span() -> Span:
+    """Innermost open span of this thread or greenlet (a throwaway one if there is none)."""
+    stack = _stack.get()
+    return stack[-1] if stack else Span("", {})
+
+
+def finish_run(status: str = "ok", **fields) -> Optional[Dict[str, object]]:
+    """Close the current run, append its record to metrics_path() and return it."""
+    global _run
+    with _lock:
+        run, _run = _run, None
+    if run is None:
+        return None
+    rss = current_rss_bytes()
+    if rss is not None:
+        run["rss_max"] = max(run["rss_max"] or 0, rss)
+    record = {
+        "run_id": run["run_id"],
+        "kind": run["kind"],
+        "started": run["started"],
+        "total_s": round(time.perf_counter() - run["t0"], 3),
+        "status": status,
+        # Largest RSS sampled during this run (not the process' lifetime peak, which in daemon mode only grows)
+        "rss_mb": _mb(run["rss_max"]),
+        **fields,
+        "spans": run["spans"],
+    }
+    path = metrics_path()
+    if path:
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+        except OSError as e:
+            print(f"[metrics] No se pudo escribir {path}: {e}")
+    return record
+
+
+def load_runs(path: str, last: Optional[int] = None) -> List[Dict[str, object]]:
+    """Read run records from a JSON-lines file, skipping unreadable lines."""
+    runs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                runs.append(json.loads(line))
+            except ValueError:
+                continue
+    return runs[-last:] if last else runs
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = max(1, int(-(-pct * len(ordered) // 100)))
+    return ordered[rank - 1]
+
+
+def _rss_mb(record: Dict[str, object]) -> Optional[float]:
+    # Records written before rss_mb carry the process' lifetime peak_rss_mb instead
+    return record.get("rss_mb", record.get("peak_rss_mb"))
+
+
+def summarize(runs: List[Dict[str, object]]) -> List[Dict[str, object]]:
+    """Per-stage p50/p95/max of wall time plus median bytes/rows, max RSS and max RSS growth."""
+    by_stage: Dict[str, List[Dict[str, object]]] = {}
+    for run in runs:
+        by_stage.setdefault("(run)", []).append({"wall_s": run.get("total_s", 0), "rss_mb": _rss_mb(run)})
+        for s in run.get("spans", []):
+            by_stage.setdefault(s["stage"], []).append(s)
+    summary = []
+    for stage, spans in by_stage.items():
+        walls = [s["wall_s"] for s in spans]
+        sizes = [s["bytes"] for s in spans if s.get("bytes")]
+        rows = [s["rows"] for s in spans if s.get("rows")]
+        rss = [_rss_mb(s) for s in spans if _rss_mb(s)]
+        growth = [s["rss_delta_mb"] for s in spans if s.get("rss_delta_mb") is not None]
+        summary.append({
+            "stage": stage,
+            "n": len(spans),
+            "errors": sum(1 for s in spans if s.get("status") == "error"),
+            "p50_s": _percentile(walls, 50),
+            "p95_s": _percentile(walls, 95),
+            "max_s": max(walls),
+            "p50_mb": _percentile(sizes, 50) / 2**20 if sizes else None,
+            "p50_rows": _percentile(rows, 50) if rows else None,
+            "max_rss_mb": max(rss) if rss else None,
+            "max_growth_mb": max(growth) if growth else None,
+        })
+    summary.sort(key=lambda r: -r["p95_s"])
+    return summary
+
+
+def _fmt(value, spec: str) -> str:
+    return "-" if value is None else format(value, spec)
+
+
+def main(argv: List[str]) -> int:
+    args = list(argv)
+    last = None
+    if "--last" in args:
+        i = args.index("--last")
+        last = int(args[i + 1])
+        del args[i:i + 2]
+    path = args[0] if args else metrics_path()
+    if not path or not os.path.isfile(path):
+        print(f"No hay registros de ejecución en {path}")
+        return 1
+    runs = load_runs(path, last)
+    if not runs:
+        print(f"No hay registros de ejecución en {path}")
+        return 1
+    failed = sum(1 for r in runs if r.get("status") != "ok")
+    print(f"{len(runs)} ejecuciones ({failed} con error) desde {runs[0].get('started')} en {path}")
+    print(f"{'etapa':<22}{'n':>5}{'err':>5}{'p50 s':>9}{'p95 s':>9}{'max s':>9}{'p50 MB':>9}{'p50 filas':>11}"
+          f"{'RSS MB':>9}{'+RSS MB':>9}")
+    for r in summarize(runs):
+        print(f"{r['stage']:<22}{r['n']:>5}{r['errors']:>5}{r['p50_s']:>9.2f}{r['p95_s']:>9.2f}{r['max_s']:>9.2f}"
+              f"{_fmt(r['p50_mb'], '.2f'):>9}{_fmt(r['p50_rows'], 'd'):>11}{_fmt(r['max_rss_mb'], '.0f'):>9}"
+              f"{_fmt(r['max_growth_mb'], '.0f'):>9}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
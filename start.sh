@@ -32,13 +32,21 @@ export GOOGLE_APPLICATION_CREDENTIALS=/tmp/google-credentials.json
 echo "✓ Credenciales de Google decodificadas"
 echo ""
 
-# Ejecutar el script principal
+# Ejecutar el script principal (SYNC_MODE=daemon: proceso permanente con horario interno)
 echo "Iniciando descarga automatizada..."
 echo ""
 
-python plex_downloader.py
+python plex_downloader.py &
+PID=$!
 
+# Reenviar SIGTERM/SIGINT al script para que termine la ejecución en curso y cierre limpio
+trap 'kill -TERM $PID 2>/dev/null' TERM INT
+wait $PID
 EXIT_CODE=$?
+if [ $EXIT_CODE -gt 128 ] && kill -0 $PID 2>/dev/null; then
+    wait $PID
+    EXIT_CODE=$?
+fi
 
 # Limpiar credenciales temporales
 rm -f /tmp/google-credentials.json
@@ -0,0 +1,569 @@
+"""Behaviour checks of the Plex → Drive sync, run offline with pytest.
+
+Drive is replaced by benchmark_merge's in-memory _FakeDrive or by LocalCsvStore, and the Plex
+export endpoint by a local HTTP server with recorded responses. Timing lives in benchmark_merge.py.
+
+    python -m pytest -q
+"""
+import contextlib
+import gzip
+import io
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import greenlet
+import pytest
+
+import google_drive_utils as gdu
+import plex_downloader as pd
+import run_metrics
+from benchmark_merge import PRODUCTION_HEADER, _FakeDrive, _legacy_clean_csv_line_breaks, make_rows, to_csv_text
+
+
+TODAY = datetime(2025, 11, 20)
+HISTORY_ROWS = 3000
+NEW_ROWS = 300
+
+# Settings the sync reads from the environment; tests start without any of them
+_SYNC_ENV = ("DRIVE_CACHE_DIR", "DRIVE_DATE_INDEX", "DRIVE_HISTORY_DB", "DRIVE_EXTRA_FORMATS", "DRIVE_PARTITION_MODE",
+             "DRIVE_DOWNLOAD_CHUNK_MB", "CSV_PARSE_WORKERS", "CSV_PARSE_PARALLEL_MIN_MB", "PLEX_REPORTS_FILE",
+             "PLEX_PRODUCTION_EXPORT_URL", "PLEX_PRODUCTION_EXPORT_BODY", "PLEX_SCRAP_EXPORT_URL",
+             "PLEX_SCRAP_EXPORT_BODY", "BACKFILL_DIR", "BACKFILL_MAX_PAGES")
+
+
+@pytest.fixture
+def patch(monkeypatch, tmp_path):
+    """monkeypatch with the sync's logs silenced, a clean environment and no files outside tmp_path.
+
+    Every test patches modules and settings through it, so all of it is undone when the test ends.
+    """
+    for name in _SYNC_ENV:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("SYNC_METRICS_FILE", "off")
+    monkeypatch.setenv("PLEX_SESSION_FILE", str(tmp_path / "plex-session.bin"))
+    monkeypatch.setattr(gdu, "_log", lambda msg: None)
+    monkeypatch.setattr(pd, "log", lambda msg: None)
+    return monkeypatch
+
+
+def fake_drive(patch, files):
+    """Replace google_drive_utils' Drive calls with a _FakeDrive holding files ({file_id: content})."""
+    drive = _FakeDrive(files)
+    for name, fn in drive.patches().items():
+        patch.setattr(gdu, name, fn)
+    return drive
+
+
+def count_calls(patch, name, returns_fn=False):
+    """Count the calls to google_drive_utils.<name>, or to the functions it returns with returns_fn=True."""
+    counter = SimpleNamespace(calls=0)
+    original = getattr(gdu, name)
+
+    def counted(fn):
+        def wrapper(*args, **kwargs):
+            counter.calls += 1
+            return fn(*args, **kwargs)
+        return wrapper
+
+    patch.setattr(gdu, name, (lambda *a, **kw: counted(original(*a, **kw))) if returns_fn else counted(original))
+    return counter
+
+
+def write_text(path, text):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
+    return str(path)
+
+
+def export_file(tmp_path, name, days_back, seed, rows=NEW_ROWS):
+    """Write a last-7-days export as Plex downloads it (with BOM) and return its path."""
+    return write_text(tmp_path / name, to_csv_text(make_rows(rows, TODAY - timedelta(days=days_back), 7, seed=seed),
+                                                   bom=True))
+
+
+def history_text(seed=1):
+    return to_csv_text(make_rows(HISTORY_ROWS, TODAY - timedelta(days=700), 700, seed=seed))
+
+
+def reference_merge(patch, before, new_path):
+    """Drive content after a plain full merge of new_path into `before` (no index, cache or store)."""
+    with patch.context() as m:
+        for name in ("DRIVE_DATE_INDEX", "DRIVE_CACHE_DIR", "DRIVE_HISTORY_DB"):
+            m.setenv(name, "off")
+        drive = fake_drive(m, {"bench": before})
+        gdu.update_drive_csv_file("bench", new_path, "Date")
+        return drive.files["bench"]
+
+
+# --- Merge ----------------------------------------------------------------------------------------
+
+def test_merge_parses_each_file_once_and_index_skips_history(patch, tmp_path):
+    patch.setenv("DRIVE_CACHE_DIR", str(tmp_path / "cache"))
+    new_path = export_file(tmp_path, "production.csv", 7, seed=2)
+    next_path = export_file(tmp_path, "production-next.csv", 6, seed=3)
+    drive = fake_drive(patch, {"bench": history_text()})
+    cleans = count_calls(patch, "_iter_clean_csv_lines")
+    keys = count_calls(patch, "_build_date_key_fn", returns_fn=True)
+
+    gdu.update_drive_csv_file("bench", new_path, "Date")
+    assert (cleans.calls, keys.calls) == (2, HISTORY_ROWS + NEW_ROWS)
+    after_cold, downloads = drive.files["bench"], drive.downloads
+
+    # Drive didn't change since our upload: the date index and the local copy skip the history
+    cleans.calls = keys.calls = 0
+    gdu.update_drive_csv_file("bench", next_path, "Date")
+    assert drive.downloads == downloads
+    assert (cleans.calls, keys.calls) == (1, NEW_ROWS)
+    assert drive.files["bench"] == reference_merge(patch, after_cold, next_path)
+
+    # The same export again changes no date and isn't uploaded
+    uploads = drive.uploads
+    gdu.update_drive_csv_file("bench", next_path, "Date")
+    assert drive.uploads == uploads
+
+
+def test_date_key_engine_matches_normalize_date_for_key():
+    values = [r[0] for r in make_rows(20000, datetime(2025, 11, 13), 7, seed=3)]
+    date_key = gdu._build_date_key_fn(values[:gdu._DATE_SNIFF_SAMPLE], True)
+    assert [date_key(v) for v in values] == [gdu._normalize_date_for_key(v, True) for v in values]
+
+
+def test_cleaner_matches_legacy_regex():
+    text = to_csv_text(make_rows(HISTORY_ROWS, datetime(2025, 1, 1), 300, seed=4))
+    assert "".join(gdu._iter_clean_csv_lines([text])) == _legacy_clean_csv_line_breaks(text)
+
+
+def test_parallel_parse_matches_serial(patch):
+    text = to_csv_text(make_rows(20000, datetime(2025, 1, 1), 300, seed=13, kind="scrap"), kind="scrap")
+    serial = gdu._read_csv_to_table(text)
+    serial_keys = gdu._table_date_keys(serial, "Report Date", True)
+    # Cuts that land inside multi-line cells and an unclosed quote at the end
+    tricky = text[:200000] + '"sin cerrar\n' + "a,b\n" * 1000
+    tricky_serial = gdu._read_csv_to_table(tricky)
+
+    patch.setenv("CSV_PARSE_WORKERS", "2")
+    patch.setenv("CSV_PARSE_PARALLEL_MIN_MB", "0")
+    parallel = gdu._read_csv_to_table(text, "Report Date", True)
+    assert (parallel.fieldnames, parallel.columns) == (serial.fieldnames, serial.columns)
+    assert parallel.date_keys.get(("Report Date", True)) == serial_keys
+    assert gdu._read_csv_to_table(tricky, "Report Date", True).columns == tricky_serial.columns
+
+
+@pytest.mark.parametrize("setting", ["", "  ", "8MB", "abc"])
+def test_numeric_settings_fall_back_when_empty_or_invalid(patch, setting):
+    patch.setenv("DRIVE_DOWNLOAD_CHUNK_MB", setting)
+    patch.setenv("CSV_PARSE_PARALLEL_MIN_MB", setting)
+    patch.setenv("CSV_PARSE_WORKERS", "4")
+    assert gdu._download_chunk_size() == 8 * 1024 * 1024
+    assert gdu._parse_workers(15 * 1024 * 1024) == 1
+    assert gdu._parse_workers(16 * 1024 * 1024) == 4
+
+
+def test_numeric_settings_are_read_when_used(patch):
+    patch.setenv("DRIVE_DOWNLOAD_CHUNK_MB", "0.5")
+    patch.setenv("CSV_PARSE_PARALLEL_MIN_MB", "1")
+    patch.setenv("CSV_PARSE_WORKERS", "4")
+    assert gdu._download_chunk_size() == 512 * 1024
+    assert gdu._parse_workers(2 * 1024 * 1024) == 4
+
+
+# --- Download -------------------------------------------------------------------------------------
+
+class _FlakyDownload:
+    """Stand-in for MediaIoBaseDownload that serves bytes in chunks and fails on chosen calls.
+
+    Like the real downloader, a failed call writes nothing and leaves the offset untouched.
+    """
+
+    def __init__(self, fd, data, chunk_size, fail_on=()):
+        self._fd, self._data, self._chunk_size = fd, data, chunk_size
+        self._fail_on = set(fail_on)
+        self.calls = 0
+        self.progress = 0
+
+    def next_chunk(self):
+        self.calls += 1
+        if self.calls in self._fail_on:
+            raise ConnectionResetError("connection reset by peer")
+        content = self._data[self.progress:self.progress + self._chunk_size]
+        self.progress += len(content)
+        self._fd.write(content)
+        return None, self.progress >= len(self._data)
+
+
+def test_download_resumes_after_connection_resets(patch, tmp_path):
+    text = to_csv_text(make_rows(HISTORY_ROWS, datetime(2025, 1, 1), 300, seed=9), bom=True)
+    data = text.encode("utf-8")
+    chunk_size = 16 * 1024
+    n_chunks = -(-len(data) // chunk_size)
+    with open(tmp_path / "download", "w+b") as fh:
+        downloader = _FlakyDownload(fh, data, chunk_size, {2, 3, n_chunks // 2 + 3, n_chunks + 2})
+        chunks = list(gdu._iter_downloaded_text(downloader, fh, max_retries=2, backoff_s=0))
+    expected = gdu._read_csv_to_table(text)
+    got = gdu._read_text_chunks_to_table(chunks)
+    assert downloader.calls == n_chunks + 4
+    assert (got.fieldnames, got.columns) == (expected.fieldnames, expected.columns)
+    assert max(len(chunk) for chunk in chunks) <= chunk_size
+
+
+# --- Local cache and sidecars ---------------------------------------------------------------------
+
+def test_drive_cache_is_off_unless_configured(patch):
+    assert gdu._drive_cache_path("bench") is None
+    patch.setenv("DRIVE_CACHE_DIR", "off")
+    assert gdu._drive_cache_path("bench") is None
+
+
+@pytest.mark.skipif(not hasattr(os, "geteuid"), reason="POSIX permissions")
+def test_drive_cache_requires_a_private_directory(patch, tmp_path):
+    cache_dir = tmp_path / "cache"
+    patch.setenv("DRIVE_CACHE_DIR", str(cache_dir))
+    assert gdu._drive_cache_path("bench") == str(cache_dir / "bench.pickle")
+    assert cache_dir.stat().st_mode & 0o777 == 0o700
+
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)
+    patch.setenv("DRIVE_CACHE_DIR", str(shared))
+    assert gdu._drive_cache_path("bench") is None
+
+
+def test_sidecar_is_not_published_without_csv_metadata(patch):
+    drive = fake_drive(patch, {"bench": history_text()})
+    assert gdu._publish_sidecar("bench", {}, "gzipFileId", "bench.csv.gz", io.BytesIO(b"x"), 1,
+                                "application/gzip") is None
+    assert drive.created == [] and "bench" not in drive.properties
+
+
+def test_sidecar_left_by_a_failed_run_is_reused(patch):
+    drive = fake_drive(patch, {"bench": history_text(), "bench.csv.gz": b"old"})
+    metadata = drive._metadata("bench")
+    assert gdu._publish_sidecar("bench", metadata, "gzipFileId", "bench.csv.gz", io.BytesIO(b"new"), 3,
+                                "application/gzip") == "bench.csv.gz"
+    assert drive.created == [] and drive.files["bench.csv.gz"] == b"new"
+    assert drive.properties["bench"] == {"gzipFileId": "bench.csv.gz"}
+
+
+def test_extra_formats_match_the_csv(patch, tmp_path):
+    patch.setenv("DRIVE_CACHE_DIR", str(tmp_path / "cache"))
+    patch.setenv("DRIVE_EXTRA_FORMATS", "gzip,parquet" if gdu.pa is not None else "gzip")
+    drive = fake_drive(patch, {"bench": history_text()})
+    # A full merge, then one through the date index
+    for step in range(2):
+        gdu.update_drive_csv_file("bench", export_file(tmp_path, f"production-{step}.csv", 7 - step, 2 + step), "Date")
+        csv_bytes = drive.files["bench"].encode("utf-8")
+        assert gzip.decompress(drive.files["bench.csv.gz"]) == csv_bytes
+        if gdu.pa is not None:
+            parquet = gdu.pq.read_table(io.BytesIO(drive.files["bench.parquet"]))
+            expected = gdu._read_csv_to_table(drive.files["bench"])
+            assert parquet.num_rows == len(expected) and not parquet.column("Date_date").null_count
+            assert parquet.column("Part No").to_pylist() == expected.column("Part No")
+            assert parquet.column("Revision").to_pylist() == expected.column("Revision")
+    # The second merge reuses the copies (and the date index) created by the first one
+    assert sorted(drive.created) == sorted(set(drive.created))
+
+
+# --- Partitioned sync -----------------------------------------------------------------------------
+
+class _FlakyCreateStore(gdu.LocalCsvStore):
+    """LocalCsvStore that gives every created file a new ID, like Drive, and fails creates after fail_after."""
+
+    def __init__(self, root_dir):
+        super().__init__(root_dir)
+        self.created = []
+        self.fail_after = 1
+
+    def create(self, name, text, sibling_file_id):
+        if self.fail_after is not None and len(self.created) >= self.fail_after:
+            raise ConnectionError("upload interrumpido")
+        self.created.append(name)
+        file_id = f"local-{len(self.created)}-{name}"
+        self.upload(file_id, text)
+        return file_id
+
+
+def test_split_history_then_partitioned_sync_matches_full_merge(patch, tmp_path):
+    history = history_text()
+    new_path = export_file(tmp_path, "production.csv", 7, seed=2)
+    store = gdu.LocalCsvStore(str(tmp_path / "drive"))
+    store.upload("history", history)
+
+    # A single-file history is not a manifest: the error points to the one-time split
+    with pytest.raises(RuntimeError, match="--split-history"):
+        gdu.update_drive_partitioned("history", new_path, "Date", "production", store=store)
+    manifest_id = gdu.split_drive_history("history", "Date", "production", store=store)
+    assert store.download("history") == history
+    with pytest.raises(RuntimeError, match="manifiesto"):
+        gdu.split_drive_history(manifest_id, "Date", "production", store=store)
+
+    gdu.update_drive_partitioned(manifest_id, new_path, "Date", "production", store=store)
+    manifest = json.loads(store.download(manifest_id))
+    partitioned = []
+    for entry in manifest["partitions"].values():
+        partitioned.extend(zip(*gdu._read_csv_to_table(store.download(entry["file_id"])).columns))
+    full, _ = gdu.merge_tables_by_date(gdu._read_csv_to_table(history), gdu._read_csv_file_to_table(new_path), "Date")
+    assert sorted(partitioned) == sorted(zip(*full.columns))
+
+
+def test_partitions_are_not_created_twice_after_a_failed_sync(patch, tmp_path):
+    future_path = write_text(tmp_path / "production.csv", to_csv_text(
+        make_rows(NEW_ROWS, TODAY + timedelta(days=20), 45, seed=4), bom=True))
+    store = _FlakyCreateStore(str(tmp_path / "drive"))
+    with pytest.raises(ConnectionError):
+        gdu.update_drive_partitioned("manifest", future_path, "Date", "production", store=store)
+    store.fail_after = None
+    gdu.update_drive_partitioned("manifest", future_path, "Date", "production", store=store)
+    manifest = json.loads(store.download("manifest"))
+    assert store.created == sorted(set(store.created))
+    assert len(store.created) == len(manifest["partitions"])
+
+
+# --- SQLite history store -------------------------------------------------------------------------
+
+def test_history_store_uploads_match_full_merge(patch, tmp_path):
+    db_path = str(tmp_path / "history.sqlite")
+    patch.setenv("DRIVE_CACHE_DIR", str(tmp_path / "cache"))
+    patch.setenv("DRIVE_HISTORY_DB", db_path)
+    drive = fake_drive(patch, {"bench": history_text()})
+    downloads = count_calls(patch, "download_csv_table")
+    # (step, days back of the export, seed, with a Shift column, expect a history download, expect an upload)
+    steps = [("initial load", 7, 2, False, True, True), ("store up to date", 6, 3, False, False, True),
+             ("new column", 5, 4, True, False, True), ("no changes", 5, 4, True, False, False),
+             ("edited in Drive", 4, 5, True, True, True)]
+    for step, (label, back, seed, shift, downloaded, uploaded) in enumerate(steps):
+        rows = [row + [str(i % 3 + 1)] * shift
+                for i, row in enumerate(make_rows(NEW_ROWS, TODAY - timedelta(days=back), 7, seed=seed))]
+        new_path = write_text(tmp_path / f"production-{step}.csv",
+                              to_csv_text(rows, header=PRODUCTION_HEADER + ["Shift"] * shift, bom=True))
+        if label == "edited in Drive":
+            # Someone edits the CSV by hand: the store no longer matches Drive and is reloaded
+            drive._upload("bench", drive.files["bench"] + '"01/01/2020, 06:00 AM",P00001,00,WC-1,1,,1\n')
+        before, version = drive.files["bench"], drive.versions["bench"]
+        downloads.calls = 0
+        gdu.update_drive_csv_file("bench", new_path, "Date", report="production")
+        assert (bool(downloads.calls), drive.versions["bench"] != version) == (downloaded, uploaded), label
+        if uploaded:
+            assert drive.files["bench"] == reference_merge(patch, before, new_path), label
+
+    (info,) = gdu.HistoryStore(db_path).reports()
+    expected = gdu._read_csv_to_table(drive.files["bench"])
+    assert (info["rows"], info["fieldnames"]) == (len(expected), expected.fieldnames)
+
+
+def test_locked_history_store_falls_back_to_plain_merge(patch, tmp_path):
+    db_path = str(tmp_path / "history.sqlite")
+    patch.setenv("DRIVE_CACHE_DIR", str(tmp_path / "cache"))
+    patch.setenv("DRIVE_HISTORY_DB", db_path)
+    drive = fake_drive(patch, {"bench": history_text()})
+    gdu.update_drive_csv_file("bench", export_file(tmp_path, "production-0.csv", 7, 2), "Date", report="production")
+
+    def locked(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    patch.setattr(gdu.HistoryStore, "iter_batches", locked)
+    new_path = export_file(tmp_path, "production-1.csv", 6, 3)
+    before = drive.files["bench"]
+    gdu.update_drive_csv_file("bench", new_path, "Date", report="production")
+    assert drive.files["bench"] == reference_merge(patch, before, new_path)
+    assert gdu.HistoryStore(db_path).state("production")["md5"] != drive._metadata("bench")["md5Checksum"]
+
+
+# --- Plex export ----------------------------------------------------------------------------------
+
+# Recorded responses of the Plex export endpoint: the login page is what it returns once the session expired
+_PLEX_LOGIN_HTML = (b'<!DOCTYPE html>\r\n<html lang="en"><head><title>Plex - Sign In</title></head>'
+                    b'<body><form method="post"><input id="inputUsername" name="username">'
+                    b'<input id="inputPassword3" name="password" type="password"></form></body></html>')
+_COOKIES = [{"name": "PlexSession", "value": "abc123"}, {"name": "XSRF", "value": "t0k"}]
+
+
+class _ExportHandler(BaseHTTPRequestHandler):
+    """Local stand-in for the Plex export endpoint; records every request on the server."""
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.server.requests.append({"path": self.path, "method": self.command, "cookie": self.headers.get("Cookie"),
+                                     "content_type": self.headers.get("Content-Type"),
+                                     "body": self.rfile.read(length).decode("utf-8") if length else None})
+        route = self.path.split("?")[0]
+        status, content_type, data = {
+            "/export": (200, "text/csv; charset=utf-8", self.server.csv_bytes),
+            "/login": (200, "text/html; charset=utf-8", _PLEX_LOGIN_HTML),
+            "/login-as-csv": (200, "application/octet-stream", _PLEX_LOGIN_HTML),
+            "/error": (500, "text/plain", b"Internal Server Error"),
+            "/truncated": (200, "text/csv", self.server.csv_bytes),
+        }[route]
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        # /truncated announces the whole file but drops the connection halfway
+        self.wfile.write(data[:len(data) // 2] if route == "/truncated" else data)
+
+    do_GET = do_POST = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+class _FakeReportPage:
+    """Records the Playwright calls of the UI export; its download saves csv_bytes."""
+
+    def __init__(self, csv_bytes, cookies):
+        self.calls = []
+        self.csv_bytes = csv_bytes
+        self.context = SimpleNamespace(cookies=lambda url=None: cookies)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name,) + args)
+
+    def _save_as(self, path):
+        with open(path, "wb") as f:
+            f.write(self.csv_bytes)
+
+    @contextlib.contextmanager
+    def expect_download(self, timeout=None):
+        self.calls.append(("expect_download",))
+        yield SimpleNamespace(value=SimpleNamespace(save_as=self._save_as))
+
+    @contextlib.contextmanager
+    def expect_response(self, predicate, timeout=None):
+        self.calls.append(("expect_response",))
+        yield SimpleNamespace(value=None)
+
+
+@pytest.fixture
+def plex():
+    """Local Plex export endpoint serving a production export; .url(route) and .requests"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ExportHandler)
+    server.csv_bytes = to_csv_text(make_rows(NEW_ROWS, TODAY - timedelta(days=7), 7, seed=21), bom=True,
+                                   lineterminator="\r\n").encode("utf-8")
+    server.requests = []
+    server.url = lambda route: f"http://127.0.0.1:{server.server_address[1]}{route}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("route", ["/login", "/login-as-csv", "/error", "/truncated"])
+def test_invalid_export_response_keeps_the_previous_file(patch, plex, tmp_path, route):
+    filepath = str(tmp_path / "production.csv")
+    write_text(filepath, "previous export\n")
+    with pytest.raises(Exception):
+        pd.export_via_http(plex.url(route), _COOKIES, filepath)
+    assert _read(filepath) == b"previous export\n"
+    assert not os.path.exists(filepath + ".part")
+
+
+def test_export_via_http_saves_the_csv_with_the_page_cookies(patch, plex, tmp_path):
+    filepath = str(tmp_path / "production.csv")
+    write_text(filepath, "previous export\n")
+    pd.export_via_http(plex.url("/export"), _COOKIES, filepath)
+    assert _read(filepath) == plex.csv_bytes
+    assert not os.path.exists(filepath + ".part")
+    assert plex.requests[0]["cookie"] == "PlexSession=abc123; XSRF=t0k"
+
+
+def test_export_fast_fills_in_the_dates(patch, plex, tmp_path):
+    filepath = str(tmp_path / "production.csv")
+    patch.setenv("PLEX_PRODUCTION_EXPORT_URL", plex.url("/export?from=$start_date&to=$end_date"))
+    patch.setenv("PLEX_PRODUCTION_EXPORT_BODY", '{"begin": "$start_date", "end": "$end_date"}')
+    page = _FakeReportPage(plex.csv_bytes, _COOKIES)
+    assert pd.export_fast(page, "production", filepath, (datetime(2024, 3, 1), datetime(2024, 3, 31)))
+    request = plex.requests[-1]
+    assert (request["method"], request["path"], request["body"], request["content_type"]) == (
+        "POST", "/export?from=03/01/2024&to=03/31/2024", '{"begin": "03/01/2024", "end": "03/31/2024"}',
+        "application/json")
+    assert _read(filepath) == plex.csv_bytes
+
+
+def test_export_fast_needs_both_date_placeholders(patch, plex, tmp_path):
+    # Without $start_date/$end_date every run would export the range fixed when the request was recorded
+    patch.setenv("PLEX_PRODUCTION_EXPORT_URL", plex.url("/export?from=11/01/2025&to=11/07/2025"))
+    patch.setenv("PLEX_PRODUCTION_EXPORT_BODY", '{"begin": "$start_date"}')
+    page = _FakeReportPage(plex.csv_bytes, _COOKIES)
+    assert not pd.export_fast(page, "production", str(tmp_path / "production.csv"))
+    assert plex.requests == []
+
+
+def test_export_report_falls_back_to_the_ui(patch, plex, tmp_path):
+    filepath = str(tmp_path / "production.csv")
+    write_text(filepath, "previous export\n")
+    _, reports = pd.load_report_registry(pd.REPORTS_FILE)
+    report = next(r for r in reports if r["name"] == "production")
+    # Expired session: the direct export gets the login page
+    patch.setenv("PLEX_PRODUCTION_EXPORT_URL", plex.url("/login?from=$start_date&to=$end_date"))
+    page = _FakeReportPage(plex.csv_bytes, _COOKIES)
+    pd.export_report(page, report, filepath)
+    assert plex.requests[-1]["path"].startswith("/login?from=")
+    called = [call[0] for call in page.calls]
+    assert called[:13] == ["goto", "wait_for_selector", "click", "select_option", "wait_for_selector", "evaluate",
+                           "wait_for_selector", "fill", "click", "wait_for_selector", "click", "expect_download",
+                           "click"]
+    assert page.calls[0][1] == report["url"]
+    assert _read(filepath) == plex.csv_bytes
+
+
+def test_backfill_refuses_reports_without_a_usable_export_request(patch):
+    patch.setenv("PLEX_USERNAME", "user")
+    patch.setenv("PLEX_PASSWORD", "secret")
+    patch.setenv("PLEX_PRODUCTION_EXPORT_URL", "https://plex.invalid/export?from=$start_date&to=$end_date")
+    patch.setenv("PLEX_SCRAP_EXPORT_URL", "https://plex.invalid/export?from=11/01/2025&to=11/07/2025")
+    patch.setattr(pd, "sync_playwright", lambda: pytest.fail("backfill started the browser"))
+    with pytest.raises(RuntimeError, match=r"\$start_date and \$end_date for: scrap$"):
+        pd.backfill(datetime(2024, 1, 1), datetime(2024, 3, 31))
+
+
+# --- Plex session ---------------------------------------------------------------------------------
+
+class _SignInPage:
+    def __init__(self, signed_out):
+        self.signed_out = signed_out
+
+    def locator(self, selector):
+        assert selector == pd.SIGN_IN_SELECTOR
+        return SimpleNamespace(count=lambda: int(self.signed_out))
+
+
+@pytest.mark.parametrize("signed_out", [True, False])
+def test_saved_session_is_discarded_only_on_the_sign_in_page(patch, signed_out):
+    pd.save_session_state({"cookies": []}, "secret")
+    path = os.environ["PLEX_SESSION_FILE"]
+    assert os.path.isfile(path)
+    assert pd.forget_session_if_signed_out(_SignInPage(signed_out)) is signed_out
+    assert os.path.isfile(path) is not signed_out
+
+
+# --- Run metrics ----------------------------------------------------------------------------------
+
+def test_spans_of_report_pages_on_one_thread_stay_separate(patch):
+    main = greenlet.getcurrent()
+
+    def page(report):
+        with run_metrics.span("export", report=report):
+            with run_metrics.span("plex_search"):
+                main.switch()  # the other page runs while this one waits on the browser
+                run_metrics.current_span().set(page=report)
+
+    run_metrics.start_run("test")
+    pages = [greenlet.greenlet(page) for _ in range(2)]
+    for worker, report in zip(pages, ("production", "scrap")):
+        worker.switch(report)
+    for worker in pages:
+        worker.switch()
+    spans = run_metrics.finish_run()["spans"]
+    assert [(s["stage"], s["report"], s.get("page")) for s in spans] == [
+        ("plex_search", "production", "production"), ("export", "production", None),
+        ("plex_search", "scrap", "scrap"), ("export", "scrap", None)]
+    assert run_metrics.current_span().stage == ""